@@ -4,6 +4,7 @@ from dash import html
 import geopandas as gpd
 import pandas as pd
 
+from hidromet import armazenamento
 from hidromet import config
 from hidromet import visualizacao
 from hidromet import utils
@@ -12,7 +13,9 @@ from hidromet import utils
 contornos = config.dir_contorno
 dir_series_concatenadas = config.dir_prec_concat
 info_bacias = list(dir_series_concatenadas.glob("*.json"))
-series = list(dir_series_concatenadas.glob("*_sout.csv"))
+series = list(dir_series_concatenadas.glob("*_sout.parquet"))
+if not series:
+    series = list(dir_series_concatenadas.glob("*_sout.csv"))
 
 #abrindo arquivos com postos
 bacias = list()
@@ -31,12 +34,15 @@ crs = gdf_contornos.crs
 #abrindo arquivos de series
 df_series = list()
 for serie in series:
-    df = pd.read_csv(serie)
+    if serie.suffix == ".parquet":
+        df = armazenamento.ler_series(serie)
+        df.index = df.index.strftime("%Y-%m-%d")
+    else:
+        df = pd.read_csv(serie, index_col=0)
     df_series.append(df)
 
 series_concatenadas = pd.concat(df_series, axis=1)
-series_concatenadas.rename(columns={"Unnamed: 0": "time"}, inplace=True)
-series_concatenadas.set_index("time", inplace=True)
+series_concatenadas.index.name = "time"
 falhas = round(series_concatenadas.isna().sum()/len(series_concatenadas),2)*100
 
 df_postos = df_postos.assign(falhas=falhas)  
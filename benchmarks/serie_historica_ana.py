@@ -0,0 +1,122 @@
+"""
+Benchmark do parser do HidroSerieHistorica da ANA.
+
+Compara o parser em fluxo (`hidromet.ANA.parsear_serie_historica`) com a
+implementação anterior, que montava um dataframe por mês, sobre uma resposta
+sintética de chuva com vários anos de dados.
+
+Uso:
+    python benchmarks/serie_historica_ana.py [anos] [repeticoes]
+"""
+import calendar
+import sys
+import time
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import pandas as pd
+
+from hidromet.ANA import parsear_serie_historica
+
+
+def gerar_resposta(anos: int, inicio: int = 1980) -> bytes:
+    """Gera uma resposta XML sintética no formato do HidroSerieHistorica."""
+    rng = np.random.default_rng(0)
+    meses = []
+    for ano in range(inicio, inicio + anos):
+        for mes in range(1, 13):
+            dias = calendar.monthrange(ano, mes)[1]
+            chuvas = "".join(
+                f"<Chuva{dia:02}>{rng.gamma(0.5, 8):.1f}</Chuva{dia:02}>"
+                if dia <= dias
+                else f"<Chuva{dia:02} />"
+                for dia in range(1, 32)
+            )
+            meses.append(
+                f'<SerieHistorica diffgr:id="SerieHistorica{len(meses) + 1}">'
+                "<EstacaoCodigo>2549017</EstacaoCodigo>"
+                "<NivelConsistencia>2</NivelConsistencia>"
+                f"<DataHora>{ano}-{mes:02}-01 07:30:00</DataHora>"
+                f"{chuvas}</SerieHistorica>"
+            )
+
+    corpo = "".join(meses)
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        '<DataTable xmlns="http://MRCS/">'
+        '<diffgr:diffgram xmlns:diffgr="urn:schemas-microsoft-com:xml-diffgram-v1">'
+        f'<DocumentElement xmlns="">{corpo}</DocumentElement>'
+        "</diffgr:diffgram></DataTable>"
+    ).encode()
+
+
+def parser_anterior(conteudo: bytes, cod_estacao: str) -> pd.DataFrame:
+    """Implementação anterior de `ANA.obter_chuva`, mantida como referência."""
+    root = ET.ElementTree(ET.fromstring(conteudo)).getroot()
+
+    df_mes = list()
+    for mes in root.iter("SerieHistorica"):
+        # sem dayfirst: a partir do pandas 2 ele também é aplicado a datas ISO
+        primeiro_dia_mes = pd.to_datetime(mes.find("DataHora").text)
+        ultimo_dia_mes = calendar.monthrange(
+            primeiro_dia_mes.year, primeiro_dia_mes.month
+        )[1]
+        lista_dias_mes = pd.date_range(
+            primeiro_dia_mes, periods=ultimo_dia_mes, freq="D"
+        ).tolist()
+
+        dados, datas = [], []
+        for i in range(len(lista_dias_mes)):
+            datas.append(lista_dias_mes[i])
+            dado = mes.find("Chuva{:02}".format(i + 1)).text
+            dados.append(dado)
+        df_mes.append(pd.DataFrame({cod_estacao: dados}, index=datas))
+
+    serie = pd.concat(df_mes)
+    serie.sort_index(inplace=True)
+    serie[cod_estacao] = pd.to_numeric(serie[cod_estacao])
+
+    return serie
+
+
+def parser_novo(conteudo: bytes, cod_estacao: str) -> pd.DataFrame:
+    """Parser em fluxo utilizado atualmente por `ANA.obter_chuva`."""
+    datas, valores, _ = parsear_serie_historica(conteudo, prefixo="Chuva")
+    return pd.DataFrame({cod_estacao: valores}, index=pd.DatetimeIndex(datas))
+
+
+def cronometrar(funcao, *args, repeticoes: int = 3) -> float:
+    """Retorna o menor tempo de execução, em segundos."""
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao(*args)
+        tempos.append(time.perf_counter() - inicio)
+    return min(tempos)
+
+
+if __name__ == "__main__":
+    anos = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    repeticoes = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+
+    conteudo = gerar_resposta(anos)
+    print(f"resposta sintética: {anos} anos, {len(conteudo) / 1e6:.1f} MB")
+
+    anterior = parser_anterior(conteudo, "posto")
+    novo = parser_novo(conteudo, "posto")
+    pd.testing.assert_series_equal(
+        anterior["posto"],
+        novo["posto"],
+        check_index_type=False,
+        check_freq=False,
+        check_index=False,
+    )
+    np.testing.assert_array_equal(
+        anterior.index.normalize().values.astype("datetime64[D]"),
+        novo.index.values.astype("datetime64[D]"),
+    )
+
+    t_anterior = cronometrar(parser_anterior, conteudo, "posto", repeticoes=repeticoes)
+    t_novo = cronometrar(parser_novo, conteudo, "posto", repeticoes=repeticoes)
+    print(f"anterior: {t_anterior:.3f} s")
+    print(f"novo:     {t_novo:.3f} s ({t_anterior / t_novo:.1f}x)")
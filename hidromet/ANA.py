@@ -1,36 +1,338 @@
 """Módulo para obtenção de dados da Agência Nacional das Águas."""
 
-import calendar
+import io
+import os
+import time
 import xml.etree.ElementTree as ET
 
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
 from typing import Union
 
 import numpy as np
 import pandas as pd
 import requests
 
+from hidromet import config
+from hidromet import requisicoes
+from hidromet.cache import CacheRespostas
+
+
+# campos do inventário: {coluna: (tag, tipo)}
+campos_inventario = {
+    "latitude": ("Latitude", "float"),
+    "longitude": ("Longitude", "float"),
+    "altitude": ("Altitude", "float"),
+    "codigo": ("Codigo", "texto"),
+    "nome": ("Nome", "texto"),
+    "estado": ("nmEstado", "texto"),
+    "municipio": ("nmMunicipio", "texto"),
+    "responsavel": ("ResponsavelSigla", "texto"),
+    "ultima_att": ("UltimaAtualizacao", "data"),
+    "tipo": ("TipoEstacao", "inteiro"),
+    "data_ins": ("DataIns", "data"),
+    "data_alt": ("DataAlt", "data"),
+}
+# campos do inventário exclusivos de postos telemétricos
+campos_telemetria = {
+    "inicio_telemetria": ("PeriodoTelemetricaInicio", "data"),
+    "fim_telemetria": ("PeriodoTelemetricaFim", "data"),
+}
+
+
+def _nome_local(tag: str) -> str:
+    """Remove o namespace de uma tag XML."""
+    return tag.rsplit("}", 1)[-1]
+
+
+def parsear_serie_historica(
+    conteudo: bytes, prefixo: str, campos_mensais: Optional[Dict[str, str]] = None
+) -> Tuple[np.ndarray, np.ndarray, Dict[str, np.ndarray]]:
+    """
+    Converte a resposta XML do HidroSerieHistorica em arrays diários.
+
+    O XML é lido em fluxo, mês a mês, e os valores diários de cada mês são
+    acumulados em listas convertidas em arrays uma única vez ao final, sem
+    criar um dataframe por mês.
+
+    Parameters
+    ----------
+    conteudo : bytes
+        Corpo da resposta do serviço.
+
+    prefixo : str
+        Prefixo das tags diárias, de acordo com o tipoDados requisitado
+        ("Chuva", "Vazao" ou "Cota").
+
+    campos_mensais : Optional[Dict[str, str]]
+        Mapeamento {nome de saída: tag} de campos mensais a serem repetidos
+        para cada dia do mês.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray, Dict[str, np.ndarray]]
+        Datas diárias ordenadas (datetime64[D]), valores diários (float) e os
+        campos mensais expandidos para cada dia.
+    """
+    campos_mensais = campos_mensais or {}
+    tags_dias = {f"{prefixo}{dia:02}": dia - 1 for dia in range(1, 32)}
+
+    tags_mensais = {tag: nome for nome, tag in campos_mensais.items()}
+    inicio_meses, linhas = list(), list()
+    textos_mensais: Dict[str, List[Optional[str]]] = {
+        nome: list() for nome in campos_mensais
+    }
+
+    for _, elemento in ET.iterparse(io.BytesIO(conteudo), events=("end",)):
+        if _nome_local(elemento.tag) != "SerieHistorica":
+            continue
+
+        linha = np.full(31, np.nan)
+        textos = dict.fromkeys(campos_mensais)
+        inicio = None
+        for filho in elemento:
+            tag = _nome_local(filho.tag)
+            texto = filho.text
+            if tag in tags_dias:
+                if texto:
+                    linha[tags_dias[tag]] = float(texto)
+            elif tag == "DataHora":
+                data = texto.strip()[:10]
+                if "/" in data:
+                    dia, mes, ano = data.split("/")
+                    data = f"{ano}-{mes}-{dia}"
+                inicio = data
+            elif tag in tags_mensais:
+                textos[tags_mensais[tag]] = texto
+
+        elemento.clear()
+        inicio_meses.append(inicio)
+        linhas.append(linha)
+        for nome, texto in textos.items():
+            textos_mensais[nome].append(texto)
+
+    inicio_meses = np.array(inicio_meses, dtype="datetime64[D]")
+    valores_meses = np.array(linhas).reshape(-1, 31)
+
+    mes = inicio_meses.astype("datetime64[M]")
+    dias_no_mes = (
+        (mes + 1).astype("datetime64[D]") - mes.astype("datetime64[D]")
+    ).astype(int)
+    validos = np.arange(31) < dias_no_mes[:, None]
+
+    datas = (inicio_meses[:, None] + np.arange(31))[validos]
+    valores = valores_meses[validos]
+    mensais = {
+        nome: np.repeat(np.array(textos, dtype=object), dias_no_mes)
+        for nome, textos in textos_mensais.items()
+    }
+
+    ordem = np.argsort(datas, kind="stable")
+
+    return (
+        datas[ordem],
+        valores[ordem],
+        {nome: campo[ordem] for nome, campo in mensais.items()},
+    )
+
+
+def _converter_coluna(valores: List[Optional[str]], tipo: str) -> Any:
+    """Converte uma coluna de textos do inventário para o seu tipo."""
+    valores = np.array(valores, dtype=object)
+    if tipo == "float":
+        return pd.to_numeric(valores, errors="coerce").astype(float)
+    if tipo == "inteiro":
+        return pd.array(pd.to_numeric(valores, errors="coerce"), dtype="Int64")
+    if tipo == "data":
+        return pd.to_datetime(valores, errors="coerce")
+    return valores
+
+
+def parsear_inventario(conteudo: bytes, telemetrica: bool = True) -> pd.DataFrame:
+    """
+    Converte a resposta XML do HidroInventario em um dataframe tipado.
+
+    O XML é lido em fluxo e cada campo é acumulado em uma coluna, de forma que
+    o dataframe é montado uma única vez ao final.
+
+    Parameters
+    ----------
+    conteudo : bytes
+        Corpo da resposta do serviço.
+
+    telemetrica : bool
+        Caso os campos de período telemétrico devam ser incluídos.
+
+    Returns
+    -------
+    pd.DataFrame
+        Inventário de postos indexado e ordenado pelo código.
+    """
+    campos = {**campos_inventario, **(campos_telemetria if telemetrica else {})}
+    colunas_tags = {tag: coluna for coluna, (tag, _) in campos.items()}
+    colunas: Dict[str, List[Optional[str]]] = {coluna: [] for coluna in campos}
+
+    for _, elemento in ET.iterparse(io.BytesIO(conteudo), events=("end",)):
+        if _nome_local(elemento.tag) != "Table":
+            continue
+
+        valores = dict()
+        for filho in elemento:
+            coluna = colunas_tags.get(_nome_local(filho.tag))
+            if coluna is not None:
+                valores[coluna] = filho.text
+        for coluna, lista in colunas.items():
+            lista.append(valores.get(coluna))
+
+        elemento.clear()
+
+    inventario = pd.DataFrame(
+        {
+            coluna: _converter_coluna(colunas[coluna], tipo)
+            for coluna, (_, tipo) in campos.items()
+        }
+    )
+    inventario.set_index("codigo", inplace=True)
+    inventario.sort_index(inplace=True)
+
+    return inventario
+
+
+def buscar_por_codigo(inventario: pd.DataFrame, codigos: List[str]) -> pd.DataFrame:
+    """
+    Seleciona postos do inventário pelos códigos.
+
+    Parameters
+    ----------
+    inventario : pd.DataFrame
+        Inventário indexado e ordenado pelo código.
+
+    codigos : List[str]
+        Códigos dos postos desejados. Códigos ausentes no inventário são
+        ignorados.
+
+    Returns
+    -------
+    pd.DataFrame
+        Postos encontrados.
+    """
+    return inventario.loc[inventario.index.intersection(codigos)]
+
+
+def buscar_por_area(
+    inventario: pd.DataFrame,
+    lon_min: float,
+    lat_min: float,
+    lon_max: float,
+    lat_max: float,
+) -> pd.DataFrame:
+    """
+    Seleciona os postos do inventário dentro de um retângulo de coordenadas.
+
+    Parameters
+    ----------
+    inventario : pd.DataFrame
+        Inventário com as colunas latitude e longitude.
+
+    lon_min, lat_min, lon_max, lat_max : float
+        Limites do retângulo, em graus.
+
+    Returns
+    -------
+    pd.DataFrame
+        Postos dentro do retângulo.
+    """
+    latitude = inventario["latitude"].to_numpy()
+    longitude = inventario["longitude"].to_numpy()
+    dentro = (
+        (longitude >= lon_min)
+        & (longitude <= lon_max)
+        & (latitude >= lat_min)
+        & (latitude <= lat_max)
+    )
+    return inventario.loc[dentro]
+
 
 class ANA:
     """Classe de requisições da API da ANA."""
 
     url_base = "http://telemetriaws1.ana.gov.br/ServiceANA.asmx"
 
-    def __init__(self) -> None:
-        """Inicialização da classe de consumo da API."""
-        pass
+    def __init__(
+        self,
+        sessao: Optional[requests.Session] = None,
+        cache: Optional[CacheRespostas] = None,
+    ) -> None:
+        """
+        Inicialização da classe de consumo da API.
+
+        Parameters
+        ----------
+        sessao : Optional[requests.Session]
+            Sessão HTTP compartilhada entre as requisições. Caso não seja passada,
+            é criada uma sessão com pool de conexões e novas tentativas.
+
+        cache : Optional[CacheRespostas]
+            Cache em disco das respostas. Caso não seja passado, todas as
+            requisições são feitas ao servidor.
+        """
+        self.sessao = sessao or requisicoes.criar_sessao()
+        self.cache = cache
+
+    def _requisitar(self, endpoint: str, url_requisicao: str) -> bytes:
+        """
+        Faz uma requisição GET pela sessão da classe, passando pelo cache.
+
+        Parameters
+        ----------
+        endpoint : str
+            Nome do endpoint requisitado.
+
+        url_requisicao : str
+            Url completa da requisição.
+
+        Returns
+        -------
+        bytes
+            Conteúdo da resposta.
+        """
+        if self.cache is not None:
+            conteudo = self.cache.obter(endpoint, url_requisicao)
+            if conteudo is not None:
+                return conteudo
+
+        resposta = self.sessao.get(url_requisicao, timeout=requisicoes.timeout)
+        resposta.raise_for_status()
+
+        if self.cache is not None:
+            self.cache.salvar(endpoint, url_requisicao, resposta.content)
+
+        return resposta.content
 
-    @classmethod
     def inventario(
         self,
         codigo: str = "",
         tipoest: Union[str, int] = "",
         telemetrica: Union[str, int] = 1,
+        validade: float = 7,
+        atualizar: bool = False,
     ) -> pd.DataFrame:
         """
         Obtém o inventário de postos da ANA.
 
         Obs: Caso nenhum parâmetro seja passado, será retornado o inventário completo.
 
+        O inventário de cada combinação de parâmetros é salvo como um snapshot
+        parquet em `config.dir_inventario` e reutilizado enquanto tiver menos de
+        `validade` dias. Após esse prazo o inventário é requisitado novamente,
+        mas o snapshot só é reescrito caso a última atualização de algum posto
+        tenha mudado.
+
         Parameters
         ----------
         codigo : str
@@ -43,49 +345,40 @@ class ANA:
             1 caso seja desejado apenas telemétricas, 0 caso contrário. '' para obter
             todas.
 
+        validade : float
+            Idade máxima do snapshot, em dias.
+
+        atualizar : bool
+            Caso seja desejado ignorar o snapshot e requisitar o inventário.
+
         Returns
         -------
         pd.DataFrame
             Inventário de postos.
         """
-        url_requisicao = f"{self.url_base}/HidroInventario?codEstDE={codigo}&codEstATE=&tpEst={tipoest}&nmEst=&nmRio=&codSubBacia=&codBacia=&nmMunicipio=&nmEstado=&sgResp=&sgOper=&telemetrica={telemetrica}"
-
-        resposta = requests.get(url_requisicao)
-
-        tree = ET.ElementTree(ET.fromstring(resposta.content))
-        root = tree.getroot()
-
-        estacoes = list()
-        for estacao in root.iter("Table"):
-            dados = {
-                "latitude": [estacao.find("Latitude").text],
-                "longitude": [estacao.find("Longitude").text],
-                "altitude": [estacao.find("Altitude").text],
-                "codigo": [estacao.find("Codigo").text],
-                "nome": [estacao.find("Nome").text],
-                "estado": [estacao.find("nmEstado").text],
-                "municipio": [estacao.find("nmMunicipio").text],
-                "responsavel": [estacao.find("ResponsavelSigla").text],
-                "ultima_att": [estacao.find("UltimaAtualizacao").text],
-                "tipo": [estacao.find("TipoEstacao").text],
-                "data_ins": [estacao.find("DataIns").text],
-                "data_alt": [estacao.find("DataAlt").text],
-            }
-            if telemetrica:
-                dados.update(
-                    {
-                        "inicio_telemetria": [
-                            estacao.find("PeriodoTelemetricaInicio").text
-                        ],
-                        "fim_telemetria": [estacao.find("PeriodoTelemetricaFim").text],
-                    }
-                )
-
-            df = pd.DataFrame.from_dict(dados)
-            df.set_index("codigo", inplace=True)
-            estacoes.append(df)
-
-        inventario = pd.concat(estacoes)
+        chave = "_".join(
+            str(p) if p != "" else "todos" for p in (codigo, tipoest, telemetrica)
+        )
+        snapshot = config.dir_inventario.joinpath(f"inventario_{chave}.parquet")
+        if snapshot.exists() and not atualizar:
+            idade = time.time() - snapshot.stat().st_mtime
+            if idade < validade * 24 * 3600:
+                return pd.read_parquet(snapshot)
+
+        endpoint = "HidroInventario"
+        url_requisicao = f"{self.url_base}/{endpoint}?codEstDE={codigo}&codEstATE=&tpEst={tipoest}&nmEst=&nmRio=&codSubBacia=&codBacia=&nmMunicipio=&nmEstado=&sgResp=&sgOper=&telemetrica={telemetrica}"
+
+        conteudo = self._requisitar(endpoint, url_requisicao)
+
+        inventario = parsear_inventario(conteudo, telemetrica=bool(telemetrica))
+
+        if snapshot.exists():
+            anterior = pd.read_parquet(snapshot, columns=["ultima_att"])
+            if anterior["ultima_att"].equals(inventario["ultima_att"]):
+                os.utime(snapshot)
+                return inventario
+
+        inventario.to_parquet(snapshot)
 
         return inventario
 
@@ -116,44 +409,69 @@ class ANA:
         -------
             pd.DataFrame: Dataframe contendo a série de vazões do posto, o nível máximo, médio e mínimo de cada mês e a consistência do dado (1: não consistido; 2: consistido)
         """
-        url_requisicao = f"{self.url_base}/HidroSerieHistorica?CodEstacao={cod_estacao}&dataInicio={data_inicial}&dataFim={data_final}&tipoDados=2&nivelConsistencia={consistencia}"
-        resposta = requests.get(url_requisicao)
-
-        tree = ET.ElementTree(ET.fromstring(resposta.content))
-        root = tree.getroot()
-
-        df_mes = list()
-        for mes in root.iter("SerieHistorica"):
-            consistencia = mes.find("NivelConsistencia").text
-
-            primeiro_dia_mes = pd.to_datetime(mes.find("DataHora").text, dayfirst=True)
-            ultimo_dia_mes = calendar.monthrange(
-                primeiro_dia_mes.year, primeiro_dia_mes.month
-            )[1]
-            lista_dias_mes = pd.date_range(
-                primeiro_dia_mes, periods=ultimo_dia_mes, freq="D"
-            ).tolist()
-
-            dados, datas = [], []
-            for i in range(len(lista_dias_mes)):
-                datas.append(lista_dias_mes[i])
-                dia = i + 1
-                chuva = "Chuva{:02}".format(dia)
-                dado = mes.find(chuva).text
-
-                dados.append(dado)
-            df = pd.DataFrame({cod_estacao: dados}, index=datas)
-            df_mes.append(df)
-
-        try:
-            serie = pd.concat(df_mes)
-            serie.sort_index(inplace=True)
-            serie[cod_estacao] = pd.to_numeric(serie[cod_estacao])
-        except (ValueError):
-            serie = pd.DataFrame([], columns=[cod_estacao])
+        endpoint = "HidroSerieHistorica"
+        url_requisicao = f"{self.url_base}/{endpoint}?CodEstacao={cod_estacao}&dataInicio={data_inicial}&dataFim={data_final}&tipoDados=2&nivelConsistencia={consistencia}"
+        conteudo = self._requisitar(endpoint, url_requisicao)
+
+        datas, valores, _ = parsear_serie_historica(conteudo, prefixo="Chuva")
+
+        if not len(datas):
+            return pd.DataFrame([], columns=[cod_estacao])
+
+        serie = pd.DataFrame({cod_estacao: valores}, index=pd.DatetimeIndex(datas))
 
         return serie
 
+    def obter_chuvas(
+        self,
+        cod_estacoes: Iterable[int],
+        data_inicial: str = "",
+        data_final: str = "",
+        consistencia: int = 2,
+        max_workers: int = requisicoes.max_conexoes,
+    ) -> Iterator[Tuple[int, Union[pd.DataFrame, Exception]]]:
+        """
+        Obtém as séries históricas de vários postos pluviométricos em paralelo.
+
+        As requisições compartilham a sessão da classe e as séries são entregues à
+        medida que terminam de ser baixadas. Um posto com erro não interrompe os
+        demais: a exceção é entregue no lugar da série.
+
+        Parameters
+        ----------
+        cod_estacoes : Iterable[int]
+            Códigos das estações pluviométricas.
+
+        data_inicial : str
+            Data de início do intervalo, no formato dd/mm/yyyy.
+
+        data_final : str
+            Data final do intervalo, no formato dd/mm/yyyy.
+
+        consistencia : int
+            Nível de consistência dos dados (1: bruto; 2: consistido).
+
+        max_workers : int
+            Número máximo de requisições simultâneas.
+
+        Returns
+        -------
+        Iterator[Tuple[int, Union[pd.DataFrame, Exception]]]
+            Pares (código do posto, série ou exceção).
+        """
+
+        def obter(cod_estacao: int) -> pd.DataFrame:
+            return self.obter_chuva(
+                cod_estacao=cod_estacao,
+                data_inicial=data_inicial,
+                data_final=data_final,
+                consistencia=consistencia,
+            )
+
+        return requisicoes.executar_em_paralelo(
+            obter, cod_estacoes, max_workers=max_workers
+        )
+
     def obter_vazoes(
         self, cod_estacao: int, data_inicial: str = "", data_final: str = ""
     ) -> pd.DataFrame:
@@ -178,47 +496,23 @@ class ANA:
             pd.DataFrame: Dataframe contendo a série de vazões do posto, o nível máximo, médio e mínimo de cada mês e a consistência do dado (1: não consistido; 2: consistido)
         """
 
-        url_requisicao = f"{self.url_base}/HidroSerieHistorica?CodEstacao={cod_estacao}&dataInicio={data_inicial}&dataFim={data_final}&tipoDados=3&nivelConsistencia="
-        resposta = requests.get(url_requisicao)
-
-        tree = ET.ElementTree(ET.fromstring(resposta.content))
-        root = tree.getroot()
-
-        df_mes = []
-        for mes in root.iter("SerieHistorica"):
-            consistencia = mes.find("NivelConsistencia").text
-            maxima = mes.find("Maxima").text
-            minima = mes.find("Minima").text
-            media = mes.find("Media").text
-
-            primeiro_dia_mes = pd.to_datetime(mes.find("DataHora").text, dayfirst=True)
-            ultimo_dia_mes = calendar.monthrange(
-                primeiro_dia_mes.year, primeiro_dia_mes.month
-            )[1]
-            lista_dias_mes = pd.date_range(
-                primeiro_dia_mes, periods=ultimo_dia_mes, freq="D"
-            ).tolist()
-
-            dados, datas = [], []
-            for i in range(len(lista_dias_mes)):
-                datas.append(lista_dias_mes[i])
-                dia = i + 1
-                vazao = "Vazao{:02}".format(dia)
-                dado = mes.find(vazao).text
-
-                dados.append(dado)
-            df = pd.DataFrame({"vazoes": dados}, index=datas)
-            df = df.assign(
-                maxima=maxima,
-                minima=minima,
-                media=media,
-                consistencia=consistencia,
-            )
-            df_mes.append(df)
-
-        serie = pd.concat(df_mes)
-        serie.sort_index(inplace=True)
-        serie.vazoes = pd.to_numeric(serie.vazoes)
+        endpoint = "HidroSerieHistorica"
+        url_requisicao = f"{self.url_base}/{endpoint}?CodEstacao={cod_estacao}&dataInicio={data_inicial}&dataFim={data_final}&tipoDados=3&nivelConsistencia="
+        conteudo = self._requisitar(endpoint, url_requisicao)
+
+        datas, valores, mensais = parsear_serie_historica(
+            conteudo,
+            prefixo="Vazao",
+            campos_mensais={
+                "maxima": "Maxima",
+                "minima": "Minima",
+                "media": "Media",
+                "consistencia": "NivelConsistencia",
+            },
+        )
+        serie = pd.DataFrame(
+            {"vazoes": valores, **mensais}, index=pd.DatetimeIndex(datas)
+        )
 
         return serie
 
@@ -244,40 +538,11 @@ class ANA:
         -------
             pd.DataFrame: Dataframe contendo a série de cotas, em metros, do nível de água no posto fluviométrico analisado.
         """
-        url_requisicao = f"{self.url_base}/HidroSerieHistorica?CodEstacao={cod_estacao}&dataInicio={data_inicial}&dataFim={data_final}&tipoDados=1&nivelConsistencia="
-        resposta = requests.get(url_requisicao)
-
-        tree = ET.ElementTree(ET.fromstring(resposta.content))
-        root = tree.getroot()
-
-        df_mes = []
-        for mes in root.iter("SerieHistorica"):
-            primeiro_dia_mes = pd.to_datetime(mes.find("DataHora").text, dayfirst=True)
-            ultimo_dia_mes = calendar.monthrange(
-                primeiro_dia_mes.year, primeiro_dia_mes.month
-            )[1]
-            lista_dias_mes = pd.date_range(
-                primeiro_dia_mes, periods=ultimo_dia_mes, freq="D"
-            ).tolist()
-
-            dados, datas = [], []
-            for i in range(len(lista_dias_mes)):
-                datas.append(lista_dias_mes[i])
-                dia = i + 1
-                cota = "Cota{:02}".format(dia)
-                try:
-                    dado = mes.find(cota).text
-                except AttributeError:
-                    dado = np.nan
-                dados.append(dado)
-
-            df = pd.DataFrame({"cota": dados}, index=datas)
-            df_mes.append(df)
-
-        serie = pd.concat(df_mes)
-        serie.sort_index(inplace=True)
-        serie.index = pd.to_datetime(serie.index)
-        serie.cota = pd.to_numeric(serie.cota)
-        serie.cota = serie.cota / 100
+        endpoint = "HidroSerieHistorica"
+        url_requisicao = f"{self.url_base}/{endpoint}?CodEstacao={cod_estacao}&dataInicio={data_inicial}&dataFim={data_final}&tipoDados=1&nivelConsistencia="
+        conteudo = self._requisitar(endpoint, url_requisicao)
+
+        datas, valores, _ = parsear_serie_historica(conteudo, prefixo="Cota")
+        serie = pd.DataFrame({"cota": valores / 100}, index=pd.DatetimeIndex(datas))
 
         return serie
@@ -1,23 +1,318 @@
 """Módulo para obtenção de dados do Instituto Nacional de Meteorologia."""
 
+import json
+
+from datetime import date
+from datetime import timedelta
+from typing import Any
 from typing import Dict
+from typing import Iterable
+from typing import Iterator
 from typing import List
 from typing import Literal
+from typing import Optional
+from typing import Tuple
 
+import numpy as np
+import pandas as pd
 import requests
 
+from hidromet import requisicoes
+from hidromet.cache import CacheRespostas
+
 
 # Código baseado no manual de uso da API de estações e dados meteorológicos do INMET: https://portal.inmet.gov.br/manual/manual-de-uso-da-api-estações
 
+# campos das respostas que não são numéricos
+colunas_texto = ["CD_ESTACAO", "DC_NOME", "UF", "DT_MEDICAO", "HR_MEDICAO"]
+# hora da leitura diária dos pluviômetros, em UTC
+hora_leitura = 12
+# limite máximo possível de chuva em uma hora, em mm
+limite_chuva_horaria = 100
+# chuva horária, em mm, a partir da qual uma hora isolada entre horas secas é anulada
+limite_pico = 40
+# fração mínima de horas válidas para o total diário ser considerado
+completude_minima = 0.9
+
+
+def registros_para_dataframe(registros: List[Dict[str, str]]) -> pd.DataFrame:
+    """
+    Converte os registros de uma resposta da API em colunas tipadas.
+
+    Os campos de medição são convertidos para float (valores ausentes viram
+    NaN) e a data e a hora da medição formam o índice. Registros horários sem
+    a hora da medição são descartados, já que não podem ser posicionados.
+
+    Parameters
+    ----------
+    registros : List[Dict[str, str]]
+        Registros retornados pela API.
+
+    Returns
+    -------
+    pd.DataFrame
+        Dados indexados pela data (e hora, em UTC) da medição.
+    """
+    if not registros:
+        return pd.DataFrame(index=pd.DatetimeIndex([], name="data"))
+
+    colunas = {campo: [r.get(campo) for r in registros] for campo in registros[0]}
+
+    indice = pd.to_datetime(colunas.pop("DT_MEDICAO"), format="%Y-%m-%d")
+    if "HR_MEDICAO" in colunas:
+        horas = pd.Series(colunas.pop("HR_MEDICAO"), dtype=object).str.ljust(4, "0")
+        indice = indice + pd.to_timedelta(
+            pd.to_numeric(horas, errors="coerce").to_numpy() // 100, unit="h"
+        )
+
+    dados = {
+        campo: (
+            np.array(valores, dtype=object)
+            if campo in colunas_texto
+            else pd.to_numeric(np.array(valores, dtype=object), errors="coerce")
+        )
+        for campo, valores in colunas.items()
+    }
+
+    df = pd.DataFrame(dados, index=pd.DatetimeIndex(indice, name="data"))
+    return df[df.index.notna()]
+
+
+def dividir_periodo(
+    data_inicial: str, data_final: str, dias: int
+) -> List[Tuple[str, str]]:
+    """
+    Divide um período em janelas consecutivas de no máximo `dias` dias.
+
+    Parameters
+    ----------
+    data_inicial : str
+        Data de início do período no formato AAAA-MM-DD.
+
+    data_final : str
+        Data final do período no formato AAAA-MM-DD.
+
+    dias : int
+        Tamanho máximo de cada janela, em dias.
+
+    Returns
+    -------
+    List[Tuple[str, str]]
+        Datas inicial e final de cada janela, no formato AAAA-MM-DD.
+    """
+    inicio = date.fromisoformat(data_inicial)
+    fim = date.fromisoformat(data_final)
+
+    janelas = list()
+    while inicio <= fim:
+        fim_janela = min(inicio + timedelta(days=dias - 1), fim)
+        janelas.append((inicio.isoformat(), fim_janela.isoformat()))
+        inicio = fim_janela + timedelta(days=1)
+
+    return janelas
+
+
+def dia_pluviometrico(
+    datas: pd.DatetimeIndex, hora_leitura: int = hora_leitura
+) -> pd.DatetimeIndex:
+    """
+    Atribui cada hora ao dia pluviométrico que a contabiliza.
+
+    Pela convenção dos pluviômetros, a leitura de um dia às `hora_leitura` UTC
+    acumula as 24 horas anteriores: o dia D soma as horas de D-1 às
+    `hora_leitura + 1` até D às `hora_leitura`. Cada hora do INMET se refere ao
+    acumulado da hora que termina no horário da medição.
+
+    Parameters
+    ----------
+    datas : pd.DatetimeIndex
+        Data e hora (UTC) do fim de cada acumulado horário.
+
+    hora_leitura : int
+        Hora da leitura diária, em UTC.
+
+    Returns
+    -------
+    pd.DatetimeIndex
+        Dia pluviométrico de cada hora.
+    """
+    deslocamento = pd.Timedelta(hours=hora_leitura + 1)
+    return (datas - deslocamento).floor("D") + pd.Timedelta(days=1)
+
+
+def limpar_chuva_horaria(
+    serie: pd.Series,
+    limite: float = limite_chuva_horaria,
+    limite_pico: float = limite_pico,
+) -> pd.Series:
+    """
+    Aplica as verificações horárias à chuva de uma estação.
+
+    Horas duplicadas são removidas (mantendo a primeira) e valores negativos ou
+    acima do limite são anulados. Picos isolados também são anulados: horas com
+    ao menos `limite_pico` cuja hora anterior e posterior foram medidas e são
+    secas, típicos de falhas do sensor. Horas sem uma das vizinhas (como as das
+    bordas de uma janela) não são avaliadas como pico.
+
+    Parameters
+    ----------
+    serie : pd.Series
+        Chuva horária indexada pela data e hora da medição.
+
+    limite : float
+        Limite máximo possível de chuva em uma hora, em mm.
+
+    limite_pico : float
+        Menor chuva, em mm, de uma hora isolada para ser considerada um pico.
+
+    Returns
+    -------
+    pd.Series
+        Chuva horária verificada.
+    """
+    serie = serie[~serie.index.duplicated(keep="first")]
+    serie = serie.where((serie >= 0) & (serie <= limite))
+
+    uma_hora = pd.Timedelta(hours=1)
+    anterior = serie.reindex(serie.index - uma_hora).to_numpy()
+    posterior = serie.reindex(serie.index + uma_hora).to_numpy()
+    pico = (serie.to_numpy() >= limite_pico) & (anterior == 0) & (posterior == 0)
+
+    return serie.mask(pico)
+
+
+def _acumular_dias(
+    serie: pd.Series, dias: pd.DatetimeIndex, completude_minima: float
+) -> pd.DataFrame:
+    unicos, posicoes = np.unique(dias.values, return_inverse=True)
+    valores = serie.to_numpy(dtype=float)
+    validos = ~np.isnan(valores)
+
+    total = np.bincount(posicoes, weights=np.where(validos, valores, 0))
+    completude = np.bincount(posicoes, weights=validos) / 24
+    chuva = np.where(completude >= completude_minima, total, np.nan)
+
+    return pd.DataFrame(
+        {"chuva": chuva, "completude": completude},
+        index=pd.DatetimeIndex(unicos, name="data"),
+    )
+
+
+def agregar_chuva_diaria(
+    janelas: Iterable[pd.DataFrame],
+    hora_leitura: int = hora_leitura,
+    limite: float = limite_chuva_horaria,
+    completude_minima: float = completude_minima,
+    limite_pico: float = limite_pico,
+) -> Iterator[pd.DataFrame]:
+    """
+    Agrega janelas de dados horários em chuva diária, janela a janela.
+
+    Apenas uma janela e as horas do último dia pluviométrico ainda em aberto
+    ficam em memória, independentemente do tamanho do período. Os dias são
+    entregues quando todas as suas horas já foram consumidas.
+
+    Parameters
+    ----------
+    janelas : Iterable[pd.DataFrame]
+        Janelas consecutivas de dados horários, com a coluna "CHUVA", como as de
+        `INMET.iterar_dados_estacao`.
+
+    hora_leitura : int
+        Hora da leitura diária, em UTC.
+
+    limite : float
+        Limite máximo possível de chuva em uma hora, em mm.
+
+    completude_minima : float
+        Fração mínima de horas válidas para o total diário ser considerado.
+
+    limite_pico : float
+        Menor chuva, em mm, de uma hora isolada entre horas secas para ser
+        anulada (ver `limpar_chuva_horaria`).
+
+    Returns
+    -------
+    Iterator[pd.DataFrame]
+        Chuva diária ("chuva", em mm) e fração de horas válidas ("completude")
+        de cada dia, indexadas pelo dia pluviométrico.
+    """
+    aberto = pd.Series(dtype=float)
+    for janela in janelas:
+        if "CHUVA" not in janela:
+            continue
+        serie = limpar_chuva_horaria(janela["CHUVA"], limite, limite_pico)
+        serie = pd.concat([aberto, serie]) if len(aberto) else serie
+        if serie.empty:
+            continue
+
+        dias = dia_pluviometrico(serie.index, hora_leitura)
+        fechados = np.asarray(dias < dias.max())
+        aberto = serie[~fechados]
+        if fechados.any():
+            yield _acumular_dias(serie[fechados], dias[fechados], completude_minima)
+
+    if len(aberto):
+        dias = dia_pluviometrico(aberto.index, hora_leitura)
+        yield _acumular_dias(aberto, dias, completude_minima)
+
 
 class INMET:
     """Classe de requisição da API do INMET."""
 
     url_base = "https://apitempo.inmet.gov.br"
 
-    def __init__(self) -> None:
-        """Inicialização da classe de consumo da API."""
-        pass
+    def __init__(
+        self,
+        sessao: Optional[requests.Session] = None,
+        cache: Optional[CacheRespostas] = None,
+    ) -> None:
+        """
+        Inicialização da classe de consumo da API.
+
+        Parameters
+        ----------
+        sessao : Optional[requests.Session]
+            Sessão HTTP compartilhada entre as requisições. Caso não seja passada,
+            é criada uma sessão com pool de conexões e novas tentativas.
+
+        cache : Optional[CacheRespostas]
+            Cache em disco das respostas. Caso não seja passado, todas as
+            requisições são feitas ao servidor.
+        """
+        self.sessao = sessao or requisicoes.criar_sessao()
+        self.cache = cache
+
+    def _requisitar(self, endpoint: str, url_requisicao: str) -> Any:
+        """
+        Faz uma requisição GET pela sessão da classe, passando pelo cache.
+
+        Parameters
+        ----------
+        endpoint : str
+            Nome do endpoint requisitado.
+
+        url_requisicao : str
+            Url completa da requisição.
+
+        Returns
+        -------
+        Any
+            Resposta json decodificada.
+        """
+        conteudo = None
+        if self.cache is not None:
+            conteudo = self.cache.obter(endpoint, url_requisicao)
+
+        if conteudo is None:
+            resposta = self.sessao.get(url_requisicao, timeout=requisicoes.timeout)
+            resposta.raise_for_status()
+            conteudo = resposta.content
+
+            if self.cache is not None:
+                self.cache.salvar(endpoint, url_requisicao, conteudo)
+
+        return json.loads(conteudo) if conteudo else []
 
     def obter_dados_estacao(
         self,
@@ -43,13 +338,163 @@ class INMET:
         -------
             List[Dict[str, str]] : dados horários referentes a uma estação automática ou manual.
         """
-        freq_ = "" if freq == "H" else "diaria/"
+        endpoint = "estacao" if freq == "H" else "estacao/diaria"
         url_requisicao = (
-            f"{self.url_base}/estacao/{freq_}{data_inicial}/{data_final}/{cod_estacao}"
+            f"{self.url_base}/{endpoint}/{data_inicial}/{data_final}/{cod_estacao}"
         )
-        resposta = requests.get(url_requisicao)
 
-        return resposta.json()
+        return self._requisitar(endpoint, url_requisicao)
+
+    def iterar_dados_estacao(
+        self,
+        data_inicial: str,
+        data_final: str,
+        cod_estacao: str,
+        freq: Literal["H", "D"] = "H",
+        dias_janela: int = 365,
+        max_workers: int = requisicoes.max_conexoes,
+    ) -> Iterator[pd.DataFrame]:
+        """
+        Obtém os dados de uma estação em janelas requisitadas em paralelo.
+
+        As janelas são entregues em ordem cronológica, já convertidas em colunas
+        tipadas, e apenas `max_workers` janelas ficam em memória à frente do
+        consumo.
+
+        Parameters
+        ----------
+        data_inicial : str
+            Data de início do intervalo no formato AAAA-MM-DD.
+        data_final : str
+            Data final do intervalo no formato AAAA-MM-DD.
+        cod_estacao : str
+            Código da estação.
+        freq : {'H', 'D'}
+            Frequência dos dados, onde H se refere a dados horários e D, diários.
+        dias_janela : int
+            Tamanho de cada janela requisitada, em dias.
+        max_workers : int
+            Número máximo de requisições simultâneas.
+
+        Returns
+        -------
+            Iterator[pd.DataFrame] : dados de cada janela, indexados pela data da medição.
+        """
+
+        def obter_janela(janela: Tuple[str, str]) -> pd.DataFrame:
+            registros = self.obter_dados_estacao(
+                data_inicial=janela[0],
+                data_final=janela[1],
+                cod_estacao=cod_estacao,
+                freq=freq,
+            )
+            return registros_para_dataframe(registros)
+
+        janelas = dividir_periodo(data_inicial, data_final, dias_janela)
+
+        return requisicoes.executar_em_ordem(
+            obter_janela, janelas, max_workers=max_workers
+        )
+
+    def obter_serie_estacao(
+        self,
+        data_inicial: str,
+        data_final: str,
+        cod_estacao: str,
+        freq: Literal["H", "D"] = "H",
+        dias_janela: int = 365,
+        max_workers: int = requisicoes.max_conexoes,
+    ) -> pd.DataFrame:
+        """
+        Obtém o histórico de uma estação em janelas paralelas, em colunas tipadas.
+
+        Parameters
+        ----------
+        data_inicial : str
+            Data de início do intervalo no formato AAAA-MM-DD.
+        data_final : str
+            Data final do intervalo no formato AAAA-MM-DD.
+        cod_estacao : str
+            Código da estação.
+        freq : {'H', 'D'}
+            Frequência dos dados, onde H se refere a dados horários e D, diários.
+        dias_janela : int
+            Tamanho de cada janela requisitada, em dias.
+        max_workers : int
+            Número máximo de requisições simultâneas.
+
+        Returns
+        -------
+            pd.DataFrame : dados da estação indexados pela data da medição.
+        """
+        janelas = self.iterar_dados_estacao(
+            data_inicial=data_inicial,
+            data_final=data_final,
+            cod_estacao=cod_estacao,
+            freq=freq,
+            dias_janela=dias_janela,
+            max_workers=max_workers,
+        )
+
+        return pd.concat(list(janelas))
+
+    def iterar_chuva_diaria(
+        self,
+        data_inicial: str,
+        data_final: str,
+        cod_estacao: str,
+        hora_leitura: int = hora_leitura,
+        completude_minima: float = completude_minima,
+        dias_janela: int = 365,
+        max_workers: int = requisicoes.max_conexoes,
+    ) -> Iterator[pd.DataFrame]:
+        """
+        Obtém a chuva diária de uma estação automática a partir dos dados horários.
+
+        Os dados horários são requisitados em janelas, verificados e agregados
+        no dia pluviométrico (ver `dia_pluviometrico`) à medida que chegam, sem
+        que o período completo fique em memória. O dia anterior à data inicial
+        também é requisitado, para que o primeiro dia tenha as suas 24 horas.
+
+        Parameters
+        ----------
+        data_inicial : str
+            Data de início do intervalo no formato AAAA-MM-DD.
+        data_final : str
+            Data final do intervalo no formato AAAA-MM-DD.
+        cod_estacao : str
+            Código da estação.
+        hora_leitura : int
+            Hora da leitura diária, em UTC.
+        completude_minima : float
+            Fração mínima de horas válidas para o total diário ser considerado.
+        dias_janela : int
+            Tamanho de cada janela requisitada, em dias.
+        max_workers : int
+            Número máximo de requisições simultâneas.
+
+        Returns
+        -------
+            Iterator[pd.DataFrame] : chuva diária ("chuva") e fração de horas válidas ("completude") de cada janela.
+        """
+        inicio = pd.Timestamp(data_inicial)
+        fim = pd.Timestamp(data_final)
+
+        janelas = self.iterar_dados_estacao(
+            data_inicial=(inicio - pd.Timedelta(days=1)).strftime("%Y-%m-%d"),
+            data_final=data_final,
+            cod_estacao=cod_estacao,
+            freq="H",
+            dias_janela=dias_janela,
+            max_workers=max_workers,
+        )
+        diarios = agregar_chuva_diaria(
+            janelas, hora_leitura=hora_leitura, completude_minima=completude_minima
+        )
+        for diario in diarios:
+            diario = diario.loc[(diario.index >= inicio) & (diario.index <= fim)]
+            if not diario.empty:
+                yield diario
 
     def obter_dados_estacoes(self, dia: str, hora: str = None) -> List[Dict[str, str]]:
         """
@@ -69,10 +514,46 @@ class INMET:
             List[Dict[str, str]] : dados horários de todas as estações automáticas para a data especificada.
         """
         sufixo = f"{dia}/{hora}" if hora else dia
-        url_requisicao = f"{self.url_base}/estacao/dados/{sufixo}"
-        resposta = requests.get(url_requisicao)
+        endpoint = "estacao/dados"
+        url_requisicao = f"{self.url_base}/{endpoint}/{sufixo}"
+
+        return self._requisitar(endpoint, url_requisicao)
+
+    def obter_dados_dia(
+        self,
+        dia: str,
+        por_hora: bool = False,
+        max_workers: int = requisicoes.max_conexoes,
+    ) -> pd.DataFrame:
+        """
+        Obtenção dos dados de todas as estações automáticas de um dia, em colunas tipadas.
+
+        Parameters
+        ----------
+        dia : str
+            Data dos dados no formato AAAA-MM-DD.
+
+        por_hora : bool
+            Caso verdadeiro, as 24 horas do dia são requisitadas em paralelo, uma
+            requisição por hora.
+
+        max_workers : int
+            Número máximo de requisições simultâneas.
+
+        Returns
+        -------
+            pd.DataFrame : dados de todas as estações, indexados pela data e hora
+            da medição, com o código da estação na coluna CD_ESTACAO.
+        """
+        horas = [f"{hora:02}00" for hora in range(24)] if por_hora else [None]
+
+        registros = requisicoes.executar_em_ordem(
+            lambda hora: self.obter_dados_estacoes(dia=dia, hora=hora),
+            horas,
+            max_workers=max_workers,
+        )
 
-        return resposta.json()
+        return pd.concat([registros_para_dataframe(r) for r in registros])
 
     def listar_estacoes(self, tipo: Literal["T", "M"] = "T") -> List[Dict[str, str]]:
         """
@@ -87,10 +568,10 @@ class INMET:
         -------
             List[Dict[str, str]] : Lista de estações.
         """
-        url_requisicao = f"{self.url_base}/estacoes/{tipo}"
-        resposta = requests.get(url_requisicao)
+        endpoint = "estacoes"
+        url_requisicao = f"{self.url_base}/{endpoint}/{tipo}"
 
-        return resposta.json()
+        return self._requisitar(endpoint, url_requisicao)
 
     def obter_estacao_geocode(self, geocode: str) -> Dict[str, Dict[str, str]]:
         """
@@ -105,7 +586,7 @@ class INMET:
         -------
             Dict[str, Dict[str,str]] : dados de uma estação próxima ao geocode informado.
         """
-        url_requisicao = f"https://apiprevmet3.inmet.gov.br/estacao/proxima/{geocode}"
-        resposta = requests.get(url_requisicao)
+        endpoint = "estacao/proxima"
+        url_requisicao = f"https://apiprevmet3.inmet.gov.br/{endpoint}/{geocode}"
 
-        return resposta.json()
+        return self._requisitar(endpoint, url_requisicao)
@@ -0,0 +1,201 @@
+"""Armazenamento das séries intermediárias em arquivos parquet tipados."""
+import json
+
+from datetime import date
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+# nome da coluna de datas nos arquivos
+coluna_data = "data"
+# chave dos metadados dos postos no rodapé dos arquivos
+chave_metadados = b"hidromet"
+# número de dias em cada grupo de linhas, usado para pular períodos na leitura
+dias_por_grupo = 366
+# compressão das colunas
+compressao = "zstd"
+
+
+def salvar_series(
+    df: pd.DataFrame,
+    arquivo: Path,
+    metadados: Optional[Dict[str, Any]] = None,
+    exportar_csv: bool = False,
+) -> None:
+    """
+    Salva séries indexadas por data em um arquivo parquet.
+
+    Os valores são gravados como float32 e as datas como datetime64, em grupos
+    de linhas de `dias_por_grupo` dias, de forma que a leitura de um período
+    consulta apenas os grupos que o contêm.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Séries indexadas por data, com uma coluna por posto (ou variável).
+
+    arquivo : Path
+        Arquivo parquet de saída.
+
+    metadados : Optional[Dict[str, Any]]
+        Informações dos postos (como as coordenadas), gravadas em json no
+        rodapé do arquivo.
+
+    exportar_csv : bool
+        Caso seja desejado também salvar as séries em csv, com o mesmo nome.
+    """
+    arquivo = Path(arquivo)
+    df = df.sort_index()
+
+    colunas = {coluna_data: pa.array(pd.to_datetime(df.index).values)}
+    for coluna in df.columns:
+        colunas[str(coluna)] = pa.array(
+            df[coluna].to_numpy(dtype=np.float32), from_pandas=True
+        )
+
+    tabela = pa.table(colunas)
+    if metadados is not None:
+        tabela = tabela.replace_schema_metadata(
+            {chave_metadados: json.dumps(metadados).encode()}
+        )
+
+    temporario = arquivo.with_name(f"{arquivo.name}.part")
+    pq.write_table(
+        tabela, temporario, row_group_size=dias_por_grupo, compression=compressao
+    )
+    temporario.replace(arquivo)
+
+    if exportar_csv:
+        exportar = df.copy()
+        # mesmo formato dos csvs existentes: datas sem nome de coluna
+        exportar.index = pd.to_datetime(exportar.index).strftime("%Y-%m-%d")
+        exportar.index.name = None
+        exportar.to_csv(arquivo.with_suffix(".csv"))
+
+
+def ler_series(
+    arquivo: Path,
+    postos: Optional[List[str]] = None,
+    inicio: Optional[Union[str, date]] = None,
+    fim: Optional[Union[str, date]] = None,
+) -> pd.DataFrame:
+    """
+    Lê séries de um arquivo parquet.
+
+    Apenas as colunas dos postos pedidos são lidas e os grupos de linhas fora
+    do período são descartados pelas estatísticas do arquivo, sem leitura.
+
+    Parameters
+    ----------
+    arquivo : Path
+        Arquivo parquet das séries.
+
+    postos : Optional[List[str]]
+        Códigos dos postos a serem lidos. Por padrão, todos.
+
+    inicio : Optional[Union[str, date]]
+        Data inicial do período (inclusiva). Por padrão, o início das séries.
+
+    fim : Optional[Union[str, date]]
+        Data final do período (inclusiva). Por padrão, o fim das séries.
+
+    Returns
+    -------
+    pd.DataFrame
+        Séries (float32) indexadas por data.
+    """
+    colunas = None if postos is None else [coluna_data, *map(str, postos)]
+
+    filtros = list()
+    if inicio is not None:
+        filtros.append((coluna_data, ">=", pd.Timestamp(inicio)))
+    if fim is not None:
+        filtros.append((coluna_data, "<=", pd.Timestamp(fim)))
+
+    tabela = pq.read_table(arquivo, columns=colunas, filters=filtros or None)
+    df = tabela.to_pandas().set_index(coluna_data)
+    df.index = pd.DatetimeIndex(df.index, name=coluna_data)
+
+    return df
+
+
+def ler_metadados(arquivo: Path) -> Optional[Dict[str, Any]]:
+    """
+    Lê os metadados dos postos gravados no rodapé de um arquivo parquet.
+
+    Parameters
+    ----------
+    arquivo : Path
+        Arquivo parquet das séries.
+
+    Returns
+    -------
+    Optional[Dict[str, Any]]
+        Metadados dos postos, ou None caso o arquivo não os tenha.
+    """
+    metadados = pq.read_schema(arquivo).metadata or dict()
+    if chave_metadados not in metadados:
+        return None
+
+    return json.loads(metadados[chave_metadados])
+
+
+def listar_postos(arquivo: Path) -> List[str]:
+    """
+    Lista os postos de um arquivo parquet sem ler os dados.
+
+    Parameters
+    ----------
+    arquivo : Path
+        Arquivo parquet das séries.
+
+    Returns
+    -------
+    List[str]
+        Códigos dos postos do arquivo.
+    """
+    return [nome for nome in pq.read_schema(arquivo).names if nome != coluna_data]
+
+
+def converter_csv(
+    arquivo_csv: Path,
+    arquivo_parquet: Optional[Path] = None,
+    metadados: Optional[Dict[str, Any]] = None,
+) -> Path:
+    """
+    Converte um arquivo csv de séries para parquet.
+
+    Parameters
+    ----------
+    arquivo_csv : Path
+        Arquivo csv com as datas na primeira coluna.
+
+    arquivo_parquet : Optional[Path]
+        Arquivo parquet de saída. Por padrão, o mesmo nome com a extensão
+        ".parquet".
+
+    metadados : Optional[Dict[str, Any]]
+        Informações dos postos gravadas no rodapé do arquivo.
+
+    Returns
+    -------
+    Path
+        Arquivo parquet criado.
+    """
+    arquivo_csv = Path(arquivo_csv)
+    arquivo_parquet = Path(arquivo_parquet or arquivo_csv.with_suffix(".parquet"))
+
+    df = pd.read_csv(arquivo_csv, index_col=0)
+    df.index = pd.to_datetime(df.index, format="%Y-%m-%d")
+    salvar_series(df, arquivo_parquet, metadados)
+
+    return arquivo_parquet
@@ -0,0 +1,186 @@
+"""Cache em disco das respostas das APIs da ANA e do INMET."""
+import gzip
+import hashlib
+import os
+import threading
+import time
+
+from pathlib import Path
+from typing import Dict
+from typing import Optional
+
+from hidromet import config
+
+
+# tempo de validade padrão de cada endpoint, em segundos
+ttl_endpoints = {
+    "HidroInventario": 7 * 24 * 3600,
+    "HidroSerieHistorica": 24 * 3600,
+    "estacoes": 7 * 24 * 3600,
+    "estacao": 24 * 3600,
+    "estacao/diaria": 24 * 3600,
+    "estacao/dados": 3600,
+    "estacao/proxima": 7 * 24 * 3600,
+}
+# tempo de validade de endpoints não listados, em segundos
+ttl_padrao = 24 * 3600
+# tamanho máximo do cache em disco, em bytes
+tamanho_maximo_padrao = 2 * 1024**3
+
+
+class CacheRespostas:
+    """
+    Cache em disco de respostas HTTP, indexado pela url da requisição.
+
+    Cada resposta é armazenada comprimida com gzip em
+    `<diretorio>/<endpoint>/<hash da url>.gz`. Uma resposta expira após o ttl do
+    seu endpoint e, quando o tamanho total ultrapassa o limite, as respostas
+    acessadas há mais tempo são removidas.
+    """
+
+    def __init__(
+        self,
+        diretorio: Path = config.dir_cache,
+        ttl: Optional[Dict[str, float]] = None,
+        tamanho_maximo: int = tamanho_maximo_padrao,
+    ) -> None:
+        """
+        Inicialização do cache.
+
+        Parameters
+        ----------
+        diretorio : Path
+            Diretório raiz do cache.
+
+        ttl : Optional[Dict[str, float]]
+            Tempo de validade, em segundos, por endpoint. Sobrescreve os valores
+            de `ttl_endpoints`.
+
+        tamanho_maximo : int
+            Tamanho máximo do cache em disco, em bytes.
+        """
+        self.diretorio = Path(diretorio)
+        self.ttl = {**ttl_endpoints, **(ttl or {})}
+        self.tamanho_maximo = tamanho_maximo
+        self.acertos = 0
+        self.faltas = 0
+        self._trava = threading.Lock()
+
+        self.diretorio.mkdir(parents=True, exist_ok=True)
+        self._tamanho = sum(a.stat().st_size for a in self._arquivos())
+
+    def _arquivos(self):
+        return self.diretorio.glob("**/*.gz")
+
+    def _caminho(self, endpoint: str, url: str) -> Path:
+        chave = hashlib.sha256(url.encode()).hexdigest()
+        return self.diretorio.joinpath(endpoint.replace("/", "-"), f"{chave}.gz")
+
+    def obter(self, endpoint: str, url: str) -> Optional[bytes]:
+        """
+        Obtém uma resposta do cache.
+
+        Parameters
+        ----------
+        endpoint : str
+            Nome do endpoint, utilizado para definir o tempo de validade.
+
+        url : str
+            Url completa da requisição.
+
+        Returns
+        -------
+        Optional[bytes]
+            Conteúdo da resposta, ou None caso não exista ou esteja expirada.
+        """
+        arquivo = self._caminho(endpoint, url)
+        ttl = self.ttl.get(endpoint, ttl_padrao)
+
+        try:
+            modificacao = arquivo.stat().st_mtime
+            idade = time.time() - modificacao
+            conteudo = gzip.decompress(arquivo.read_bytes()) if idade <= ttl else None
+        except (FileNotFoundError, OSError, EOFError):
+            conteudo = None
+
+        with self._trava:
+            if conteudo is None:
+                self.faltas += 1
+            else:
+                self.acertos += 1
+
+        if conteudo is not None:
+            # registra o acesso para a remoção por tamanho; o arquivo pode ter
+            # sido removido por outra thread após a leitura
+            try:
+                os.utime(arquivo, (time.time(), modificacao))
+            except FileNotFoundError:
+                pass
+
+        return conteudo
+
+    def salvar(self, endpoint: str, url: str, conteudo: bytes) -> None:
+        """
+        Salva uma resposta no cache.
+
+        Parameters
+        ----------
+        endpoint : str
+            Nome do endpoint da requisição.
+
+        url : str
+            Url completa da requisição.
+
+        conteudo : bytes
+            Conteúdo da resposta.
+        """
+        arquivo = self._caminho(endpoint, url)
+        arquivo.parent.mkdir(parents=True, exist_ok=True)
+
+        temporario = arquivo.with_name(f"{arquivo.name}.{threading.get_ident()}.tmp")
+        temporario.write_bytes(gzip.compress(conteudo))
+        tamanho_anterior = arquivo.stat().st_size if arquivo.exists() else 0
+        os.replace(temporario, arquivo)
+
+        with self._trava:
+            self._tamanho += arquivo.stat().st_size - tamanho_anterior
+            if self._tamanho > self.tamanho_maximo:
+                self._remover_excedente()
+
+    def _remover_excedente(self) -> None:
+        """Remove as respostas acessadas há mais tempo até respeitar o limite."""
+        arquivos = sorted(
+            ((a.stat().st_atime, a.stat().st_size, a) for a in self._arquivos()),
+            key=lambda x: x[0],
+        )
+        for _, tamanho, arquivo in arquivos:
+            if self._tamanho <= self.tamanho_maximo:
+                break
+            arquivo.unlink(missing_ok=True)
+            self._tamanho -= tamanho
+
+    def limpar(self) -> None:
+        """Remove todas as respostas do cache."""
+        with self._trava:
+            for arquivo in list(self._arquivos()):
+                arquivo.unlink(missing_ok=True)
+            self._tamanho = 0
+
+    @property
+    def estatisticas(self) -> Dict[str, float]:
+        """
+        Estatísticas de uso do cache.
+
+        Returns
+        -------
+        Dict[str, float]
+            Número de acertos e faltas, taxa de acerto e tamanho em disco, em
+            bytes.
+        """
+        total = self.acertos + self.faltas
+        return {
+            "acertos": self.acertos,
+            "faltas": self.faltas,
+            "taxa_acerto": self.acertos / total if total else 0.0,
+            "tamanho": self._tamanho,
+        }
@@ -11,22 +11,35 @@ dir_contorno = dir_shapefile.joinpath("iguacu.shp")
 dir_prec_ana = dir_arquivos.joinpath("series-chuva-ana")
 dir_prec_inmet = dir_arquivos.joinpath("series-chuva-inmet")
 dir_prec_concat = dir_arquivos.joinpath("series-concatenadas")
+dir_modelos_outliers = dir_prec_concat.joinpath("modelos-outliers")
+dir_vizinhos = dir_prec_concat.joinpath("vizinhos.npz")
 dir_merge = dir_arquivos.joinpath("merge")
 dir_merge_concat = dir_arquivos.joinpath("merge-concatenado")
+dir_merge_cubo = dir_merge_concat.joinpath("merge.zarr")
+dir_merge_cubo_pixels = dir_merge_concat.joinpath("merge_pixels.zarr")
+dir_merge_mascara = dir_merge_concat.joinpath("mascara.zarr")
+dir_merge_pesos = dir_merge_concat.joinpath("pesos.npz")
+dir_merge_zonas = dir_merge_concat.joinpath("pesos_zonas.npz")
+dir_correcao_merge = dir_merge_concat.joinpath("correcao_quantis.npz")
 dir_merge_posto = dir_arquivos.joinpath("merge-e-posto")
 dir_final = dir_arquivos.joinpath("series-preenchidas")
 dir_final_extra = dir_arquivos.joinpath("series-preenchidas-extra")
+dir_cache = dir_arquivos.joinpath("cache")
+dir_inventario = dir_arquivos.joinpath("inventario")
 
 dir_arquivos.mkdir(parents=True, exist_ok=True)
 dir_shapefile.mkdir(parents=True, exist_ok=True)
 dir_prec_ana.mkdir(parents=True, exist_ok=True)
 dir_prec_inmet.mkdir(parents=True, exist_ok=True)
 dir_prec_concat.mkdir(parents=True, exist_ok=True)
+dir_modelos_outliers.mkdir(parents=True, exist_ok=True)
 dir_merge.mkdir(parents=True, exist_ok=True)
 dir_merge_concat.mkdir(parents=True, exist_ok=True)
 dir_merge_posto.mkdir(parents=True, exist_ok=True)
 dir_final.mkdir(parents=True, exist_ok=True)
 dir_final_extra.mkdir(parents=True, exist_ok=True)
+dir_cache.mkdir(parents=True, exist_ok=True)
+dir_inventario.mkdir(parents=True, exist_ok=True)
 
 # epsg UTM da bacia do iguaçu
 epsg = "31985"
@@ -5,10 +5,15 @@ from typing import Optional
 
 import geopandas as gpd
 from geopandas.geodataframe import GeoDataFrame
+import numpy as np
 import pandas as pd
+from pyproj import Transformer
 import shapely
 from shapely.geometry import mapping
 
+from hidromet import config
+
+
 def obter_buffer(
     contorno: gpd.geodataframe.GeoDataFrame, distancia: float
 ) -> gpd.geodataframe.GeoDataFrame:
@@ -156,8 +161,136 @@ def recortar_postos(
     gpd.geodataframe.GeoDataFrame
         Lista de postos dentro do contorno.
     """
-    recorte = postos.geometry.within(contorno)
-    return postos.loc[recorte].to_frame()
+    dentro = postos.sindex.query(contorno, predicate="contains")
+    return postos.iloc[np.sort(dentro)].to_frame()
+
+
+def criar_pontos(
+    latitude: pd.Series, longitude: pd.Series, epsg: str = config.epsg_inicial
+) -> gpd.geoseries.GeoSeries:
+    """
+    Cria de uma só vez a série de pontos de um conjunto de coordenadas.
+
+    Parameters
+    ----------
+    latitude : pd.Series
+        Série de latitudes, indexada pelo código do posto.
+
+    longitude : pd.Series
+        Série de longitudes, com o mesmo índice das latitudes.
+
+    epsg : str
+        Código do sistema de coordenadas das coordenadas.
+
+    Returns
+    -------
+    gpd.geoseries.GeoSeries
+        Série de pontos com o mesmo índice das coordenadas.
+    """
+    pontos = gpd.points_from_xy(
+        pd.to_numeric(longitude), pd.to_numeric(latitude), crs=f"epsg:{epsg}"
+    )
+    return gpd.GeoSeries(pontos, index=latitude.index)
+
+
+def projetar_coordenadas(
+    latitude: np.ndarray, longitude: np.ndarray, epsg: str = config.epsg
+) -> np.ndarray:
+    """
+    Projeta coordenadas geográficas sem criar geometrias.
+
+    Parameters
+    ----------
+    latitude : np.ndarray
+        Latitudes, em graus.
+
+    longitude : np.ndarray
+        Longitudes, em graus.
+
+    epsg : str
+        Código do sistema de coordenadas projetado.
+
+    Returns
+    -------
+    np.ndarray
+        Coordenadas (x, y) projetadas, uma linha por ponto.
+    """
+    transformador = Transformer.from_crs(
+        f"epsg:{config.epsg_inicial}", f"epsg:{epsg}", always_xy=True
+    )
+    x, y = transformador.transform(np.asarray(longitude), np.asarray(latitude))
+    return np.column_stack([x, y])
+
+
+def coordenadas_geocentricas(latitude: np.ndarray, longitude: np.ndarray) -> np.ndarray:
+    """
+    Converte coordenadas geográficas em coordenadas geocêntricas (ECEF).
+
+    A distância euclidiana entre as coordenadas geocêntricas é a corda entre os
+    pontos sobre o elipsoide, em metros, válida em qualquer lugar do país e
+    igual à distância sobre a superfície para pontos próximos.
+
+    Parameters
+    ----------
+    latitude : np.ndarray
+        Latitudes, em graus.
+
+    longitude : np.ndarray
+        Longitudes, em graus.
+
+    Returns
+    -------
+    np.ndarray
+        Coordenadas (x, y, z) geocêntricas, em metros, uma linha por ponto.
+    """
+    transformador = Transformer.from_crs(
+        f"epsg:{config.epsg_inicial}", "epsg:4978", always_xy=True
+    )
+    longitude = np.asarray(longitude, dtype=float)
+    latitude = np.asarray(latitude, dtype=float)
+    x, y, z = transformador.transform(longitude, latitude, np.zeros_like(latitude))
+    return np.column_stack([x, y, z])
+
+
+def mapear_postos_bacias(
+    postos: gpd.geoseries.GeoSeries,
+    bacias: gpd.geodataframe.GeoDataFrame,
+    coluna: str = "bacia",
+) -> pd.Series:
+    """
+    Relaciona cada posto às bacias que o contêm.
+
+    Todos os polígonos são testados de uma só vez: o índice espacial dos postos
+    seleciona os candidatos pela caixa envolvente de cada polígono e o teste de
+    inclusão é feito apenas sobre eles.
+
+    Parameters
+    ----------
+    postos : gpd.geoseries.GeoSeries
+        Série de geometrias dos postos indexados pelo código.
+
+    bacias : gpd.geodataframe.GeoDataFrame
+        Contornos das bacias, como os polígonos de um shapefile.
+
+    coluna : str
+        Coluna com o nome de cada bacia.
+
+    Returns
+    -------
+    pd.Series
+        Nome da bacia de cada posto, indexado pelo código do posto. Postos fora
+        de todas as bacias não aparecem e postos em bacias sobrepostas aparecem
+        uma vez por bacia.
+    """
+    if postos.crs is not None and bacias.crs is not None:
+        bacias = bacias.to_crs(postos.crs)
+
+    pontos = gpd.GeoDataFrame(geometry=postos)
+    juncao = gpd.sjoin(
+        pontos, bacias[[coluna, "geometry"]], how="inner", predicate="within"
+    )
+
+    return juncao[coluna].sort_index()
 
 
 def zipar_coordenadas(
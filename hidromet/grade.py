@@ -1,13 +1,53 @@
 """Métodos utilitários para lidar com dados em grade."""
+import hashlib
+import json
 import os
+import shutil
 
 from pathlib import Path
+from typing import List
+from typing import Optional
+from typing import Tuple
 
+import dask.array
 import geopandas as gpd
+import numcodecs
+import numpy as np
+import pandas as pd
 import rioxarray
 import xarray as xr
+import zarr
+
+from scipy import sparse
+from scipy.spatial import cKDTree
+from shapely.geometry import box
 
 from hidromet import config
+from hidromet import contornos
+
+
+# dimensão temporal dos arquivos do merge
+dim_tempo = "valid_time"
+# coordenadas escalares dos gribs do merge que variam entre os arquivos diários
+coordenadas_grib = ["time", "step", "surface"]
+# variáveis dos gribs do merge que não são utilizadas
+variaveis_descartadas = ["prmsl"]
+# número de dias em cada chunk do cubo do merge
+dias_por_chunk = 32
+# número de pontos de grade em cada lado dos chunks do cubo por pixel
+celulas_por_bloco = 8
+# capacidade de dias de cada chunk do cubo por pixel (cerca de 45 anos)
+dias_por_chunk_pixels = 16384
+# memória máxima, em bytes, ocupada pela faixa lida na criação do cubo por pixel
+memoria_reorganizacao = 512 * 1024**2
+
+
+def _remover_grib(arquivo_grib: Path) -> None:
+    """Remove um grib e os índices criados pelo cfgrib."""
+    arquivos_indesejados = arquivo_grib.parent.glob(f"{arquivo_grib.name}*")
+    for arquivo in list(arquivos_indesejados):
+        if arquivo.suffix not in (".nc", ".part"):
+            os.remove(arquivo)
 
 
 def converter_grib_para_netcdf(
@@ -31,9 +71,1026 @@ def converter_grib_para_netcdf(
     ds.to_netcdf(arquivo_netcdf)
 
     if remover_arquivo_grib:
-        arquivos_indesejados = config.dir_merge.glob("*[!nc]")
-        for arquivo in list(arquivos_indesejados):
-            os.remove(arquivo)
+        _remover_grib(arquivo_grib)
+
+
+def _geografico(contorno: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    """Garante que o contorno esteja no sistema de coordenadas geográfico."""
+    if contorno.crs is None:
+        return contorno.set_crs(epsg=config.epsg_inicial)
+    return contornos.converter_epsg(contorno, config.epsg_inicial)
+
+
+def normalizar_longitude(dataset: xr.Dataset) -> xr.Dataset:
+    """
+    Converte as longitudes do dataset para o intervalo [-180, 180).
+
+    Parameters
+    ----------
+    dataset : xr.Dataset
+        Dataset com a dimensão longitude.
+
+    Returns
+    -------
+    xr.Dataset
+        Dataset ordenado pelas novas longitudes.
+    """
+    return dataset.assign_coords(
+        longitude=(((dataset.longitude + 180) % 360) - 180)
+    ).sortby("longitude")
+
+
+def criar_mascara(
+    dataset: xr.Dataset,
+    contorno: gpd.GeoDataFrame,
+    buffer: float = config.buffer,
+) -> xr.DataArray:
+    """
+    Calcula a máscara de recorte do merge para um contorno.
+
+    A máscara cobre a janela retangular do contorno acrescido do buffer dos
+    postos e marca os pontos de grade que tocam o contorno com buffer.
+
+    Parameters
+    ----------
+    dataset : xr.Dataset
+        Dataset de referência com a grade completa, com longitudes em [-180, 180).
+
+    contorno : gpd.GeoDataFrame
+        Contorno da bacia.
+
+    buffer : float
+        Distância, em metros, acrescida ao contorno.
+
+    Returns
+    -------
+    xr.DataArray
+        Máscara booleana sobre a janela do contorno.
+    """
+    contorno = _geografico(contorno)
+    projetado = contornos.converter_epsg(contorno, config.epsg)
+    contorno_buffer = projetado.buffer(buffer).to_crs(epsg=config.epsg_inicial)
+    lon_min, lat_min, lon_max, lat_max = contorno_buffer.total_bounds
+
+    resolucao_lon = float(np.abs(dataset.longitude.diff("longitude")).max())
+    resolucao_lat = float(np.abs(dataset.latitude.diff("latitude")).max())
+    janela = dataset.isel(
+        longitude=(
+            (dataset.longitude >= lon_min - resolucao_lon)
+            & (dataset.longitude <= lon_max + resolucao_lon)
+        ).values,
+        latitude=(
+            (dataset.latitude >= lat_min - resolucao_lat)
+            & (dataset.latitude <= lat_max + resolucao_lat)
+        ).values,
+    )
+
+    referencia = xr.ones_like(janela.latitude) * xr.ones_like(janela.longitude)
+    referencia = referencia.rio.set_spatial_dims(x_dim="longitude", y_dim="latitude")
+    referencia = referencia.rio.write_crs(f"epsg:{config.epsg_inicial}")
+    recortado = referencia.rio.clip(
+        contorno_buffer.geometry, f"epsg:{config.epsg_inicial}", all_touched=True
+    )
+
+    mascara = recortado.notnull().drop_vars("spatial_ref", errors="ignore")
+    mascara.attrs = {
+        "buffer": buffer,
+        "limites_contorno": [float(x) for x in contorno.total_bounds],
+    }
+
+    return mascara.rename("mascara")
+
+
+def obter_mascara(
+    dataset: xr.Dataset,
+    contorno: gpd.GeoDataFrame,
+    buffer: float = config.buffer,
+    arquivo: Path = config.dir_merge_mascara,
+) -> xr.DataArray:
+    """
+    Obtém a máscara de recorte do merge, calculando-a apenas uma vez.
+
+    A máscara é salva em disco e reaproveitada enquanto o contorno e o buffer
+    não mudarem.
+
+    Parameters
+    ----------
+    dataset : xr.Dataset
+        Dataset de referência com a grade completa.
+
+    contorno : gpd.GeoDataFrame
+        Contorno da bacia.
+
+    buffer : float
+        Distância, em metros, acrescida ao contorno.
+
+    arquivo : Path
+        Caminho para a máscara salva.
+
+    Returns
+    -------
+    xr.DataArray
+        Máscara booleana sobre a janela do contorno.
+    """
+    if arquivo.exists():
+        mascara = xr.open_zarr(arquivo).mascara.load()
+        limites = _geografico(contorno).total_bounds
+        if mascara.attrs.get("buffer") == buffer and np.allclose(
+            mascara.attrs.get("limites_contorno"), limites
+        ):
+            return mascara.astype(bool)
+
+    mascara = criar_mascara(dataset, contorno, buffer)
+    mascara.astype("int8").to_dataset().to_zarr(arquivo, mode="w")
+
+    return mascara
+
+
+def aplicar_mascara(dataset: xr.Dataset, mascara: xr.DataArray) -> xr.Dataset:
+    """
+    Recorta o dataset na janela da máscara e anula os pontos fora dela.
+
+    Parameters
+    ----------
+    dataset : xr.Dataset
+        Dataset com longitudes em [-180, 180).
+
+    mascara : xr.DataArray
+        Máscara obtida por `obter_mascara`.
+
+    Returns
+    -------
+    xr.Dataset
+        Dataset recortado.
+    """
+    janela = dataset.sel(latitude=mascara.latitude, longitude=mascara.longitude)
+    return janela.where(mascara)
+
+
+def ler_grib(
+    arquivo_grib: Path,
+    remover_arquivo_grib: bool = True,
+    mascara: Optional[xr.DataArray] = None,
+) -> xr.Dataset:
+    """
+    Lê um arquivo GRIB diário do merge para a memória.
+
+    As coordenadas escalares que variam entre os arquivos e as variáveis não
+    utilizadas são descartadas, as longitudes são convertidas para [-180, 180)
+    e a data do arquivo passa a ser a dimensão temporal do dataset. Caso uma
+    máscara seja passada, apenas a janela da bacia é carregada.
+
+    Parameters
+    ----------
+    arquivo_grib : Path
+        Caminho para o arquivo grib.
+
+    remover_arquivo_grib : bool
+        Caso seja desejado remover o arquivo grib do diretório após a leitura.
+
+    mascara : Optional[xr.DataArray]
+        Máscara de recorte obtida por `obter_mascara`.
+
+    Returns
+    -------
+    xr.Dataset
+        Dataset de um dia, com dimensões (valid_time, latitude, longitude).
+    """
+    with xr.open_dataset(arquivo_grib, engine="cfgrib") as ds:
+        ds = ds.drop_vars(coordenadas_grib + variaveis_descartadas, errors="ignore")
+        ds = normalizar_longitude(ds)
+        if mascara is not None:
+            ds = aplicar_mascara(ds, mascara)
+        if dim_tempo not in ds.dims:
+            ds = ds.expand_dims(dim_tempo)
+        ds = ds.load()
+
+    if remover_arquivo_grib:
+        _remover_grib(arquivo_grib)
+
+    return ds
+
+
+def datas_no_cubo(cubo: Path = config.dir_merge_cubo) -> pd.DatetimeIndex:
+    """
+    Obtém as datas já armazenadas no cubo do merge.
+
+    Apenas os metadados e a coordenada temporal do cubo são lidos.
+
+    Parameters
+    ----------
+    cubo : Path
+        Caminho para o cubo zarr.
+
+    Returns
+    -------
+    pd.DatetimeIndex
+        Datas presentes no cubo.
+    """
+    if not cubo.exists():
+        return pd.DatetimeIndex([])
+
+    with xr.open_zarr(cubo, consolidated=True) as ds:
+        return ds.indexes[dim_tempo]
+
+
+def anexar_ao_cubo(ds: xr.Dataset, cubo: Path = config.dir_merge_cubo) -> None:
+    """
+    Anexa um ou mais dias ao cubo do merge.
+
+    O cubo é um único armazenamento zarr, comprimido e dividido em chunks de
+    `dias_por_chunk` dias, criado na primeira chamada. Dias já presentes no
+    cubo são ignorados e os novos são escritos em ordem cronológica, de forma
+    que o eixo temporal do cubo é sempre crescente.
+
+    OBS: o cubo admite apenas um escritor por vez.
+
+    Parameters
+    ----------
+    ds : xr.Dataset
+        Dataset com a dimensão temporal `valid_time`.
+
+    cubo : Path
+        Caminho para o cubo zarr.
+    """
+    datas = datas_no_cubo(cubo)
+    ds = ds.isel({dim_tempo: ~ds.indexes[dim_tempo].isin(datas)}).sortby(dim_tempo)
+    if not ds.sizes[dim_tempo]:
+        return
+
+    if cubo.exists():
+        if len(datas) and ds.indexes[dim_tempo][0] < datas.max():
+            raise ValueError(
+                f"Dias anteriores ao último dia do cubo ({datas.max():%Y-%m-%d}) "
+                "não podem ser anexados: recrie o cubo para incluí-los."
+            )
+        ds.to_zarr(cubo, append_dim=dim_tempo, consolidated=True)
+        return
+
+    compressor = numcodecs.Blosc(
+        cname="zstd", clevel=3, shuffle=numcodecs.Blosc.BITSHUFFLE
+    )
+    encoding = {
+        variavel: {
+            "chunks": tuple(
+                dias_por_chunk if dim == dim_tempo else tamanho
+                for dim, tamanho in ds[variavel].sizes.items()
+            ),
+            "compressor": compressor,
+        }
+        for variavel in ds.data_vars
+    }
+    ds.to_zarr(cubo, mode="w", encoding=encoding, consolidated=True)
+
+
+def converter_grib_para_cubo(
+    arquivo_grib: Path,
+    cubo: Path = config.dir_merge_cubo,
+    remover_arquivo_grib: bool = True,
+    mascara: Optional[xr.DataArray] = None,
+) -> None:
+    """
+    Converte um arquivo GRIB diário e o anexa ao cubo do merge.
+
+    Parameters
+    ----------
+    arquivo_grib : Path
+        Caminho para o arquivo grib.
+
+    cubo : Path
+        Caminho para o cubo zarr.
+
+    remover_arquivo_grib : bool
+        Caso seja desejado remover o arquivo grib do diretório.
+
+    mascara : Optional[xr.DataArray]
+        Máscara de recorte obtida por `obter_mascara`.
+    """
+    anexar_ao_cubo(ler_grib(arquivo_grib, remover_arquivo_grib, mascara), cubo)
+
+
+def abrir_cubo(cubo: Path = config.dir_merge_cubo) -> xr.Dataset:
+    """
+    Abre o histórico completo do merge a partir do cubo.
+
+    A abertura lê apenas os metadados consolidados; os dados são carregados
+    sob demanda.
+
+    Parameters
+    ----------
+    cubo : Path
+        Caminho para o cubo zarr.
+
+    Returns
+    -------
+    xr.Dataset
+        Dataset do merge, ordenado pela dimensão temporal (ver `anexar_ao_cubo`).
+    """
+    return xr.open_zarr(cubo, consolidated=True)
+
+
+def celulas_na_bacia(
+    latitude: np.ndarray, longitude: np.ndarray, contorno: gpd.GeoDataFrame
+) -> np.ndarray:
+    """
+    Seleciona os pontos de grade dentro do contorno.
+
+    Apenas os pontos na caixa envolvente do contorno são testados.
+
+    Parameters
+    ----------
+    latitude : np.ndarray
+        Latitudes da grade.
+
+    longitude : np.ndarray
+        Longitudes da grade, em [-180, 180).
+
+    contorno : gpd.GeoDataFrame
+        Contorno da bacia.
+
+    Returns
+    -------
+    np.ndarray
+        Índices planos (na ordem latitude, longitude) dos pontos no contorno.
+    """
+    contorno = _geografico(contorno)
+    lon_min, lat_min, lon_max, lat_max = contorno.total_bounds
+    i_lat = np.flatnonzero((latitude >= lat_min) & (latitude <= lat_max))
+    i_lon = np.flatnonzero((longitude >= lon_min) & (longitude <= lon_max))
+    i_lat, i_lon = (i.ravel() for i in np.meshgrid(i_lat, i_lon, indexing="ij"))
+
+    pontos = gpd.GeoSeries(
+        gpd.points_from_xy(longitude[i_lon], latitude[i_lat]), crs=contorno.crs
+    )
+    dentro = pontos.intersects(contorno.unary_union).to_numpy()
+
+    return np.ravel_multi_index(
+        (i_lat[dentro], i_lon[dentro]), (len(latitude), len(longitude))
+    )
+
+
+def celulas_no_raio(
+    latitude: np.ndarray,
+    longitude: np.ndarray,
+    postos: pd.DataFrame,
+    contorno: gpd.GeoDataFrame,
+    raio: float = config.buffer,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Encontra os pontos de grade a até `raio` metros de cada posto, dentro da bacia.
+
+    Os pontos de grade da bacia são projetados em `config.epsg` e indexados em
+    uma árvore KD, consultada de uma só vez para todos os postos.
+
+    Parameters
+    ----------
+    latitude : np.ndarray
+        Latitudes da grade.
+
+    longitude : np.ndarray
+        Longitudes da grade, em [-180, 180).
+
+    postos : pd.DataFrame
+        Tabela de postos com as colunas "latitude" e "longitude".
+
+    contorno : gpd.GeoDataFrame
+        Contorno da bacia.
+
+    raio : float
+        Distância máxima, em metros, entre o posto e o ponto de grade.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        Pares (posição do posto na tabela, índice plano do ponto de grade na
+        ordem latitude, longitude), ordenados por posto.
+    """
+    latitude, longitude = np.asarray(latitude), np.asarray(longitude)
+    celulas = celulas_na_bacia(latitude, longitude, contorno)
+    i_lat, i_lon = np.unravel_index(celulas, (len(latitude), len(longitude)))
+    arvore = cKDTree(contornos.projetar_coordenadas(latitude[i_lat], longitude[i_lon]))
+
+    xy = contornos.projetar_coordenadas(postos["latitude"], postos["longitude"])
+    vizinhos = arvore.query_ball_point(xy, r=raio)
+    n_vizinhos = np.fromiter((len(v) for v in vizinhos), dtype=int, count=len(vizinhos))
+
+    indices_postos = np.repeat(np.arange(len(postos)), n_vizinhos)
+    indices_celulas = celulas[
+        np.concatenate(
+            [np.asarray(v, dtype=int) for v in vizinhos] + [np.empty(0, dtype=int)]
+        )
+    ]
+
+    return indices_postos, indices_celulas
+
+
+def _chave_pesos(
+    dataset: xr.Dataset,
+    postos: pd.DataFrame,
+    contorno: gpd.GeoDataFrame,
+    buffer: float,
+) -> str:
+    """Identifica os postos, a grade, o contorno e o buffer de uma matriz de pesos."""
+    chave = hashlib.sha256()
+    chave.update(json.dumps(postos["codigo"].astype(str).tolist()).encode())
+    for valores in (
+        postos["latitude"],
+        postos["longitude"],
+        dataset.latitude,
+        dataset.longitude,
+        _geografico(contorno).total_bounds,
+        [buffer],
+    ):
+        chave.update(np.asarray(valores, dtype=np.float64).tobytes())
+
+    return chave.hexdigest()
+
+
+def criar_matriz_pesos(
+    dataset: xr.Dataset,
+    postos: pd.DataFrame,
+    contorno: gpd.GeoDataFrame,
+    buffer: float = config.buffer,
+) -> sparse.csr_matrix:
+    """
+    Calcula a matriz esparsa de pesos (postos x células da grade).
+
+    Cada posto recebe peso igual para os pontos de grade dentro do seu buffer
+    recortado pelo contorno (ver `celulas_no_raio`), de forma que o produto da
+    matriz pela grade é a média desses pontos. As células são numeradas na
+    ordem (latitude, longitude) da grade do dataset.
+
+    Parameters
+    ----------
+    dataset : xr.Dataset
+        Dataset com as dimensões latitude e longitude, como o cubo do merge.
+
+    postos : pd.DataFrame
+        Tabela de postos com as colunas "codigo", "latitude" e "longitude".
+
+    contorno : gpd.GeoDataFrame
+        Contorno da bacia.
+
+    buffer : float
+        Raio, em metros, ao redor de cada posto.
+
+    Returns
+    -------
+    sparse.csr_matrix
+        Matriz de pesos, com uma linha por posto (na ordem da tabela).
+    """
+    linhas, colunas = celulas_no_raio(
+        dataset.latitude.values, dataset.longitude.values, postos, contorno, buffer
+    )
+    n_celulas = dataset.sizes["latitude"] * dataset.sizes["longitude"]
+
+    contagem = np.bincount(linhas, minlength=len(postos))
+    pesos = 1 / contagem[linhas]
+
+    return sparse.csr_matrix((pesos, (linhas, colunas)), shape=(len(postos), n_celulas))
+
+
+def obter_matriz_pesos(
+    dataset: xr.Dataset,
+    postos: pd.DataFrame,
+    contorno: gpd.GeoDataFrame,
+    buffer: float = config.buffer,
+    arquivo: Path = config.dir_merge_pesos,
+) -> sparse.csr_matrix:
+    """
+    Obtém a matriz de pesos dos postos, calculando-a apenas uma vez.
+
+    A matriz é salva em disco e reaproveitada enquanto os postos, a grade, o
+    contorno e o buffer não mudarem.
+
+    Parameters
+    ----------
+    dataset : xr.Dataset
+        Dataset com as dimensões latitude e longitude, como o cubo do merge.
+
+    postos : pd.DataFrame
+        Tabela de postos com as colunas "codigo", "latitude" e "longitude".
+
+    contorno : gpd.GeoDataFrame
+        Contorno da bacia.
+
+    buffer : float
+        Raio, em metros, ao redor de cada posto.
+
+    arquivo : Path
+        Caminho para a matriz salva.
+
+    Returns
+    -------
+    sparse.csr_matrix
+        Matriz de pesos, com uma linha por posto (na ordem da tabela).
+    """
+    chave = _chave_pesos(dataset, postos, contorno, buffer)
+    pesos = _carregar_esparsa(arquivo, chave)
+    if pesos is None:
+        pesos = criar_matriz_pesos(dataset, postos, contorno, buffer)
+        _salvar_esparsa(arquivo, pesos, chave)
+
+    return pesos
+
+
+def _carregar_esparsa(arquivo: Path, chave: str) -> Optional[sparse.csr_matrix]:
+    """Carrega uma matriz esparsa salva, caso ela tenha sido salva com a mesma chave."""
+    if not arquivo.exists():
+        return None
+
+    with np.load(arquivo) as salvo:
+        if salvo["chave"].item() != chave:
+            return None
+        return sparse.csr_matrix(
+            (salvo["data"], salvo["indices"], salvo["indptr"]),
+            shape=tuple(salvo["shape"]),
+        )
+
+
+def _salvar_esparsa(arquivo: Path, matriz: sparse.csr_matrix, chave: str) -> None:
+    np.savez(
+        arquivo,
+        data=matriz.data,
+        indices=matriz.indices,
+        indptr=matriz.indptr,
+        shape=matriz.shape,
+        chave=chave,
+    )
+
+
+def media_ponderada(pesos: sparse.csr_matrix, valores: np.ndarray) -> np.ndarray:
+    """
+    Calcula a média ponderada das células de cada linha da matriz de pesos.
+
+    As células sem dado são desconsideradas e os pesos das demais são
+    renormalizados. Para um único dia, é apenas um produto esparso.
+
+    Parameters
+    ----------
+    pesos : sparse.csr_matrix
+        Matriz de pesos (linhas x células).
+
+    valores : np.ndarray
+        Valores das células, como vetor (células) ou matriz (células x dias).
+
+    Returns
+    -------
+    np.ndarray
+        Média de cada linha, com a mesma forma dos valores (linhas ou linhas x
+        dias). Linhas sem nenhuma célula com dado resultam em NaN.
+    """
+    validos = ~np.isnan(valores)
+    soma = pesos @ np.where(validos, valores, 0)
+    peso_valido = pesos @ validos
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(peso_valido > 0, soma / peso_valido, np.nan)
+
+
+def extrair_series(
+    dataset: xr.Dataset,
+    pesos: sparse.csr_matrix,
+    codigos: List[str],
+    variavel: str = "prec",
+    dias_por_bloco: int = 12 * dias_por_chunk,
+) -> pd.DataFrame:
+    """
+    Extrai a série de satélite de todos os postos por produto esparso.
+
+    A grade é lida em blocos de dias; em cada bloco, a média dos pontos de cada
+    posto é calculada por `media_ponderada`.
+
+    Parameters
+    ----------
+    dataset : xr.Dataset
+        Dataset com as dimensões de tempo, latitude e longitude.
+
+    pesos : sparse.csr_matrix
+        Matriz obtida por `obter_matriz_pesos` para a mesma grade.
+
+    codigos : List[str]
+        Códigos dos postos, na ordem das linhas da matriz.
+
+    variavel : str
+        Variável do dataset.
+
+    dias_por_bloco : int
+        Número de dias lidos por vez.
+
+    Returns
+    -------
+    pd.DataFrame
+        Série de satélite de cada posto, indexada por data.
+    """
+    grade = dataset[variavel].transpose(dim_tempo, "latitude", "longitude")
+    n_dias = grade.sizes[dim_tempo]
+
+    blocos = list()
+    for inicio in range(0, n_dias, dias_por_bloco):
+        valores = grade.isel({dim_tempo: slice(inicio, inicio + dias_por_bloco)})
+        valores = np.asarray(valores.values, dtype=np.float64)
+        blocos.append(media_ponderada(pesos, valores.reshape(len(valores), -1).T))
+
+    series = np.concatenate(blocos, axis=1).T if blocos else np.empty((0, len(codigos)))
+    datas = pd.DatetimeIndex(grade[dim_tempo].values, name="data").normalize()
+
+    return pd.DataFrame(series, index=datas, columns=list(codigos))
+
+
+def _estrutura_cubo_pixels(origem: xr.Dataset) -> xr.Dataset:
+    """Estrutura (sem dados) do cubo por pixel para o dataset de origem."""
+    variaveis = dict()
+    for nome, variavel in origem.data_vars.items():
+        dims = (dim_tempo, "latitude", "longitude")
+        forma = tuple(origem.sizes[dim] for dim in dims)
+        variaveis[nome] = (
+            dims,
+            dask.array.full(forma, np.nan, dtype=variavel.dtype, chunks=forma),
+            variavel.attrs,
+        )
+
+    return xr.Dataset(
+        variaveis,
+        coords={
+            dim_tempo: origem[dim_tempo].values,
+            "latitude": origem.latitude.values,
+            "longitude": origem.longitude.values,
+        },
+    )
+
+
+def criar_cubo_pixels(
+    cubo: Path = config.dir_merge_cubo,
+    cubo_pixels: Path = config.dir_merge_cubo_pixels,
+    memoria_maxima: int = memoria_reorganizacao,
+) -> None:
+    """
+    Cria a cópia do cubo do merge organizada por pixel.
+
+    No cubo por pixel, cada chunk guarda todos os dias de um bloco de
+    `celulas_por_bloco` x `celulas_por_bloco` pontos de grade, de forma que a
+    série completa de um ponto é lida de um único chunk. A cópia é feita em
+    faixas de latitudes, uma por vez, de forma que a memória utilizada não
+    passa de `memoria_maxima`.
+
+    Como cada chunk do cubo original guarda a grade inteira, ler uma faixa dele
+    lê o cubo todo. Quando há mais de uma faixa, o cubo original é lido uma
+    única vez, em lotes de dias, e regravado em um cubo intermediário dividido
+    por faixa (`<cubo_pixels>.tmp`), do qual cada faixa é lida sozinha.
+
+    Parameters
+    ----------
+    cubo : Path
+        Caminho para o cubo zarr do merge.
+
+    cubo_pixels : Path
+        Caminho para o cubo zarr organizado por pixel.
+
+    memoria_maxima : int
+        Memória máxima, em bytes, ocupada por cada faixa lida.
+    """
+    origem = abrir_cubo(cubo)
+    estrutura = _estrutura_cubo_pixels(origem)
+
+    compressor = numcodecs.Blosc(
+        cname="zstd", clevel=3, shuffle=numcodecs.Blosc.BITSHUFFLE
+    )
+    chunks = (dias_por_chunk_pixels, celulas_por_bloco, celulas_por_bloco)
+    encoding = {
+        nome: {"chunks": chunks, "compressor": compressor}
+        for nome in estrutura.data_vars
+    }
+    encoding[dim_tempo] = {"units": "hours since 1970-01-01", "dtype": "int64"}
+    estrutura.to_zarr(
+        cubo_pixels, mode="w", encoding=encoding, compute=False, consolidated=True
+    )
+
+    destino = zarr.open_group(str(cubo_pixels), mode="r+")
+    n_dias, n_lat, n_lon = (
+        origem.sizes[d] for d in (dim_tempo, "latitude", "longitude")
+    )
+    intermediario = cubo_pixels.with_name(f"{cubo_pixels.name}.tmp")
+    for nome, variavel in origem.data_vars.items():
+        itemsize = variavel.dtype.itemsize
+        linhas = max(memoria_maxima // (n_dias * n_lon * itemsize), 1)
+        linhas = max(linhas // celulas_por_bloco, 1) * celulas_por_bloco
+
+        variavel = variavel.transpose(dim_tempo, "latitude", "longitude")
+        if linhas >= n_lat:
+            destino[nome][:] = variavel.values
+            continue
+
+        # lotes de dias múltiplos dos chunks do cubo original, lidos uma vez
+        dias_origem = variavel.encoding.get("chunks", (dias_por_chunk,))[0]
+        dias = max(memoria_maxima // (n_lat * n_lon * itemsize), 1)
+        dias = max(dias // dias_origem, 1) * dias_origem
+
+        faixas = zarr.open_array(
+            str(intermediario),
+            mode="w",
+            shape=(n_dias, n_lat, n_lon),
+            chunks=(dias, linhas, n_lon),
+            dtype=variavel.dtype,
+            compressor=numcodecs.Blosc(cname="lz4", clevel=1),
+        )
+        try:
+            for inicio in range(0, n_dias, dias):
+                lote = slice(inicio, inicio + dias)
+                faixas[lote] = variavel.isel({dim_tempo: lote}).values
+
+            for inicio in range(0, n_lat, linhas):
+                faixa = slice(inicio, inicio + linhas)
+                destino[nome][:, faixa, :] = faixas[:, faixa, :]
+        finally:
+            shutil.rmtree(intermediario, ignore_errors=True)
+
+
+def atualizar_cubo_pixels(
+    cubo: Path = config.dir_merge_cubo,
+    cubo_pixels: Path = config.dir_merge_cubo_pixels,
+    minimo_dias: int = dias_por_chunk,
+    memoria_maxima: int = memoria_reorganizacao,
+) -> int:
+    """
+    Anexa ao cubo por pixel os dias novos do cubo do merge.
+
+    Como anexar dias reescreve todos os chunks do cubo por pixel, os dias são
+    acumulados no cubo original e anexados em lotes de pelo menos
+    `minimo_dias`; `serie_pixel` completa a série com os dias ainda não
+    anexados. Caso o cubo original tenha recebido dias anteriores ao fim do
+    cubo por pixel, a cópia é refeita.
+
+    Parameters
+    ----------
+    cubo : Path
+        Caminho para o cubo zarr do merge.
+
+    cubo_pixels : Path
+        Caminho para o cubo zarr organizado por pixel.
+
+    minimo_dias : int
+        Número mínimo de dias novos para que o lote seja anexado.
+
+    memoria_maxima : int
+        Memória máxima utilizada caso a cópia precise ser refeita.
+
+    Returns
+    -------
+    int
+        Número de dias anexados.
+    """
+    if not cubo_pixels.exists():
+        criar_cubo_pixels(cubo, cubo_pixels, memoria_maxima)
+        return datas_no_cubo(cubo_pixels).size
+
+    datas = datas_no_cubo(cubo)
+    datas_pixels = datas_no_cubo(cubo_pixels)
+    novas = datas[~datas.isin(datas_pixels)]
+    if novas.size and datas_pixels.size and novas.min() < datas_pixels.max():
+        criar_cubo_pixels(cubo, cubo_pixels, memoria_maxima)
+        return novas.size
+    if novas.size < max(minimo_dias, 1):
+        return 0
+
+    origem = abrir_cubo(cubo).sel({dim_tempo: novas.sort_values()})
+    destino = zarr.open_group(str(cubo_pixels), mode="r+")
+
+    n_atual = destino[dim_tempo].shape[0]
+    n_novo = n_atual + origem.sizes[dim_tempo]
+    horas = (origem.indexes[dim_tempo] - pd.Timestamp("1970-01-01")) // pd.Timedelta(
+        hours=1
+    )
+    destino[dim_tempo].resize(n_novo)
+    destino[dim_tempo][n_atual:] = np.asarray(horas, dtype=np.int64)
+
+    for nome, variavel in origem.data_vars.items():
+        destino[nome].resize((n_novo, *destino[nome].shape[1:]))
+        variavel = variavel.transpose(dim_tempo, "latitude", "longitude")
+        destino[nome][n_atual:] = variavel.values
+
+    zarr.consolidate_metadata(str(cubo_pixels))
+
+    return origem.sizes[dim_tempo]
+
+
+def serie_pixel(
+    latitude: float,
+    longitude: float,
+    variavel: str = "prec",
+    cubo: Path = config.dir_merge_cubo,
+    cubo_pixels: Path = config.dir_merge_cubo_pixels,
+) -> pd.Series:
+    """
+    Obtém a série completa do ponto de grade mais próximo de uma coordenada.
+
+    A série é lida do cubo por pixel (um chunk) e completada com os dias do
+    cubo do merge ainda não anexados a ele.
+
+    Parameters
+    ----------
+    latitude : float
+        Latitude da coordenada.
+
+    longitude : float
+        Longitude da coordenada, em [-180, 180).
+
+    variavel : str
+        Variável do dataset.
+
+    cubo : Path
+        Caminho para o cubo zarr do merge.
+
+    cubo_pixels : Path
+        Caminho para o cubo zarr organizado por pixel.
+
+    Returns
+    -------
+    pd.Series
+        Série do ponto de grade, indexada por data.
+    """
+    pixels = xr.open_zarr(cubo_pixels, consolidated=True)
+    ponto = pixels[variavel].sel(
+        latitude=latitude, longitude=longitude, method="nearest"
+    )
+    serie = ponto.to_series()
+
+    pendentes = datas_no_cubo(cubo)
+    pendentes = pendentes[pendentes > serie.index.max()]
+    if pendentes.size:
+        cauda = abrir_cubo(cubo)[variavel].sel({dim_tempo: pendentes.sort_values()})
+        cauda = cauda.sel(latitude=latitude, longitude=longitude, method="nearest")
+        serie = pd.concat([serie, cauda.to_series()])
+
+    serie.index = pd.DatetimeIndex(serie.index, name="data")
+    return serie.rename(variavel)
+
+
+def _limites_celulas(coordenadas: np.ndarray) -> np.ndarray:
+    """Limites das células de uma grade regular a partir dos seus centros."""
+    meios = (coordenadas[1:] + coordenadas[:-1]) / 2
+    primeiro = coordenadas[0] - (meios[0] - coordenadas[0])
+    ultimo = coordenadas[-1] + (coordenadas[-1] - meios[-1])
+    return np.concatenate([[primeiro], meios, [ultimo]])
+
+
+def criar_pesos_zonas(
+    latitude: np.ndarray, longitude: np.ndarray, zonas: gpd.GeoDataFrame
+) -> sparse.csr_matrix:
+    """
+    Calcula a área de cada célula da grade coberta por cada zona.
+
+    As células são retângulos ao redor dos pontos de grade. Apenas as células
+    que tocam cada zona são intersectadas, e as áreas são medidas em
+    `config.epsg`. Dividida pela soma da linha, cada linha dá a fração de cada
+    célula na média areal da zona.
+
+    Parameters
+    ----------
+    latitude : np.ndarray
+        Latitudes da grade, com ao menos dois pontos.
+
+    longitude : np.ndarray
+        Longitudes da grade, em [-180, 180), com ao menos dois pontos.
+
+    zonas : gpd.GeoDataFrame
+        Polígonos das zonas (bacias e sub-bacias).
+
+    Returns
+    -------
+    sparse.csr_matrix
+        Matriz (zonas x células) com a área, em m², de cada interseção.
+    """
+    zonas = _geografico(zonas)
+    limites_lat = _limites_celulas(np.asarray(latitude))
+    limites_lon = _limites_celulas(np.asarray(longitude))
+
+    lon_min, lat_min, lon_max, lat_max = zonas.total_bounds
+    i_lat = np.flatnonzero(
+        (np.maximum(limites_lat[:-1], limites_lat[1:]) >= lat_min)
+        & (np.minimum(limites_lat[:-1], limites_lat[1:]) <= lat_max)
+    )
+    i_lon = np.flatnonzero((limites_lon[1:] >= lon_min) & (limites_lon[:-1] <= lon_max))
+    i_lat, i_lon = (i.ravel() for i in np.meshgrid(i_lat, i_lon, indexing="ij"))
+
+    celulas = gpd.GeoDataFrame(
+        {
+            "celula": np.ravel_multi_index(
+                (i_lat, i_lon), (len(latitude), len(longitude))
+            )
+        },
+        geometry=[
+            box(x0, y0, x1, y1)
+            for x0, y0, x1, y1 in zip(
+                limites_lon[i_lon],
+                limites_lat[i_lat],
+                limites_lon[i_lon + 1],
+                limites_lat[i_lat + 1],
+            )
+        ],
+        crs=zonas.crs,
+    ).to_crs(epsg=config.epsg)
+    poligonos = gpd.GeoDataFrame(
+        {"zona": np.arange(len(zonas))}, geometry=zonas.geometry.values, crs=zonas.crs
+    ).to_crs(epsg=config.epsg)
+
+    pares = gpd.sjoin(celulas, poligonos, how="inner", predicate="intersects")
+    areas = (
+        pares.geometry.reset_index(drop=True)
+        .intersection(
+            poligonos.geometry.iloc[pares["zona"].to_numpy()].reset_index(drop=True)
+        )
+        .area.to_numpy()
+    )
+
+    return sparse.csr_matrix(
+        (areas, (pares["zona"].to_numpy(), pares["celula"].to_numpy())),
+        shape=(len(zonas), len(latitude) * len(longitude)),
+    )
+
+
+def obter_pesos_zonas(
+    dataset: xr.Dataset,
+    zonas: gpd.GeoDataFrame,
+    arquivo: Path = config.dir_merge_zonas,
+) -> sparse.csr_matrix:
+    """
+    Obtém as áreas de interseção entre as células e as zonas, uma única vez.
+
+    As áreas são salvas em disco e reaproveitadas enquanto a grade e os
+    polígonos não mudarem.
+
+    Parameters
+    ----------
+    dataset : xr.Dataset
+        Dataset com as dimensões latitude e longitude, como o cubo do merge.
+
+    zonas : gpd.GeoDataFrame
+        Polígonos das zonas, como os de `config.dir_contorno`.
+
+    arquivo : Path
+        Caminho para as áreas salvas.
+
+    Returns
+    -------
+    sparse.csr_matrix
+        Matriz (zonas x células) com a área, em m², de cada interseção.
+    """
+    chave = hashlib.sha256()
+    for valores in (dataset.latitude, dataset.longitude):
+        chave.update(np.asarray(valores, dtype=np.float64).tobytes())
+    for geometria in _geografico(zonas).geometry:
+        chave.update(geometria.wkb)
+    chave = chave.hexdigest()
+
+    pesos = _carregar_esparsa(arquivo, chave)
+    if pesos is None:
+        pesos = criar_pesos_zonas(
+            dataset.latitude.values, dataset.longitude.values, zonas
+        )
+        _salvar_esparsa(arquivo, pesos, chave)
+
+    return pesos
+
+
+def media_areal(
+    dataset: xr.Dataset,
+    zonas: gpd.GeoDataFrame,
+    coluna: str = "bacia",
+    variavel: str = "prec",
+    arquivo: Path = config.dir_merge_zonas,
+) -> pd.DataFrame:
+    """
+    Calcula a chuva média diária de todas as zonas de uma só vez.
+
+    Cada célula contribui para a média de uma zona com a área que ela tem em
+    comum com a zona. Para um dia novo, basta `media_ponderada` com os pesos de
+    `obter_pesos_zonas` sobre os valores do dia.
+
+    Parameters
+    ----------
+    dataset : xr.Dataset
+        Dataset com as dimensões de tempo, latitude e longitude, como o cubo do
+        merge.
+
+    zonas : gpd.GeoDataFrame
+        Polígonos das zonas, como os de `config.dir_contorno`.
+
+    coluna : str
+        Coluna com o nome de cada zona.
+
+    variavel : str
+        Variável do dataset.
+
+    arquivo : Path
+        Caminho para as áreas salvas.
+
+    Returns
+    -------
+    pd.DataFrame
+        Chuva média de cada zona, indexada por data.
+    """
+    pesos = obter_pesos_zonas(dataset, zonas, arquivo)
+    return extrair_series(dataset, pesos, zonas[coluna].tolist(), variavel)
 
 
 def preparar_para_recorte(
@@ -0,0 +1,295 @@
+"""Atualização incremental das séries de chuva já armazenadas."""
+from datetime import date
+from pathlib import Path
+from typing import Callable
+from typing import Dict
+from typing import Literal
+from typing import Optional
+from typing import Tuple
+
+import pandas as pd
+
+from hidromet import armazenamento
+from hidromet import limpeza
+from hidromet import requisicoes
+from hidromet.ANA import ANA
+from hidromet.INMET import INMET
+
+
+def ultimas_datas(series: pd.DataFrame) -> pd.Series:
+    """
+    Obtém a última data com dado de cada posto.
+
+    Parameters
+    ----------
+    series : pd.DataFrame
+        Séries de chuva indexadas por data, com uma coluna por posto.
+
+    Returns
+    -------
+    pd.Series
+        Última data válida de cada posto (NaT caso o posto não tenha dados).
+    """
+    return pd.to_datetime(series.apply(pd.Series.last_valid_index))
+
+
+def inicio_atualizacao(series: pd.DataFrame, data_inicial: date) -> pd.Series:
+    """
+    Calcula a data a partir da qual cada posto deve ser requisitado novamente.
+
+    A atualização começa no primeiro dia do mês da última observação, de forma
+    que o mês sobreposto seja conferido contra revisões de consistência. Postos
+    sem nenhum dado começam na data inicial do histórico.
+
+    Parameters
+    ----------
+    series : pd.DataFrame
+        Séries de chuva armazenadas.
+
+    data_inicial : date
+        Data de início do histórico completo.
+
+    Returns
+    -------
+    pd.Series
+        Data de início da atualização de cada posto.
+    """
+    ultimas = ultimas_datas(series)
+    inicios = ultimas.dt.to_period("M").dt.to_timestamp()
+
+    return inicios.fillna(pd.Timestamp(data_inicial))
+
+
+def limpar_cauda(serie: pd.Series) -> pd.Series:
+    """
+    Aplica à cauda baixada as verificações pontuais do histórico.
+
+    OBS: as verificações mensais (`limpeza.remover_meses_nao_representativos`)
+    não são aplicadas, já que o mês corrente ainda está incompleto.
+
+    Parameters
+    ----------
+    serie : pd.Series
+        Cauda da série de um posto.
+
+    Returns
+    -------
+    pd.Series
+        Cauda sem datas duplicadas, outliers e valores negativos.
+    """
+    serie = limpeza.remover_duplicados(serie.to_frame()).iloc[:, 0]
+    serie = limpeza.remover_outliers(serie)
+    serie = limpeza.substituir_negativos(serie)
+
+    return serie
+
+
+def mesclar_caudas(
+    series: pd.DataFrame, caudas: Dict[str, pd.Series], inicios: pd.Series
+) -> pd.DataFrame:
+    """
+    Substitui o período revisado de cada posto pela cauda baixada.
+
+    Entre a data de início e o último dia da cauda, os dados armazenados são
+    substituídos pela cauda, inclusive pelas suas falhas (valores removidos na
+    revisão de consistência ou anulados por `limpar_cauda`). Uma cauda vazia ou
+    mais curta que o período revisado (falha do serviço, por exemplo) mantém os
+    dados armazenados nos dias posteriores ao seu fim.
+
+    Parameters
+    ----------
+    series : pd.DataFrame
+        Séries de chuva armazenadas.
+
+    caudas : Dict[str, pd.Series]
+        Cauda baixada de cada posto, a partir da sua data de início.
+
+    inicios : pd.Series
+        Data de início da atualização de cada posto.
+
+    Returns
+    -------
+    pd.DataFrame
+        Séries atualizadas.
+    """
+    revisadas = dict()
+    for codigo, cauda in caudas.items():
+        if not cauda.empty:
+            cauda = cauda[cauda.index >= inicios[codigo]]
+        if not cauda.empty:
+            revisadas[codigo] = cauda
+
+    indice = series.index
+    for cauda in revisadas.values():
+        indice = indice.union(cauda.index)
+
+    atualizado = series.reindex(indice)
+    for codigo, cauda in revisadas.items():
+        periodo = (indice >= inicios[codigo]) & (indice <= cauda.index.max())
+        atualizado.loc[periodo, codigo] = cauda.reindex(indice[periodo]).values
+
+    return atualizado
+
+
+def _atualizar(
+    series: pd.DataFrame,
+    obter_cauda: Callable[[str, pd.Timestamp], pd.Series],
+    data_inicial: date,
+    max_workers: int,
+) -> Tuple[pd.DataFrame, Dict[str, Exception]]:
+    series = series.copy()
+    series.index = pd.to_datetime(series.index)
+    inicios = inicio_atualizacao(series, data_inicial)
+
+    caudas, erros = dict(), dict()
+    resultados = requisicoes.executar_em_paralelo(
+        lambda codigo: limpar_cauda(obter_cauda(codigo, inicios[codigo])),
+        series.columns,
+        max_workers=max_workers,
+    )
+    for codigo, resultado in resultados:
+        if isinstance(resultado, Exception):
+            erros[codigo] = resultado
+        else:
+            caudas[codigo] = resultado
+
+    return mesclar_caudas(series, caudas, inicios), erros
+
+
+def atualizar_ana(
+    series: pd.DataFrame,
+    ana: Optional[ANA] = None,
+    data_inicial: date = date(2000, 1, 1),
+    data_final: Optional[date] = None,
+    max_workers: int = requisicoes.max_conexoes,
+) -> Tuple[pd.DataFrame, Dict[str, Exception]]:
+    """
+    Atualiza as séries de postos da ANA requisitando apenas o período faltante.
+
+    Parameters
+    ----------
+    series : pd.DataFrame
+        Séries de chuva armazenadas, com uma coluna por código de posto.
+
+    ana : Optional[ANA]
+        Cliente da ANA. Caso não seja passado, um novo cliente é criado.
+
+    data_inicial : date
+        Data de início do histórico, usada para postos sem nenhum dado.
+
+    data_final : Optional[date]
+        Data final da atualização. Por padrão, o dia atual.
+
+    max_workers : int
+        Número máximo de requisições simultâneas.
+
+    Returns
+    -------
+    Tuple[pd.DataFrame, Dict[str, Exception]]
+        Séries atualizadas e os erros dos postos que não puderam ser
+        atualizados (esses postos permanecem como estavam).
+    """
+    ana = ana or ANA()
+    fim = (data_final or date.today()).strftime("%d/%m/%Y")
+
+    def obter_cauda(codigo: str, inicio: pd.Timestamp) -> pd.Series:
+        df = ana.obter_chuva(
+            cod_estacao=codigo, data_inicial=inicio.strftime("%d/%m/%Y"), data_final=fim
+        )
+        return df[codigo]
+
+    return _atualizar(series, obter_cauda, data_inicial, max_workers)
+
+
+def atualizar_inmet(
+    series: pd.DataFrame,
+    inmet: Optional[INMET] = None,
+    data_inicial: date = date(2000, 1, 1),
+    data_final: Optional[date] = None,
+    max_workers: int = requisicoes.max_conexoes,
+) -> Tuple[pd.DataFrame, Dict[str, Exception]]:
+    """
+    Atualiza as séries de estações do INMET requisitando apenas o período faltante.
+
+    Parameters
+    ----------
+    series : pd.DataFrame
+        Séries de chuva diária armazenadas, com uma coluna por código de estação.
+
+    inmet : Optional[INMET]
+        Cliente do INMET. Caso não seja passado, um novo cliente é criado.
+
+    data_inicial : date
+        Data de início do histórico, usada para estações sem nenhum dado.
+
+    data_final : Optional[date]
+        Data final da atualização. Por padrão, o dia atual.
+
+    max_workers : int
+        Número máximo de requisições simultâneas.
+
+    Returns
+    -------
+    Tuple[pd.DataFrame, Dict[str, Exception]]
+        Séries atualizadas e os erros das estações que não puderam ser
+        atualizadas (essas estações permanecem como estavam).
+    """
+    inmet = inmet or INMET()
+    fim = (data_final or date.today()).strftime("%Y-%m-%d")
+
+    def obter_cauda(codigo: str, inicio: pd.Timestamp) -> pd.Series:
+        df = inmet.obter_serie_estacao(
+            data_inicial=inicio.strftime("%Y-%m-%d"),
+            data_final=fim,
+            cod_estacao=codigo,
+            freq="D",
+            # as estações já são requisitadas em paralelo
+            max_workers=1,
+        )
+        serie = df.get("CHUVA", pd.Series(dtype=float)).rename(codigo)
+        return serie.dropna()
+
+    return _atualizar(series, obter_cauda, data_inicial, max_workers)
+
+
+def atualizar_arquivo(
+    arquivo: Path, fonte: Literal["ANA", "INMET"], **kwargs
+) -> Dict[str, Exception]:
+    """
+    Atualiza incrementalmente um arquivo de séries de uma bacia.
+
+    Arquivos ".parquet" são lidos e gravados por `armazenamento`, mantendo os
+    metadados dos postos; os demais são tratados como csv.
+
+    Parameters
+    ----------
+    arquivo : Path
+        Arquivo das séries, como `config.dir_prec_ana/<bacia>.csv`.
+
+    fonte : {"ANA", "INMET"}
+        Fonte dos dados do arquivo.
+
+    **kwargs
+        Argumentos repassados para `atualizar_ana` ou `atualizar_inmet`.
+
+    Returns
+    -------
+    Dict[str, Exception]
+        Erros dos postos que não puderam ser atualizados.
+    """
+    parquet = Path(arquivo).suffix == ".parquet"
+    if parquet:
+        series = armazenamento.ler_series(arquivo)
+    else:
+        series = pd.read_csv(arquivo, index_col=0)
+    atualizar = atualizar_ana if fonte == "ANA" else atualizar_inmet
+
+    atualizado, erros = atualizar(series, **kwargs)
+    if parquet:
+        metadados = armazenamento.ler_metadados(arquivo)
+        armazenamento.salvar_series(atualizado, arquivo, metadados)
+    else:
+        atualizado.index = atualizado.index.strftime("%Y-%m-%d")
+        atualizado.to_csv(arquivo)
+
+    return erros
@@ -1,10 +1,20 @@
 """Funções para a limpeza de séries."""
 
 from datetime import date
+from typing import List
+from typing import Optional
+from typing import Tuple
 
 import numpy as np
 import pandas as pd
 
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+
+from hidromet import contornos
+from hidromet import modelos
+
 
 def remover_codigos_duplicados(df: pd.DataFrame) -> pd.DataFrame:
     """
@@ -152,12 +162,51 @@ def recortar_periodo(serie: pd.Series, inicio: date, fim: date) -> pd.Series:
     return serie[(serie.index >= inicio) & (serie.index <= fim)]
 
 
+def contar_dias_por_mes(df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Conta os dias com dados de cada mês de cada posto em uma única passada.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Séries de dados indexadas por data, com uma coluna por posto.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        Matriz (meses x postos) com a contagem de dias com dados e o código do
+        mês de cada linha do dataframe, que indexa a primeira dimensão da
+        matriz.
+    """
+    return _contar_dias_por_mes(df.notna().to_numpy(), pd.DatetimeIndex(df.index))
+
+
+def _contar_dias_por_mes(
+    validos: np.ndarray, datas: pd.DatetimeIndex
+) -> Tuple[np.ndarray, np.ndarray]:
+    meses = np.asarray(datas.year * 12 + datas.month - 1)
+    _, codigos = np.unique(meses, return_inverse=True)
+    codigos = codigos.ravel()
+    n_meses = codigos.max() + 1 if len(codigos) else 0
+    n_postos = validos.shape[1]
+
+    posicoes = codigos[:, None] * n_postos + np.arange(n_postos)
+    contagem = np.bincount(
+        posicoes.ravel(), weights=validos.ravel(), minlength=n_meses * n_postos
+    )
+
+    return contagem.reshape(n_meses, n_postos), codigos
+
+
 def remover_meses_nao_representativos(
     df: pd.DataFrame, limite: int = 15
 ) -> pd.DataFrame:
     """
     Remove meses com menos de x dias de dados.
 
+    OBS: a representatividade é avaliada sobre a primeira coluna. Para
+    dataframes com vários postos, utilize `mascarar_meses_nao_representativos`.
+
     Parameters
     ----------
     df : pd.DataFrame
@@ -172,14 +221,57 @@ def remover_meses_nao_representativos(
         Série de dados contendo apenas meses com mais de
         15 dias de representatividade.
     """
-    contagem = df.groupby([(df.index.year), (df.index.month)]).count()
-    for ano, mes in contagem.index:
-        dias = contagem.loc[(ano, mes)].values[0]
-        if dias < limite:
-            condicao = (df.index.month == mes) & (df.index.year == ano)
-            df.drop(df.loc[condicao].index, axis=0, inplace=True)
+    contagem, codigos = contar_dias_por_mes(df)
+    if not contagem.size:
+        return df
+
+    falhos = contagem[:, 0] < limite
+
+    return df.loc[~falhos[codigos]]
+
+
+def mascarar_meses_nao_representativos(
+    df: pd.DataFrame, limite: int = 15
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Anula os meses de cada posto com menos de x dias de dados.
+
+    Todos os postos são avaliados de uma só vez e os meses reprovados são
+    substituídos por NaN, preservando o índice de datas comum.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Séries de dados indexadas por data, com uma coluna por posto.
+
+    limite : int
+        Número mínimo de dias presentes na série mensal.
+
+    Returns
+    -------
+    Tuple[pd.DataFrame, pd.DataFrame]
+        Séries com os meses não representativos anulados e um resumo por posto
+        com o número de meses mantidos, de meses removidos (que tinham algum
+        dado) e de dias removidos.
+    """
+    contagem, codigos = contar_dias_por_mes(df)
+    falhos = contagem < limite
+
+    valores = df.to_numpy(dtype=float, copy=True)
+    mascara = falhos[codigos]
+    dias_removidos = (mascara & ~np.isnan(valores)).sum(axis=0)
+    valores[mascara] = np.nan
 
-    return df
+    resumo = pd.DataFrame(
+        {
+            "meses_mantidos": (~falhos).sum(axis=0),
+            "meses_removidos": (falhos & (contagem > 0)).sum(axis=0),
+            "dias_removidos": dias_removidos,
+        },
+        index=df.columns,
+    )
+
+    return pd.DataFrame(valores, index=df.index, columns=df.columns), resumo
 
 
 def anos_disponiveis(df: pd.DataFrame) -> float:
@@ -204,3 +296,296 @@ def anos_disponiveis(df: pd.DataFrame) -> float:
     meses_disponiveis = len(serie_mensal)
 
     return meses_disponiveis / 12
+
+
+def resolver_postos_duplicados(
+    postos: pd.DataFrame,
+    series: pd.DataFrame,
+    tolerancia: float = 500,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Resolve os postos co-localizados de fontes diferentes (ANA e INMET).
+
+    Os postos são convertidos em coordenadas geocêntricas
+    (`contornos.coordenadas_geocentricas`), de forma que a distância é correta
+    em qualquer lugar do país, e agrupados por uma árvore KD: postos a até
+    `tolerancia` metros uns dos outros, direta ou indiretamente, formam um
+    grupo. Em cada grupo é mantido o posto com a menor fração de falhas no
+    período das séries (em caso de empate, o primeiro da tabela).
+
+    Parameters
+    ----------
+    postos : pd.DataFrame
+        Tabela de postos com as colunas "codigo", "latitude" e "longitude".
+
+    series : pd.DataFrame
+        Séries dos postos indexadas por data, com uma coluna por código. Postos
+        sem série são tratados como 100% de falhas.
+
+    tolerancia : float
+        Distância máxima, em metros, entre postos de um mesmo grupo.
+
+    Returns
+    -------
+    Tuple[pd.DataFrame, pd.DataFrame]
+        Tabela de postos sem os duplicados e tabela de auditoria dos grupos com
+        mais de um posto, indexada pelo código, com o grupo, a fração de falhas,
+        a posição no grupo, o posto mantido e a distância até ele.
+    """
+    codigos = postos["codigo"].astype(str).to_numpy()
+    xyz = contornos.coordenadas_geocentricas(
+        pd.to_numeric(postos["latitude"]), pd.to_numeric(postos["longitude"])
+    )
+
+    pares = cKDTree(xyz).query_pairs(r=tolerancia, output_type="ndarray")
+    n = len(codigos)
+    grafo = coo_matrix(
+        (np.ones(len(pares), dtype=bool), (pares[:, 0], pares[:, 1])), shape=(n, n)
+    )
+    _, grupos = connected_components(grafo, directed=False)
+
+    colunas = series.columns.astype(str)
+    presentes = np.isin(codigos, colunas)
+    falhas = np.ones(n)
+    if len(series):
+        posicoes = colunas.get_indexer(codigos[presentes])
+        falhas[presentes] = np.isnan(series.to_numpy(dtype=float)[:, posicoes]).mean(
+            axis=0
+        )
+
+    # ordena por grupo, falhas e ordem original e marca o primeiro de cada grupo
+    ordem = np.lexsort((np.arange(n), falhas, grupos))
+    primeiro = np.ones(n, dtype=bool)
+    primeiro[1:] = grupos[ordem][1:] != grupos[ordem][:-1]
+    inicio_grupo = np.maximum.accumulate(np.where(primeiro, np.arange(n), 0))
+    posicao = np.empty(n, dtype=int)
+    posicao[ordem] = np.arange(n) - inicio_grupo
+    vencedor = np.empty(n, dtype=int)
+    vencedor[ordem] = ordem[inicio_grupo]
+
+    tamanho = np.bincount(grupos)[grupos]
+    auditoria = pd.DataFrame(
+        {
+            "grupo": grupos,
+            "falhas": falhas,
+            "posicao": posicao,
+            "vencedor": codigos[vencedor],
+            "distancia": np.linalg.norm(xyz - xyz[vencedor], axis=1),
+            "mantido": posicao == 0,
+        },
+        index=pd.Index(codigos, name="codigo"),
+    )
+    auditoria = auditoria[tamanho > 1].sort_values(["grupo", "posicao"])
+
+    return postos[posicao == 0], auditoria
+
+
+class LimpezaBacia:
+    """
+    Limpeza conjunta das séries de todos os postos de uma bacia.
+
+    As séries são mantidas em uma única matriz (datas x postos) e cada etapa da
+    limpeza é aplicada sobre ela como uma máscara, sem cópias por posto:
+
+    1. remoção de datas duplicadas (na construção);
+    2. remoção de outliers acima do limite e de valores negativos;
+    3. contabilização das falhas de cada posto;
+    4. anulação dos meses não representativos;
+    5. contagem dos anos disponíveis e classificação dos postos.
+    """
+
+    # classes de postos, na ordem dos campos de `modelos.Bacia`
+    vazia = "serie_vazia"
+    nao_representativo = "nao_representativos"
+    com_falhas = "com_falhas"
+    ok = "postos_ok"
+
+    def __init__(
+        self,
+        valores: np.ndarray,
+        datas: pd.DatetimeIndex,
+        codigos: List[str],
+        limite_outlier: float = 400,
+        limite_dias: int = 15,
+        min_anos: float = 8,
+        max_falhas: float = 0.15,
+    ) -> None:
+        """
+        Inicialização da limpeza.
+
+        Parameters
+        ----------
+        valores : np.ndarray
+            Matriz de precipitação (datas x postos). Matrizes float são limpas
+            no próprio lugar, sem cópia.
+
+        datas : pd.DatetimeIndex
+            Datas das linhas da matriz.
+
+        codigos : List[str]
+            Códigos dos postos das colunas da matriz.
+
+        limite_outlier : float
+            Limite máximo possível de precipitação diária.
+
+        limite_dias : int
+            Número mínimo de dias com dados para um mês ser representativo.
+
+        min_anos : float
+            Número mínimo de anos disponíveis para um posto ser aceito.
+
+        max_falhas : float
+            Fração máxima de falhas para um posto ser aceito.
+        """
+        datas = pd.DatetimeIndex(datas)
+        unicas = ~datas.duplicated()
+        if not unicas.all():
+            valores = valores[unicas]
+            datas = datas[unicas]
+
+        self.valores = np.asarray(valores, dtype=np.result_type(valores, np.float32))
+        self.datas = datas
+        self.codigos = list(codigos)
+        self.limite_outlier = limite_outlier
+        self.limite_dias = limite_dias
+        self.min_anos = min_anos
+        self.max_falhas = max_falhas
+
+        self.falhas: Optional[np.ndarray] = None
+        self.anos: Optional[np.ndarray] = None
+        self.classes: Optional[np.ndarray] = None
+
+    @classmethod
+    def de_dataframe(cls, df: pd.DataFrame, **kwargs) -> "LimpezaBacia":
+        """
+        Cria a limpeza a partir de um dataframe largo (datas x postos).
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            Séries indexadas por data, com uma coluna por posto.
+
+        **kwargs
+            Parâmetros repassados para a inicialização.
+
+        Returns
+        -------
+        LimpezaBacia
+            Limpeza ainda não executada.
+        """
+        return cls(
+            df.to_numpy(dtype=float),
+            pd.to_datetime(df.index),
+            [str(c) for c in df.columns],
+            **kwargs,
+        )
+
+    def executar(self) -> "LimpezaBacia":
+        """
+        Executa a cadeia de limpeza sobre a matriz.
+
+        OBS: a fração de falhas de cada posto é calculada entre a sua primeira e
+        a sua última observação, antes da anulação dos meses não representativos.
+
+        Returns
+        -------
+        LimpezaBacia
+            A própria limpeza, com a matriz limpa e os postos classificados.
+        """
+        valores = self.valores
+
+        with np.errstate(invalid="ignore"):
+            valores[(valores > self.limite_outlier) | (valores < 0)] = np.nan
+
+        validos = ~np.isnan(valores)
+        possui_dados = validos.any(axis=0)
+        primeira = validos.argmax(axis=0)
+        ultima = len(valores) - 1 - validos[::-1].argmax(axis=0)
+        extensao = np.where(possui_dados, ultima - primeira + 1, 1)
+        self.falhas = np.where(possui_dados, 1 - validos.sum(axis=0) / extensao, 1.0)
+
+        contagem, meses = _contar_dias_por_mes(validos, self.datas)
+        representativos = contagem >= self.limite_dias
+        valores[~representativos[meses]] = np.nan
+        self.anos = representativos.sum(axis=0) / 12
+
+        vazio = ~representativos.any(axis=0)
+        aceito = ~vazio & (self.falhas < self.max_falhas) & (self.anos > self.min_anos)
+        self.classes = np.select(
+            [aceito, vazio, self.anos <= self.min_anos],
+            [self.ok, self.vazia, self.nao_representativo],
+            default=self.com_falhas,
+        )
+
+        return self
+
+    def para_dataframe(self, apenas_ok: bool = False) -> pd.DataFrame:
+        """
+        Retorna a matriz limpa como um dataframe largo.
+
+        Parameters
+        ----------
+        apenas_ok : bool
+            Caso seja desejado manter apenas os postos aceitos.
+
+        Returns
+        -------
+        pd.DataFrame
+            Séries limpas indexadas por data.
+        """
+        df = pd.DataFrame(self.valores, index=self.datas, columns=self.codigos)
+        if apenas_ok:
+            df = df.loc[:, self.classes == self.ok]
+        return df
+
+    @property
+    def resumo(self) -> pd.DataFrame:
+        """
+        Falhas, anos disponíveis e classe de cada posto.
+
+        Returns
+        -------
+        pd.DataFrame
+            Resumo indexado pelo código do posto.
+        """
+        return pd.DataFrame(
+            {"falhas": self.falhas, "anos": self.anos, "classe": self.classes},
+            index=self.codigos,
+        )
+
+    def bacia(self, coordenadas: pd.DataFrame, nome: str) -> modelos.Bacia:
+        """
+        Monta a estrutura de informações da bacia a partir da classificação.
+
+        Parameters
+        ----------
+        coordenadas : pd.DataFrame
+            Latitude e longitude de cada posto, indexadas pelo código.
+
+        nome : str
+            Nome da bacia.
+
+        Returns
+        -------
+        modelos.Bacia
+            Postos da bacia separados por classe.
+        """
+        grupos = {
+            classe: list()
+            for classe in (
+                self.vazia,
+                self.nao_representativo,
+                self.com_falhas,
+                self.ok,
+            )
+        }
+        for codigo, classe in zip(self.codigos, self.classes):
+            grupos[classe].append(
+                modelos.Posto(
+                    latitude=coordenadas.loc[codigo, "latitude"],
+                    longitude=coordenadas.loc[codigo, "longitude"],
+                    codigo=codigo,
+                )
+            )
+
+        return modelos.Bacia(**grupos, n_postos=len(self.codigos), bacia=nome)
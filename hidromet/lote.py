@@ -0,0 +1,705 @@
+"""Processamento em lote de todas as bacias de um shapefile."""
+import json
+
+from datetime import date
+from pathlib import Path
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import Optional
+from typing import Tuple
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from scipy import sparse
+
+from hidromet import config
+from hidromet import contornos
+from hidromet import grade
+from hidromet import limpeza
+from hidromet import modelos
+from hidromet import outliers
+from hidromet import preenchimento
+from hidromet import requisicoes
+from hidromet import utils
+from hidromet.ANA import ANA
+from hidromet.INMET import INMET
+
+
+# coluna do shapefile com o nome de cada bacia
+coluna_bacia = "bacia"
+
+
+def ler_bacias(
+    shapefile: Path = config.dir_contorno, coluna: str = coluna_bacia
+) -> gpd.GeoDataFrame:
+    """
+    Lê todos os polígonos de um shapefile de bacias.
+
+    Parameters
+    ----------
+    shapefile : Path
+        Caminho para o shapefile.
+
+    coluna : str
+        Coluna com o nome de cada bacia.
+
+    Returns
+    -------
+    gpd.GeoDataFrame
+        Contornos das bacias, em coordenadas geográficas caso o shapefile não
+        tenha sistema de coordenadas.
+    """
+    bacias = gpd.read_file(shapefile)
+    if bacias.crs is None:
+        bacias = bacias.set_crs(epsg=config.epsg_inicial)
+
+    duplicadas = bacias[coluna][bacias[coluna].duplicated()]
+    if not duplicadas.empty:
+        raise ValueError(f"Bacias com nomes repetidos: {sorted(set(duplicadas))}")
+
+    return bacias
+
+
+def arquivos_bacia(diretorio: Path, bacia: str) -> Tuple[Path, Path]:
+    """
+    Caminhos das séries e das informações dos postos de uma bacia.
+
+    Parameters
+    ----------
+    diretorio : Path
+        Diretório da etapa, como `config.dir_prec_ana`.
+
+    bacia : str
+        Nome da bacia.
+
+    Returns
+    -------
+    Tuple[Path, Path]
+        Arquivos `<bacia>.csv` e `coords_<bacia>.json` do diretório.
+    """
+    arquivo_bacia = diretorio.joinpath(f"{bacia}.csv")
+    arquivo_json = diretorio.joinpath(f"coords_{bacia}.json")
+
+    return arquivo_bacia, arquivo_json
+
+
+def diretorio_bacia(diretorio: Path, bacia: str) -> Path:
+    """
+    Subdiretório de uma bacia para os arquivos por posto.
+
+    Parameters
+    ----------
+    diretorio : Path
+        Diretório da etapa, como `config.dir_merge_posto`.
+
+    bacia : str
+        Nome da bacia.
+
+    Returns
+    -------
+    Path
+        Diretório `<diretorio>/<bacia>`, criado caso não exista.
+    """
+    subdiretorio = diretorio.joinpath(bacia)
+    subdiretorio.mkdir(parents=True, exist_ok=True)
+
+    return subdiretorio
+
+
+def mapear_postos(
+    tabela: pd.DataFrame,
+    bacias: gpd.GeoDataFrame,
+    codigo: str = "codigo",
+    latitude: str = "latitude",
+    longitude: str = "longitude",
+    coluna: str = coluna_bacia,
+) -> pd.Series:
+    """
+    Relaciona os postos de uma tabela às bacias, todas de uma só vez.
+
+    Parameters
+    ----------
+    tabela : pd.DataFrame
+        Tabela de postos, como o inventário da ANA ou a lista de estações do
+        INMET.
+
+    bacias : gpd.GeoDataFrame
+        Contornos das bacias.
+
+    codigo : str
+        Coluna com o código do posto.
+
+    latitude : str
+        Coluna com a latitude do posto.
+
+    longitude : str
+        Coluna com a longitude do posto.
+
+    coluna : str
+        Coluna com o nome de cada bacia.
+
+    Returns
+    -------
+    pd.Series
+        Nome da bacia de cada posto, indexado pelo código (ver
+        `contornos.mapear_postos_bacias`).
+    """
+    tabela = limpeza.remover_codigos_duplicados(
+        tabela.set_index(tabela[codigo].astype(str))
+    )
+    pontos = contornos.criar_pontos(tabela[latitude], tabela[longitude])
+
+    return contornos.mapear_postos_bacias(pontos, bacias, coluna)
+
+
+def _juntar_series(
+    resultados: Iterator[Tuple[str, object]]
+) -> Tuple[pd.DataFrame, Dict[str, Exception]]:
+    """Junta as séries baixadas em um dataframe largo, separando os erros."""
+    series, erros = dict(), dict()
+    for codigo, resultado in resultados:
+        if isinstance(resultado, Exception):
+            erros[codigo] = resultado
+        elif not resultado.empty:
+            serie = resultado[~resultado.index.duplicated()]
+            series[codigo] = pd.to_numeric(serie, errors="coerce")
+
+    if not series:
+        return pd.DataFrame(), erros
+
+    df = pd.concat(series, axis=1).sort_index()
+    df.index = pd.to_datetime(df.index)
+
+    return df, erros
+
+
+def baixar_ana(
+    codigos: Iterable[str],
+    ana: Optional[ANA] = None,
+    data_inicial: date = date(2000, 1, 1),
+    max_workers: int = requisicoes.max_conexoes,
+) -> Tuple[pd.DataFrame, Dict[str, Exception]]:
+    """
+    Baixa em paralelo a série de chuva de cada posto da ANA uma única vez.
+
+    Parameters
+    ----------
+    codigos : Iterable[str]
+        Códigos dos postos. Códigos repetidos são baixados apenas uma vez.
+
+    ana : Optional[ANA]
+        Cliente da ANA. Caso não seja passado, um novo cliente é criado.
+
+    data_inicial : date
+        Data de início das séries.
+
+    max_workers : int
+        Número máximo de requisições simultâneas.
+
+    Returns
+    -------
+    Tuple[pd.DataFrame, Dict[str, Exception]]
+        Séries indexadas por data, com uma coluna por posto, e os erros dos
+        postos que não puderam ser baixados.
+    """
+    ana = ana or ANA()
+    resultados = ana.obter_chuvas(
+        dict.fromkeys(map(str, codigos)),
+        data_inicial=data_inicial.strftime("%d/%m/%Y"),
+        max_workers=max_workers,
+    )
+
+    return _juntar_series(
+        (codigo, r if isinstance(r, Exception) else r[codigo])
+        for codigo, r in resultados
+    )
+
+
+def baixar_inmet(
+    codigos: Iterable[str],
+    inmet: Optional[INMET] = None,
+    data_inicial: date = date(2000, 1, 1),
+    data_final: Optional[date] = None,
+    max_workers: int = requisicoes.max_conexoes,
+) -> Tuple[pd.DataFrame, Dict[str, Exception]]:
+    """
+    Baixa em paralelo, uma única vez, a chuva diária de cada estação do INMET.
+
+    Parameters
+    ----------
+    codigos : Iterable[str]
+        Códigos das estações. Códigos repetidos são baixados apenas uma vez.
+
+    inmet : Optional[INMET]
+        Cliente do INMET. Caso não seja passado, um novo cliente é criado.
+
+    data_inicial : date
+        Data de início das séries.
+
+    data_final : Optional[date]
+        Data final das séries. Por padrão, o dia atual.
+
+    max_workers : int
+        Número máximo de requisições simultâneas.
+
+    Returns
+    -------
+    Tuple[pd.DataFrame, Dict[str, Exception]]
+        Séries indexadas por data, com uma coluna por estação, e os erros das
+        estações que não puderam ser baixadas.
+    """
+    inmet = inmet or INMET()
+    inicio = data_inicial.strftime("%Y-%m-%d")
+    fim = (data_final or date.today()).strftime("%Y-%m-%d")
+
+    def obter(codigo: str) -> pd.Series:
+        # as estações já são baixadas em paralelo: as janelas de cada uma, não
+        df = inmet.obter_serie_estacao(
+            data_inicial=inicio,
+            data_final=fim,
+            cod_estacao=codigo,
+            freq="D",
+            max_workers=1,
+        )
+        return df.get("CHUVA", pd.Series(dtype=float)).dropna()
+
+    resultados = requisicoes.executar_em_paralelo(
+        obter, dict.fromkeys(map(str, codigos)), max_workers=max_workers
+    )
+
+    return _juntar_series(resultados)
+
+
+def separar_bacias(
+    series: pd.DataFrame,
+    mapeamento: pd.Series,
+    coordenadas: pd.DataFrame,
+    diretorio: Path,
+    **kwargs,
+) -> Dict[str, modelos.Bacia]:
+    """
+    Limpa e classifica os postos de cada bacia e salva os arquivos da bacia.
+
+    Cada bacia é limpa por `limpeza.LimpezaBacia` sobre as colunas dos seus
+    postos. Postos sem série são classificados como série vazia.
+
+    Parameters
+    ----------
+    series : pd.DataFrame
+        Séries de todos os postos, com uma coluna por código.
+
+    mapeamento : pd.Series
+        Nome da bacia de cada posto, indexado pelo código (ver `mapear_postos`).
+
+    coordenadas : pd.DataFrame
+        Latitude e longitude de cada posto, indexadas pelo código.
+
+    diretorio : Path
+        Diretório de saída, onde são salvos `<bacia>.csv` e `coords_<bacia>.json`.
+
+    **kwargs
+        Parâmetros repassados para `limpeza.LimpezaBacia`.
+
+    Returns
+    -------
+    Dict[str, modelos.Bacia]
+        Informações dos postos de cada bacia.
+    """
+    info_bacias = dict()
+    for bacia, postos in mapeamento.groupby(mapeamento, sort=False):
+        codigos = postos.index.astype(str).tolist()
+        limpa = limpeza.LimpezaBacia.de_dataframe(
+            series.reindex(columns=codigos), **kwargs
+        ).executar()
+
+        df_chuva = limpa.para_dataframe(apenas_ok=True).dropna(how="all")
+        df_chuva.index = df_chuva.index.strftime("%Y-%m-%d")
+        info_bacias[bacia] = limpa.bacia(coordenadas, bacia)
+
+        arquivo_bacia, arquivo_json = arquivos_bacia(diretorio, bacia)
+        df_chuva.to_csv(arquivo_bacia)
+        with open(arquivo_json, "w") as f:
+            json.dump(info_bacias[bacia].dict(), f)
+
+    return info_bacias
+
+
+def processar_ana(
+    bacias: gpd.GeoDataFrame,
+    ana: Optional[ANA] = None,
+    data_inicial: date = date(2000, 1, 1),
+    diretorio: Path = config.dir_prec_ana,
+    coluna: str = coluna_bacia,
+    max_workers: int = requisicoes.max_conexoes,
+) -> Tuple[Dict[str, modelos.Bacia], Dict[str, Exception]]:
+    """
+    Obtém, limpa e salva os postos da ANA de todas as bacias.
+
+    O inventário é obtido uma vez, os postos são relacionados a todas as bacias
+    de uma só vez e cada posto é baixado uma única vez, mesmo que esteja em
+    bacias sobrepostas.
+
+    Parameters
+    ----------
+    bacias : gpd.GeoDataFrame
+        Contornos das bacias (ver `ler_bacias`).
+
+    ana : Optional[ANA]
+        Cliente da ANA. Caso não seja passado, um novo cliente é criado.
+
+    data_inicial : date
+        Data de início das séries.
+
+    diretorio : Path
+        Diretório de saída dos arquivos de cada bacia.
+
+    coluna : str
+        Coluna com o nome de cada bacia.
+
+    max_workers : int
+        Número máximo de requisições simultâneas.
+
+    Returns
+    -------
+    Tuple[Dict[str, modelos.Bacia], Dict[str, Exception]]
+        Informações dos postos de cada bacia e os erros dos postos que não
+        puderam ser baixados.
+    """
+    ana = ana or ANA()
+    # o inventário é indexado pelo código do posto
+    inventario = ana.inventario(tipoest=2).reset_index()
+    mapeamento = mapear_postos(inventario, bacias, coluna=coluna)
+
+    series, erros = baixar_ana(
+        mapeamento.index.unique(), ana, data_inicial, max_workers
+    )
+    coordenadas = inventario.set_index(inventario["codigo"].astype(str))
+    coordenadas = coordenadas[["latitude", "longitude"]].apply(pd.to_numeric)
+
+    return separar_bacias(series, mapeamento, coordenadas, diretorio), erros
+
+
+def processar_inmet(
+    bacias: gpd.GeoDataFrame,
+    inmet: Optional[INMET] = None,
+    data_inicial: date = date(2000, 1, 1),
+    data_final: Optional[date] = None,
+    diretorio: Path = config.dir_prec_inmet,
+    coluna: str = coluna_bacia,
+    max_workers: int = requisicoes.max_conexoes,
+) -> Tuple[Dict[str, modelos.Bacia], Dict[str, Exception]]:
+    """
+    Obtém, limpa e salva as estações do INMET de todas as bacias.
+
+    A lista de estações é obtida uma vez e cada estação é baixada uma única
+    vez, mesmo que esteja em bacias sobrepostas.
+
+    Parameters
+    ----------
+    bacias : gpd.GeoDataFrame
+        Contornos das bacias (ver `ler_bacias`).
+
+    inmet : Optional[INMET]
+        Cliente do INMET. Caso não seja passado, um novo cliente é criado.
+
+    data_inicial : date
+        Data de início das séries.
+
+    data_final : Optional[date]
+        Data final das séries. Por padrão, o dia atual.
+
+    diretorio : Path
+        Diretório de saída dos arquivos de cada bacia.
+
+    coluna : str
+        Coluna com o nome de cada bacia.
+
+    max_workers : int
+        Número máximo de requisições simultâneas.
+
+    Returns
+    -------
+    Tuple[Dict[str, modelos.Bacia], Dict[str, Exception]]
+        Informações das estações de cada bacia e os erros das estações que não
+        puderam ser baixadas.
+    """
+    inmet = inmet or INMET()
+    estacoes = pd.DataFrame(inmet.listar_estacoes())
+    mapeamento = mapear_postos(
+        estacoes,
+        bacias,
+        codigo="CD_ESTACAO",
+        latitude="VL_LATITUDE",
+        longitude="VL_LONGITUDE",
+        coluna=coluna,
+    )
+
+    series, erros = baixar_inmet(
+        mapeamento.index.unique(), inmet, data_inicial, data_final, max_workers
+    )
+    coordenadas = estacoes.set_index(estacoes["CD_ESTACAO"].astype(str))
+    coordenadas = coordenadas[["VL_LATITUDE", "VL_LONGITUDE"]].apply(pd.to_numeric)
+    coordenadas.columns = ["latitude", "longitude"]
+
+    return separar_bacias(series, mapeamento, coordenadas, diretorio), erros
+
+
+def _ler_postos_ok(diretorio: Path, bacia: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Lê a tabela e as séries dos postos aceitos de uma bacia de uma fonte."""
+    arquivo_bacia, arquivo_json = arquivos_bacia(diretorio, bacia)
+    if not arquivo_json.exists():
+        return pd.DataFrame(columns=["latitude", "longitude", "codigo"]), pd.DataFrame()
+
+    postos = pd.DataFrame(
+        utils.carregar_json(arquivo_json)["postos_ok"],
+        columns=["latitude", "longitude", "codigo"],
+    )
+    series = pd.read_csv(arquivo_bacia, index_col=0)
+    series.index = pd.to_datetime(series.index)
+
+    return postos, series[postos["codigo"]]
+
+
+def concatenar_bacias(
+    bacias: Iterable[str],
+    dir_ana: Path = config.dir_prec_ana,
+    dir_inmet: Path = config.dir_prec_inmet,
+    diretorio: Path = config.dir_prec_concat,
+    dir_modelos: Optional[Path] = config.dir_modelos_outliers,
+    max_processos: Optional[int] = None,
+) -> Dict[str, pd.DataFrame]:
+    """
+    Une os postos da ANA e do INMET de cada bacia e remove os outliers.
+
+    Os postos co-localizados de cada bacia são resolvidos por
+    `limpeza.resolver_postos_duplicados`. A remoção de outliers é feita uma
+    única vez para a união dos postos de todas as bacias, de forma que postos
+    em bacias sobrepostas não são processados duas vezes.
+
+    Parameters
+    ----------
+    bacias : Iterable[str]
+        Nomes das bacias.
+
+    dir_ana : Path
+        Diretório dos arquivos da ANA de cada bacia.
+
+    dir_inmet : Path
+        Diretório dos arquivos do INMET de cada bacia.
+
+    diretorio : Path
+        Diretório de saída, onde são salvos `<bacia>.csv`, `<bacia>_sout.csv` e
+        `coords_<bacia>.json`.
+
+    dir_modelos : Optional[Path]
+        Diretório dos modelos de outliers de cada posto (ver
+        `outliers.remover_outliers_postos`).
+
+    max_processos : Optional[int]
+        Número máximo de processos simultâneos na remoção de outliers.
+
+    Returns
+    -------
+    Dict[str, pd.DataFrame]
+        Auditoria dos postos duplicados de cada bacia.
+    """
+    auditorias, postos_bacias, series = dict(), dict(), list()
+    for bacia in bacias:
+        postos_ana, series_ana = _ler_postos_ok(dir_ana, bacia)
+        postos_inmet, series_inmet = _ler_postos_ok(dir_inmet, bacia)
+
+        postos = pd.concat([postos_ana, postos_inmet], ignore_index=True)
+        series_bacia = pd.concat([series_ana, series_inmet], axis=1)
+        postos, auditorias[bacia] = limpeza.resolver_postos_duplicados(
+            postos, series_bacia
+        )
+
+        series_bacia = series_bacia[postos["codigo"]]
+        postos_bacias[bacia] = postos
+        series.append(series_bacia)
+
+        arquivo_bacia, arquivo_json = arquivos_bacia(diretorio, bacia)
+        series_bacia.to_csv(arquivo_bacia, date_format="%Y-%m-%d")
+        with open(arquivo_json, "w") as f:
+            json.dump(postos.to_dict(orient="records"), f)
+
+    if not series:
+        return auditorias
+
+    todos = pd.concat(series, axis=1)
+    todos = todos.loc[:, ~todos.columns.duplicated()]
+    sem_outliers = outliers.remover_outliers_postos(
+        todos, dir_modelos=dir_modelos, max_processos=max_processos
+    )
+
+    for bacia, postos in postos_bacias.items():
+        arquivo_sout = diretorio.joinpath(f"{bacia}_sout.csv")
+        sem_outliers[postos["codigo"]].to_csv(arquivo_sout, date_format="%Y-%m-%d")
+
+    return auditorias
+
+
+def extrair_satelite(
+    bacias: gpd.GeoDataFrame,
+    dataset: Optional[xr.Dataset] = None,
+    dir_series: Path = config.dir_prec_concat,
+    diretorio: Path = config.dir_merge_posto,
+    coluna: str = coluna_bacia,
+    variavel: str = "prec",
+) -> Dict[str, pd.DataFrame]:
+    """
+    Extrai a série do merge dos postos de todas as bacias em uma só leitura.
+
+    As matrizes de pesos de cada bacia (`grade.obter_matriz_pesos`, salvas em
+    `pesos_<bacia>.npz`) são empilhadas em uma única matriz, de forma que cada
+    bloco de dias do cubo é lido uma única vez para todas as bacias. Como o
+    buffer de cada posto é recortado pelo contorno da bacia, um posto em bacias
+    sobrepostas tem uma série de satélite por bacia.
+
+    Parameters
+    ----------
+    bacias : gpd.GeoDataFrame
+        Contornos das bacias (ver `ler_bacias`).
+
+    dataset : Optional[xr.Dataset]
+        Dataset do merge. Por padrão, o cubo (`grade.abrir_cubo`).
+
+    dir_series : Path
+        Diretório das séries sem outliers (`<bacia>_sout.csv`) e dos postos
+        (`coords_<bacia>.json`) de cada bacia.
+
+    diretorio : Path
+        Diretório de saída. A comparação de cada posto é salva em
+        `<diretorio>/<bacia>/<codigo>.csv`, com as colunas do posto, "merge" e
+        "diferenca".
+
+    coluna : str
+        Coluna com o nome de cada bacia.
+
+    variavel : str
+        Variável do dataset.
+
+    Returns
+    -------
+    Dict[str, pd.DataFrame]
+        Série de satélite dos postos de cada bacia, indexada por data.
+    """
+    dataset = grade.abrir_cubo() if dataset is None else dataset
+
+    pesos, postos_bacias = list(), dict()
+    for _, bacia in bacias.iterrows():
+        nome = bacia[coluna]
+        _, arquivo_json = arquivos_bacia(dir_series, nome)
+        if not arquivo_json.exists():
+            continue
+
+        postos = pd.DataFrame(utils.carregar_json(arquivo_json))
+        if postos.empty:
+            continue
+        contorno = bacias[bacias[coluna] == nome]
+        arquivo_pesos = config.dir_merge_concat.joinpath(f"pesos_{nome}.npz")
+        pesos.append(
+            grade.obter_matriz_pesos(dataset, postos, contorno, arquivo=arquivo_pesos)
+        )
+        postos_bacias[nome] = postos["codigo"].astype(str).tolist()
+
+    if not pesos:
+        return dict()
+
+    linhas = np.cumsum([0] + [len(codigos) for codigos in postos_bacias.values()])
+    extraidas = grade.extrair_series(
+        dataset, sparse.vstack(pesos, format="csr"), list(range(linhas[-1])), variavel
+    )
+
+    satelite = dict()
+    for (nome, codigos), inicio, fim in zip(
+        postos_bacias.items(), linhas[:-1], linhas[1:]
+    ):
+        satelite[nome] = extraidas.iloc[:, inicio:fim].set_axis(codigos, axis=1)
+
+        series_postos = pd.read_csv(
+            dir_series.joinpath(f"{nome}_sout.csv"), index_col=0
+        )
+        series_postos.index = pd.to_datetime(series_postos.index)
+
+        saida = diretorio_bacia(diretorio, nome)
+        for codigo in codigos:
+            comparacao = pd.concat(
+                [series_postos[codigo], satelite[nome][codigo].rename("merge")], axis=1
+            )
+            comparacao = comparacao.assign(
+                diferenca=comparacao["merge"] - comparacao[codigo]
+            )
+            comparacao.to_csv(saida.joinpath(f"{codigo}.csv"), date_format="%Y-%m-%d")
+
+    return satelite
+
+
+def executar(
+    shapefile: Path = config.dir_contorno,
+    data_inicial: date = date(2000, 1, 1),
+    data_final: Optional[date] = None,
+    coluna: str = coluna_bacia,
+    satelite: bool = True,
+    max_workers: int = requisicoes.max_conexoes,
+    max_processos: Optional[int] = None,
+) -> Dict[str, Exception]:
+    """
+    Executa a obtenção e o tratamento dos dados de todas as bacias de um shapefile.
+
+    Equivale aos notebooks 00 (ANA e INMET), 01, 03, 04, 05 e 06 para cada polígono,
+    com os arquivos de cada bacia salvos sob o seu nome. O cubo do merge deve
+    ter sido atualizado antes com `merge.obter_periodo(..., contorno=bacias)`,
+    que recorta uma única grade cobrindo todas as bacias.
+
+    Parameters
+    ----------
+    shapefile : Path
+        Caminho para o shapefile das bacias.
+
+    data_inicial : date
+        Data de início das séries dos postos.
+
+    data_final : Optional[date]
+        Data final das séries do INMET. Por padrão, o dia atual.
+
+    coluna : str
+        Coluna com o nome de cada bacia.
+
+    satelite : bool
+        Caso seja desejado extrair as séries do merge dos postos.
+
+    max_workers : int
+        Número máximo de requisições simultâneas.
+
+    max_processos : Optional[int]
+        Número máximo de processos simultâneos na remoção de outliers.
+
+    Returns
+    -------
+    Dict[str, Exception]
+        Erros dos postos que não puderam ser baixados.
+    """
+    bacias = ler_bacias(shapefile, coluna)
+
+    _, erros_ana = processar_ana(
+        bacias, data_inicial=data_inicial, coluna=coluna, max_workers=max_workers
+    )
+    _, erros_inmet = processar_inmet(
+        bacias,
+        data_inicial=data_inicial,
+        data_final=data_final,
+        coluna=coluna,
+        max_workers=max_workers,
+    )
+    concatenar_bacias(bacias[coluna], max_processos=max_processos)
+
+    if satelite:
+        for bacia in extrair_satelite(bacias, coluna=coluna):
+            preenchimento.preencher_diretorio(bacia=bacia)
+
+    return {**erros_ana, **erros_inmet}
@@ -0,0 +1,498 @@
+"""Matriz persistente de chuva diária (datas x postos) mapeada em memória."""
+import json
+import os
+
+from datetime import date
+from pathlib import Path
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Literal
+from typing import Mapping
+from typing import Optional
+from typing import Union
+
+import numpy as np
+import pandas as pd
+
+
+# número de dias acrescentados ao arquivo quando a capacidade se esgota
+dias_por_bloco = 366
+# capacidade inicial de postos (múltiplo de 8, por causa da máscara de bits)
+capacidade_postos_inicial = 64
+
+arquivo_valores = "valores.f32"
+arquivo_validade = "validade.bits"
+arquivo_indice = "indice.json"
+
+
+class MatrizChuva:
+    """
+    Matriz de chuva diária (datas x postos) em float32, mapeada em memória.
+
+    O diretório da matriz contém:
+
+    - `valores.f32`: matriz densa float32 (capacidade de dias x capacidade de
+      postos), em ordem de linhas, com NaN onde não há dado;
+    - `validade.bits`: máscara de dados válidos compactada em bits, com uma
+      linha de bytes por dia;
+    - `indice.json`: códigos dos postos (na ordem das colunas), data inicial,
+      número de dias e capacidades.
+
+    As datas são diárias e contíguas a partir da data inicial, de forma que a
+    posição de uma data é aritmética. Os arquivos são alocados com folga de dias
+    e de postos, de forma que anexar um dia ou adicionar um posto não reescreve
+    a matriz. Vários processos podem ler a matriz ao mesmo tempo sem carregá-la
+    na memória; apenas um processo deve escrever.
+    """
+
+    def __init__(self, diretorio: Path, modo: Literal["r", "r+"] = "r") -> None:
+        """
+        Abre uma matriz existente.
+
+        Parameters
+        ----------
+        diretorio : Path
+            Diretório da matriz.
+
+        modo : {"r", "r+"}
+            Somente leitura ou leitura e escrita.
+        """
+        self.diretorio = Path(diretorio)
+        self.modo = modo
+        self.recarregar()
+
+    @classmethod
+    def criar(
+        cls,
+        diretorio: Path,
+        data_inicial: date,
+        codigos: Iterable[str] = (),
+        capacidade_postos: int = capacidade_postos_inicial,
+    ) -> "MatrizChuva":
+        """
+        Cria uma matriz vazia.
+
+        Parameters
+        ----------
+        diretorio : Path
+            Diretório da matriz, criado caso não exista.
+
+        data_inicial : date
+            Data da primeira linha da matriz.
+
+        codigos : Iterable[str]
+            Códigos dos postos iniciais.
+
+        capacidade_postos : int
+            Número de colunas reservadas.
+
+        Returns
+        -------
+        MatrizChuva
+            Matriz aberta para escrita.
+        """
+        diretorio = Path(diretorio)
+        diretorio.mkdir(parents=True, exist_ok=True)
+
+        codigos = [str(c) for c in codigos]
+        capacidade_postos = _multiplo_de_8(max(capacidade_postos, len(codigos)))
+        indice = {
+            "data_inicial": pd.Timestamp(data_inicial).date().isoformat(),
+            "n_dias": 0,
+            "capacidade_dias": 0,
+            "capacidade_postos": capacidade_postos,
+            "codigos": codigos,
+        }
+        diretorio.joinpath(arquivo_valores).touch()
+        diretorio.joinpath(arquivo_validade).touch()
+        _salvar_indice(diretorio, indice)
+
+        return cls(diretorio, modo="r+")
+
+    @classmethod
+    def de_dataframe(cls, df: pd.DataFrame, diretorio: Path) -> "MatrizChuva":
+        """
+        Cria uma matriz a partir de séries diárias indexadas por data.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            Séries indexadas por data, com uma coluna por posto.
+
+        diretorio : Path
+            Diretório da matriz.
+
+        Returns
+        -------
+        MatrizChuva
+            Matriz aberta para escrita.
+        """
+        df = df.copy()
+        df.index = pd.to_datetime(df.index)
+        datas = pd.date_range(df.index.min(), df.index.max(), freq="D")
+        df = df[~df.index.duplicated(keep="first")].reindex(datas)
+
+        matriz = cls.criar(diretorio, datas[0].date(), df.columns)
+        matriz._reservar_dias(len(datas))
+        matriz._escrever_linhas(0, df.to_numpy(dtype=np.float32))
+        matriz.indice["n_dias"] = len(datas)
+        matriz._salvar()
+
+        return matriz
+
+    def recarregar(self) -> None:
+        """Relê o índice e remapeia os arquivos, com as escritas de outros processos."""
+        while True:
+            self.indice = _ler_indice(self.diretorio)
+            self._mapear()
+            # os arquivos podem ter sido realocados entre a leitura do índice e o
+            # mapeamento; nesse caso, o mapeamento é refeito
+            capacidade = _ler_indice(self.diretorio)["capacidade_postos"]
+            if capacidade == self.indice["capacidade_postos"]:
+                break
+
+        self._posicoes: Dict[str, int] = {
+            codigo: i for i, codigo in enumerate(self.indice["codigos"])
+        }
+
+    def _mapear(self) -> None:
+        linhas = self.indice["capacidade_dias"]
+        colunas = self.indice["capacidade_postos"]
+        if linhas == 0:
+            self._valores = np.empty((0, colunas), dtype=np.float32)
+            self._validade = np.empty((0, colunas // 8), dtype=np.uint8)
+            return
+
+        self._valores = np.memmap(
+            self.diretorio.joinpath(arquivo_valores),
+            dtype=np.float32,
+            mode=self.modo,
+            shape=(linhas, colunas),
+        )
+        self._validade = np.memmap(
+            self.diretorio.joinpath(arquivo_validade),
+            dtype=np.uint8,
+            mode=self.modo,
+            shape=(linhas, colunas // 8),
+        )
+
+    @property
+    def codigos(self) -> List[str]:
+        """Códigos dos postos, na ordem das colunas."""
+        return list(self.indice["codigos"])
+
+    @property
+    def data_inicial(self) -> pd.Timestamp:
+        """Data da primeira linha."""
+        return pd.Timestamp(self.indice["data_inicial"])
+
+    @property
+    def n_dias(self) -> int:
+        """Número de dias gravados."""
+        return self.indice["n_dias"]
+
+    @property
+    def n_postos(self) -> int:
+        """Número de postos gravados."""
+        return len(self.indice["codigos"])
+
+    @property
+    def datas(self) -> pd.DatetimeIndex:
+        """Datas das linhas gravadas."""
+        return pd.date_range(self.data_inicial, periods=self.n_dias, freq="D")
+
+    @property
+    def valores(self) -> np.ndarray:
+        """Matriz (dias x postos) gravada, sem cópia."""
+        return self._valores[: self.n_dias, : self.n_postos]
+
+    def posicao_posto(self, codigo: str) -> int:
+        """
+        Coluna de um posto.
+
+        Parameters
+        ----------
+        codigo : str
+            Código do posto.
+
+        Returns
+        -------
+        int
+            Posição da coluna do posto.
+        """
+        return self._posicoes[str(codigo)]
+
+    def posicao_data(self, data: Union[str, date]) -> int:
+        """
+        Linha de uma data.
+
+        Parameters
+        ----------
+        data : Union[str, date]
+            Data desejada.
+
+        Returns
+        -------
+        int
+            Posição da linha da data (pode estar fora das linhas gravadas).
+        """
+        return (pd.Timestamp(data) - self.data_inicial).days
+
+    def validos(
+        self,
+        inicio: Optional[Union[str, date]] = None,
+        fim: Optional[Union[str, date]] = None,
+    ) -> np.ndarray:
+        """
+        Máscara de dados válidos de um período, desempacotada.
+
+        Parameters
+        ----------
+        inicio : Optional[Union[str, date]]
+            Data inicial (inclusiva). Por padrão, a primeira data.
+
+        fim : Optional[Union[str, date]]
+            Data final (inclusiva). Por padrão, a última data.
+
+        Returns
+        -------
+        np.ndarray
+            Máscara booleana (dias x postos).
+        """
+        linhas = self._fatia(inicio, fim)
+        bits = np.unpackbits(self._validade[linhas], axis=1, bitorder="little")
+        return bits[:, : self.n_postos].astype(bool)
+
+    def contar_validos(self) -> pd.Series:
+        """
+        Número de dias com dado de cada posto, contado pela máscara de bits.
+
+        Returns
+        -------
+        pd.Series
+            Número de dias válidos indexado pelo código do posto.
+        """
+        validade = self._validade[: self.n_dias]
+        contagem = np.zeros(self.indice["capacidade_postos"], dtype=np.int64)
+        for inicio in range(0, len(validade), dias_por_bloco):
+            bits = np.unpackbits(
+                validade[inicio : inicio + dias_por_bloco], axis=1, bitorder="little"
+            )
+            contagem += bits.sum(axis=0, dtype=np.int64)
+
+        return pd.Series(contagem[: self.n_postos], index=self.codigos)
+
+    def ler(
+        self,
+        postos: Optional[List[str]] = None,
+        inicio: Optional[Union[str, date]] = None,
+        fim: Optional[Union[str, date]] = None,
+    ) -> pd.DataFrame:
+        """
+        Lê um recorte da matriz como dataframe.
+
+        Sem `postos`, o dataframe é uma visão do arquivo mapeado (sem cópia);
+        com `postos`, apenas as colunas pedidas são copiadas.
+
+        Parameters
+        ----------
+        postos : Optional[List[str]]
+            Códigos dos postos. Por padrão, todos.
+
+        inicio : Optional[Union[str, date]]
+            Data inicial (inclusiva). Por padrão, a primeira data.
+
+        fim : Optional[Union[str, date]]
+            Data final (inclusiva). Por padrão, a última data.
+
+        Returns
+        -------
+        pd.DataFrame
+            Séries indexadas por data.
+        """
+        linhas = self._fatia(inicio, fim)
+        datas = self.datas[linhas]
+
+        if postos is None:
+            return pd.DataFrame(
+                self.valores[linhas], index=datas, columns=self.codigos, copy=False
+            )
+
+        colunas = [self.posicao_posto(codigo) for codigo in postos]
+        return pd.DataFrame(
+            self._valores[linhas][:, colunas], index=datas, columns=list(postos)
+        )
+
+    def _fatia(
+        self, inicio: Optional[Union[str, date]], fim: Optional[Union[str, date]]
+    ) -> slice:
+        primeira = 0 if inicio is None else max(self.posicao_data(inicio), 0)
+        ultima = (
+            self.n_dias if fim is None else min(self.posicao_data(fim) + 1, self.n_dias)
+        )
+        return slice(primeira, max(ultima, primeira))
+
+    def anexar_dia(
+        self, valores: Union[Mapping[str, float], pd.Series, np.ndarray]
+    ) -> pd.Timestamp:
+        """
+        Anexa o dia seguinte à última data gravada.
+
+        Parameters
+        ----------
+        valores : Union[Mapping[str, float], pd.Series, np.ndarray]
+            Chuva de cada posto, por código (postos ausentes ficam sem dado) ou
+            como um vetor na ordem das colunas.
+
+        Returns
+        -------
+        pd.Timestamp
+            Data do dia anexado.
+        """
+        linha = np.full(self.n_postos, np.nan, dtype=np.float32)
+        if isinstance(valores, np.ndarray):
+            linha[:] = valores
+        else:
+            for codigo, valor in dict(valores).items():
+                linha[self.posicao_posto(codigo)] = valor
+
+        dia = self.n_dias
+        self._reservar_dias(dia + 1)
+        self._escrever_linhas(dia, linha[None, :])
+        self.indice["n_dias"] = dia + 1
+        self._salvar()
+
+        return self.data_inicial + pd.Timedelta(days=dia)
+
+    def adicionar_posto(self, codigo: str, serie: Optional[pd.Series] = None) -> int:
+        """
+        Adiciona a coluna de um novo posto.
+
+        Parameters
+        ----------
+        codigo : str
+            Código do posto.
+
+        serie : Optional[pd.Series]
+            Série diária do posto indexada por data. Datas fora das linhas
+            gravadas são ignoradas.
+
+        Returns
+        -------
+        int
+            Posição da coluna do posto.
+        """
+        codigo = str(codigo)
+        if codigo in self._posicoes:
+            raise ValueError(f"Posto {codigo} já existe na matriz.")
+
+        coluna = self.n_postos
+        if coluna == self.indice["capacidade_postos"]:
+            self._realocar_postos(2 * coluna)
+
+        self.indice["codigos"].append(codigo)
+        self._posicoes[codigo] = coluna
+
+        if serie is not None and self.n_dias:
+            serie = serie[~serie.index.duplicated(keep="first")]
+            valores = serie.reindex(self.datas).to_numpy(dtype=np.float32)
+            self._valores[: self.n_dias, coluna] = valores
+            self._marcar_coluna(coluna, ~np.isnan(valores))
+            self._valores.flush()
+            self._validade.flush()
+
+        self._salvar()
+
+        return coluna
+
+    def _escrever_linhas(self, inicio: int, valores: np.ndarray) -> None:
+        fim = inicio + len(valores)
+        n = valores.shape[1]
+        self._valores[inicio:fim, :n] = valores
+
+        validos = np.zeros((len(valores), self.indice["capacidade_postos"]), dtype=bool)
+        validos[:, :n] = ~np.isnan(valores)
+        self._validade[inicio:fim] = np.packbits(validos, axis=1, bitorder="little")
+
+        self._valores.flush()
+        self._validade.flush()
+
+    def _marcar_coluna(self, coluna: int, validos: np.ndarray) -> None:
+        byte, bit = divmod(coluna, 8)
+        bits = self._validade[: len(validos), byte]
+        bits &= np.uint8(~(1 << bit) & 0xFF)
+        bits |= validos.astype(np.uint8) << bit
+
+    def _reservar_dias(self, n_dias: int) -> None:
+        """Aumenta os arquivos, em blocos de dias, até comportarem `n_dias` linhas."""
+        capacidade = self.indice["capacidade_dias"]
+        if n_dias <= capacidade:
+            return
+
+        nova = capacidade + dias_por_bloco * -(-(n_dias - capacidade) // dias_por_bloco)
+        colunas = self.indice["capacidade_postos"]
+
+        # as linhas novas de valores começam sem dado (NaN); as de validade, zeradas
+        with open(self.diretorio.joinpath(arquivo_valores), "ab") as f:
+            vazio = np.full((dias_por_bloco, colunas), np.nan, dtype=np.float32)
+            for _ in range((nova - capacidade) // dias_por_bloco):
+                f.write(vazio.tobytes())
+        os.truncate(self.diretorio.joinpath(arquivo_validade), nova * colunas // 8)
+
+        self.indice["capacidade_dias"] = nova
+        self._mapear()
+
+    def _realocar_postos(self, capacidade_postos: int) -> None:
+        """Reescreve os arquivos com mais colunas reservadas."""
+        capacidade_postos = _multiplo_de_8(capacidade_postos)
+        linhas = self.indice["capacidade_dias"]
+        colunas = self.indice["capacidade_postos"]
+
+        for nome, dtype, antigas, novas, vazio in (
+            (arquivo_valores, np.float32, colunas, capacidade_postos, np.nan),
+            (arquivo_validade, np.uint8, colunas // 8, capacidade_postos // 8, 0),
+        ):
+            arquivo = self.diretorio.joinpath(nome)
+            temporario = arquivo.with_name(f"{nome}.part")
+            if linhas:
+                antigo = np.memmap(
+                    arquivo, dtype=dtype, mode="r", shape=(linhas, antigas)
+                )
+                novo = np.memmap(
+                    temporario, dtype=dtype, mode="w+", shape=(linhas, novas)
+                )
+                for inicio in range(0, linhas, dias_por_bloco):
+                    bloco = slice(inicio, inicio + dias_por_bloco)
+                    novo[bloco, :antigas] = antigo[bloco]
+                    novo[bloco, antigas:] = vazio
+                novo.flush()
+                del antigo, novo
+            else:
+                temporario.touch()
+            os.replace(temporario, arquivo)
+
+        self.indice["capacidade_postos"] = capacidade_postos
+        self._salvar()
+        self._mapear()
+
+    def _salvar(self) -> None:
+        _salvar_indice(self.diretorio, self.indice)
+
+
+def _multiplo_de_8(n: int) -> int:
+    return max(8, -(-n // 8) * 8)
+
+
+def _ler_indice(diretorio: Path) -> dict:
+    with open(diretorio.joinpath(arquivo_indice)) as f:
+        return json.load(f)
+
+
+def _salvar_indice(diretorio: Path, indice: dict) -> None:
+    """Grava o índice de forma atômica, sem que leitores vejam um índice parcial."""
+    arquivo = diretorio.joinpath(arquivo_indice)
+    temporario = arquivo.with_name(f"{arquivo_indice}.part")
+    with open(temporario, "w") as f:
+        json.dump(indice, f)
+    os.replace(temporario, arquivo)
@@ -1,24 +1,51 @@
 """Módulo para coleta de arquivos do merge."""
+import os
+
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
 from datetime import datetime
+from pathlib import Path
+from typing import Deque
+from typing import Dict
 from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import Union
 
 import geopandas as gpd
 import pandas as pd
 import requests
-import xarray as xr
 
 from hidromet import config
+from hidromet import grade
+from hidromet import requisicoes
+
+
+url_base = "http://ftp.cptec.inpe.br/modelos/tempo/MERGE/GPM/DAILY"
+# primeiro dia disponível do merge diário
+data_inicial = date(2000, 6, 2)
 
+sessao = requisicoes.criar_sessao()
 
-def obter(data: datetime) -> xr.Dataset:
+
+def obter(data: datetime, sessao: requests.Session = sessao) -> Path:
     """
     Baixa arquivo horário do Merge.
 
+    O arquivo é escrito em blocos em um nome temporário e renomeado apenas ao
+    final do download, de forma que um download interrompido não deixa um
+    arquivo grib incompleto no diretório.
+
     Parameters
     ----------
     data: Datetime
         Data do arquivo a ser baixado
 
+    sessao: requests.Session
+        Sessão HTTP utilizada no download.
+
     Returns
     ----------
     arquivo_grib
@@ -29,12 +56,165 @@ def obter(data: datetime) -> xr.Dataset:
     data_fmt = data.strftime("%Y%m%d")
     nome_arquivo = f"MERGE_CPTEC_{data_fmt}.grib2"
     arquivo_grib = config.dir_merge.joinpath(nome_arquivo)
+    arquivo_temporario = config.dir_merge.joinpath(f"{nome_arquivo}.part")
 
-    url = f"http://ftp.cptec.inpe.br/modelos/tempo/MERGE/GPM/DAILY/{ano}/{mes}/{nome_arquivo}"
-    req = requests.get(url=url)
-
-    if req.status_code == 200:
-        with open(arquivo_grib, "wb") as f:
-            f.write(req.content)
+    url = f"{url_base}/{ano}/{mes}/{nome_arquivo}"
+    with sessao.get(url=url, stream=True, timeout=requisicoes.timeout) as req:
+        if req.status_code == 200:
+            with open(arquivo_temporario, "wb") as f:
+                for bloco in req.iter_content(chunk_size=1024**2):
+                    f.write(bloco)
+            os.replace(arquivo_temporario, arquivo_grib)
 
     return arquivo_grib
+
+
+def _baixar(data: datetime) -> Union[Path, Exception]:
+    """Baixa o arquivo de um dia, retornando o erro no lugar do arquivo."""
+    try:
+        arquivo_grib = obter(data)
+    except Exception as erro:
+        return erro
+    return arquivo_grib if arquivo_grib.exists() else FileNotFoundError(arquivo_grib)
+
+
+def _anexar(
+    data: pd.Timestamp,
+    leitura: Future,
+    cubo: Path,
+    resultados: Dict[pd.Timestamp, Union[Path, Exception]],
+) -> bool:
+    """Anexa ao cubo o dia lido, registrando o resultado; False em caso de erro."""
+    try:
+        grade.anexar_ao_cubo(leitura.result(), cubo)
+    except Exception as erro:
+        resultados[data] = erro
+        return False
+    resultados[data] = cubo
+    return True
+
+
+def obter_periodo(
+    inicio: date,
+    fim: date,
+    converter: bool = True,
+    cubo: Path = config.dir_merge_cubo,
+    contorno: Optional[gpd.GeoDataFrame] = None,
+    cubo_pixels: Optional[Path] = config.dir_merge_cubo_pixels,
+    max_workers: int = requisicoes.max_conexoes,
+    max_processos: Optional[int] = None,
+) -> Dict[pd.Timestamp, Union[Path, Exception]]:
+    """
+    Baixa os arquivos diários do Merge de um período em paralelo.
+
+    Os downloads são feitos em um pool de threads sobre uma sessão compartilhada
+    e a leitura de cada arquivo baixado é enviada a um pool de processos, de
+    forma que rede e processamento ocorrem ao mesmo tempo. Cada dia lido é
+    anexado ao cubo do merge (`grade.anexar_ao_cubo`) pelo processo principal,
+    que é o único escritor do cubo, em ordem cronológica e assim que os dias
+    anteriores foram anexados. Downloads e leituras avançam no máximo
+    `max_workers` e `2 * max_processos` dias à frente do último dia anexado, de
+    forma que a memória não depende do tamanho do período.
+
+    Apenas os dias posteriores ao último dia do cubo são anexados. Caso o
+    download ou a leitura de um dia falhe, nenhum dia posterior é anexado (eles
+    recebem um `RuntimeError`), de forma que o cubo nunca fica com lacunas e a
+    próxima execução continua a partir do dia que falhou.
+
+    Caso um contorno seja passado, cada dia é recortado na janela do contorno
+    acrescido do buffer dos postos (`grade.obter_mascara`) ainda na leitura,
+    antes de ser armazenado.
+
+    Parameters
+    ----------
+    inicio : date
+        Primeiro dia do período.
+
+    fim : date
+        Último dia do período.
+
+    converter : bool
+        Caso seja desejado anexar os arquivos grib ao cubo. Caso contrário,
+        apenas os gribs são baixados.
+
+    cubo : Path
+        Caminho para o cubo zarr do merge.
+
+    contorno : Optional[gpd.GeoDataFrame]
+        Contorno da bacia utilizado no recorte. Caso não seja passado, a grade
+        completa é armazenada.
+
+    cubo_pixels : Optional[Path]
+        Caminho para o cubo organizado por pixel. Caso ele já exista, os dias
+        novos são repassados a ele (`grade.atualizar_cubo_pixels`) ao final.
+
+    max_workers : int
+        Número máximo de downloads simultâneos.
+
+    max_processos : Optional[int]
+        Número máximo de leituras simultâneas. Por padrão, o número de CPUs.
+
+    Returns
+    -------
+    Dict[pd.Timestamp, Union[Path, Exception]]
+        Arquivo atualizado (cubo ou grib) ou erro de cada dia processado.
+    """
+    periodo = pd.date_range(start=inicio, end=fim, freq="D")
+    datas = grade.datas_no_cubo(cubo)
+
+    resultados: Dict[pd.Timestamp, Union[Path, Exception]] = dict()
+    if not converter:
+        pendentes = periodo[~periodo.isin(datas)]
+        for data, arquivo_grib in requisicoes.executar_em_paralelo(
+            _baixar, pendentes, max_workers=max_workers
+        ):
+            resultados[data] = arquivo_grib
+        return resultados
+
+    pendentes = periodo[periodo > datas.max()] if len(datas) else periodo
+    max_processos = max_processos or os.cpu_count() or 1
+    mascara = None
+    falhou = False
+    with ProcessPoolExecutor(max_workers=max_processos) as processos:
+        leituras: Deque[Tuple[pd.Timestamp, Future]] = deque()
+        downloads = requisicoes.executar_em_ordem(
+            _baixar, pendentes, max_workers=max_workers
+        )
+        for data, arquivo_grib in zip(pendentes, downloads):
+            if isinstance(arquivo_grib, Exception):
+                resultados[data] = arquivo_grib
+                break
+
+            if contorno is not None and mascara is None:
+                referencia = grade.ler_grib(arquivo_grib, remover_arquivo_grib=False)
+                mascara = grade.obter_mascara(referencia, contorno)
+            leituras.append(
+                (data, processos.submit(grade.ler_grib, arquivo_grib, True, mascara))
+            )
+
+            # anexa os dias já lidos, em ordem, limitando as leituras pendentes
+            while leituras and (
+                len(leituras) > 2 * max_processos or leituras[0][1].done()
+            ):
+                if not _anexar(*leituras.popleft(), cubo, resultados):
+                    falhou = True
+                    break
+            if falhou:
+                break
+        downloads.close()
+
+        while leituras and not falhou:
+            falhou = not _anexar(*leituras.popleft(), cubo, resultados)
+        for _, leitura in leituras:
+            leitura.cancel()
+
+    interrompidos = pendentes[~pendentes.isin(list(resultados))]
+    for data in interrompidos:
+        resultados[data] = RuntimeError(
+            f"{data:%Y-%m-%d} não anexado: um dia anterior falhou."
+        )
+
+    if cubo_pixels is not None and cubo_pixels.exists():
+        grade.atualizar_cubo_pixels(cubo, cubo_pixels)
+
+    return resultados
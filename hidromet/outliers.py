@@ -0,0 +1,403 @@
+"""Detecção de outliers das séries de chuva com DBSCAN e HBOS."""
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+from hidromet import config
+
+
+# raio e número mínimo de vizinhos do dbscan que define o número de classes
+eps = 0.4
+min_amostras = 15
+# regularização e tolerância fora das classes do hbos
+alpha = 0.1
+tol = 0.9
+# fração de outliers esperada em séries muito ou pouco dispersas
+contaminacao_alta = 0.5
+contaminacao_baixa = 0.01
+# quantil dos valores positivos substituído por zero
+quantil_inferior = 0.1
+# coluna do ano na matriz de características
+coluna_ano = 2
+
+
+@dataclass
+class ModeloOutliers:
+    """Parâmetros do HBOS ajustado para um posto."""
+
+    # densidade de cada classe (n_classes x n_caracteristicas)
+    histogramas: np.ndarray
+    # limites das classes (n_classes + 1 x n_caracteristicas)
+    limites: np.ndarray
+    # pontuação acima da qual um dia é considerado outlier
+    limiar: float
+    # valor do quantil inferior substituído por zero
+    quantil: float
+
+    def salvar(self, arquivo: Path) -> None:
+        """
+        Salva os parâmetros do modelo.
+
+        Parameters
+        ----------
+        arquivo : Path
+            Arquivo npz do modelo.
+        """
+        np.savez(
+            arquivo,
+            histogramas=self.histogramas,
+            limites=self.limites,
+            limiar=self.limiar,
+            quantil=self.quantil,
+        )
+
+    @classmethod
+    def carregar(cls, arquivo: Path) -> "ModeloOutliers":
+        """
+        Carrega os parâmetros de um modelo salvo.
+
+        Parameters
+        ----------
+        arquivo : Path
+            Arquivo npz do modelo.
+
+        Returns
+        -------
+        ModeloOutliers
+            Modelo salvo.
+        """
+        with np.load(arquivo) as dados:
+            return cls(
+                histogramas=dados["histogramas"],
+                limites=dados["limites"],
+                limiar=dados["limiar"].item(),
+                quantil=dados["quantil"].item(),
+            )
+
+
+def remover_quantil_inferior(valores: np.ndarray, quantil: float) -> np.ndarray:
+    """
+    Substitui por zero os valores iguais ao quantil inferior dos valores positivos.
+
+    Parameters
+    ----------
+    valores : np.ndarray
+        Valores de chuva sem falhas.
+
+    quantil : float
+        Valor do quantil inferior.
+
+    Returns
+    -------
+    np.ndarray
+        Valores com o quantil inferior substituído.
+    """
+    return np.where(valores == quantil, 0.0, valores)
+
+
+def contar_clusters(
+    valores: np.ndarray, eps: float = eps, min_amostras: int = min_amostras
+) -> int:
+    """
+    Conta os rótulos do DBSCAN de uma série unidimensional.
+
+    Em uma dimensão o DBSCAN se reduz a uma varredura dos valores únicos: os
+    pontos centrais são os que têm ao menos `min_amostras` valores a até `eps` e
+    dois pontos centrais consecutivos a até `eps` pertencem ao mesmo cluster. O
+    resultado é o mesmo de `np.unique(DBSCAN(eps, min_samples).fit_predict(x))`,
+    incluindo o rótulo de ruído, sem montar a vizinhança de cada ponto.
+
+    Parameters
+    ----------
+    valores : np.ndarray
+        Valores da série.
+
+    eps : float
+        Distância máxima entre vizinhos.
+
+    min_amostras : int
+        Número mínimo de vizinhos (incluindo o próprio ponto) de um ponto central.
+
+    Returns
+    -------
+    int
+        Número de rótulos distintos, contando o ruído.
+    """
+    unicos, contagem = np.unique(valores, return_counts=True)
+    acumulado = np.concatenate([[0], np.cumsum(contagem)])
+    fim = np.searchsorted(unicos, unicos + eps, side="right")
+    inicio = np.searchsorted(unicos, unicos - eps, side="left")
+
+    # corrige os arredondamentos de `x ± eps` para que o critério de vizinhança
+    # seja o mesmo do DBSCAN, |a - b| <= eps
+    n = len(unicos)
+    while True:
+        fim_excede = unicos[np.maximum(fim - 1, 0)] - unicos > eps
+        fim_falta = (fim < n) & (unicos[np.minimum(fim, n - 1)] - unicos <= eps)
+        inicio_excede = unicos - unicos[np.minimum(inicio, n - 1)] > eps
+        inicio_falta = (inicio > 0) & (
+            unicos - unicos[np.maximum(inicio - 1, 0)] <= eps
+        )
+        if not (fim_excede | fim_falta | inicio_excede | inicio_falta).any():
+            break
+        fim = fim - fim_excede + fim_falta
+        inicio = inicio + inicio_excede - inicio_falta
+
+    vizinhos = acumulado[fim] - acumulado[inicio]
+    centrais = unicos[vizinhos >= min_amostras]
+    if centrais.size == 0:
+        return 1
+
+    n_clusters = 1 + np.count_nonzero(np.diff(centrais) > eps)
+
+    # distância de cada valor ao ponto central mais próximo
+    posicao = np.searchsorted(centrais, unicos)
+    anterior = centrais[np.clip(posicao - 1, 0, centrais.size - 1)]
+    seguinte = centrais[np.clip(posicao, 0, centrais.size - 1)]
+    distancia = np.minimum(np.abs(unicos - anterior), np.abs(seguinte - unicos))
+    possui_ruido = bool((distancia > eps).any())
+
+    return n_clusters + possui_ruido
+
+
+def caracteristicas(valores: np.ndarray, datas: pd.DatetimeIndex) -> np.ndarray:
+    """
+    Monta a matriz de características do HBOS: valor, mês e ano de cada dia.
+
+    Parameters
+    ----------
+    valores : np.ndarray
+        Valores de chuva.
+
+    datas : pd.DatetimeIndex
+        Datas dos valores.
+
+    Returns
+    -------
+    np.ndarray
+        Matriz (n_dias x 3).
+    """
+    return np.column_stack(
+        [valores, np.asarray(datas.month), np.asarray(datas.year)]
+    ).astype(float)
+
+
+def ajustar(valores: np.ndarray, datas: pd.DatetimeIndex) -> ModeloOutliers:
+    """
+    Ajusta o HBOS às séries de um posto.
+
+    O número de classes é o número de rótulos do DBSCAN (no mínimo dois) e a
+    contaminação é alta quando o desvio padrão supera dez vezes a mediana dos
+    valores positivos.
+
+    Parameters
+    ----------
+    valores : np.ndarray
+        Valores de chuva sem falhas.
+
+    datas : pd.DatetimeIndex
+        Datas dos valores.
+
+    Returns
+    -------
+    ModeloOutliers
+        Parâmetros ajustados.
+    """
+    positivos = valores[valores > 0]
+    quantil = np.quantile(positivos, quantil_inferior) if positivos.size else np.nan
+    valores = remover_quantil_inferior(valores, quantil)
+
+    positivos = valores[valores > 0]
+    mediana10 = np.median(positivos) * 10 if positivos.size else np.nan
+    dispersa = np.std(valores, ddof=1) > mediana10
+    contaminacao = contaminacao_alta if dispersa else contaminacao_baixa
+
+    n_classes = max(contar_clusters(valores), 2)
+    x = caracteristicas(valores, datas)
+    histogramas = np.empty((n_classes, x.shape[1]))
+    limites = np.empty((n_classes + 1, x.shape[1]))
+    for i in range(x.shape[1]):
+        histogramas[:, i], limites[:, i] = np.histogram(
+            x[:, i], bins=n_classes, density=True
+        )
+
+    modelo = ModeloOutliers(histogramas, limites, np.nan, quantil)
+    modelo.limiar = np.percentile(_pontuar(modelo, x), 100 * (1 - contaminacao))
+
+    return modelo
+
+
+def _pontuar(modelo: ModeloOutliers, x: np.ndarray) -> np.ndarray:
+    n_classes = modelo.histogramas.shape[0]
+    log_densidade = np.log2(modelo.histogramas + alpha)
+    pontuacao = np.zeros(len(x))
+
+    for i in range(x.shape[1]):
+        limites = modelo.limites[:, i]
+        densidade = log_densidade[:, i]
+        classe = np.digitize(x[:, i], limites, right=True)
+        pontos = densidade[np.clip(classe, 1, n_classes) - 1]
+
+        # valores fora das classes recebem a classe da borda se estiverem a
+        # menos de `tol` larguras dela, ou a menor densidade caso contrário
+        abaixo = classe == 0
+        distante = limites[0] - x[:, i] > (limites[1] - limites[0]) * tol
+        pontos[abaixo & distante] = densidade.min()
+
+        acima = classe == n_classes + 1
+        distante = x[:, i] - limites[-1] > (limites[-1] - limites[-2]) * tol
+        pontos[acima & distante] = densidade.min()
+
+        pontuacao -= pontos
+
+    return pontuacao
+
+
+def pontuar(
+    modelo: ModeloOutliers, valores: np.ndarray, datas: pd.DatetimeIndex
+) -> np.ndarray:
+    """
+    Calcula a pontuação HBOS de cada dia a partir de um modelo já ajustado.
+
+    Os anos fora do período do ajuste (como os dias novos de uma atualização
+    incremental) são avaliados como o ano mais próximo do ajuste, de forma que
+    apenas o valor e o mês os distinguem dos dias do histórico.
+
+    Parameters
+    ----------
+    modelo : ModeloOutliers
+        Parâmetros do HBOS do posto.
+
+    valores : np.ndarray
+        Valores de chuva sem falhas.
+
+    datas : pd.DatetimeIndex
+        Datas dos valores.
+
+    Returns
+    -------
+    np.ndarray
+        Pontuação de cada dia (quanto maior, mais atípico).
+    """
+    valores = remover_quantil_inferior(valores, modelo.quantil)
+    x = caracteristicas(valores, datas)
+    x[:, coluna_ano] = np.clip(
+        x[:, coluna_ano],
+        modelo.limites[0, coluna_ano],
+        modelo.limites[-1, coluna_ano],
+    )
+    return _pontuar(modelo, x)
+
+
+def detectar(
+    modelo: ModeloOutliers, valores: np.ndarray, datas: pd.DatetimeIndex
+) -> np.ndarray:
+    """
+    Identifica os outliers de uma série a partir de um modelo já ajustado.
+
+    Parameters
+    ----------
+    modelo : ModeloOutliers
+        Parâmetros do HBOS do posto.
+
+    valores : np.ndarray
+        Valores de chuva sem falhas.
+
+    datas : pd.DatetimeIndex
+        Datas dos valores.
+
+    Returns
+    -------
+    np.ndarray
+        Máscara dos dias considerados outliers.
+    """
+    return pontuar(modelo, valores, datas) > modelo.limiar
+
+
+def _processar_posto(
+    valores: np.ndarray,
+    datas: np.ndarray,
+    arquivo_modelo: Optional[Path],
+    reajustar: bool,
+) -> Tuple[np.ndarray, np.ndarray]:
+    datas = pd.DatetimeIndex(datas)
+    if arquivo_modelo is not None and arquivo_modelo.exists() and not reajustar:
+        modelo = ModeloOutliers.carregar(arquivo_modelo)
+    else:
+        modelo = ajustar(valores, datas)
+        if arquivo_modelo is not None:
+            modelo.salvar(arquivo_modelo)
+
+    return remover_quantil_inferior(valores, modelo.quantil), detectar(
+        modelo, valores, datas
+    )
+
+
+def remover_outliers_postos(
+    postos: pd.DataFrame,
+    dir_modelos: Optional[Path] = config.dir_modelos_outliers,
+    reajustar: bool = False,
+    max_processos: Optional[int] = None,
+) -> pd.DataFrame:
+    """
+    Remove os outliers das séries de todos os postos de uma bacia.
+
+    Cada posto é processado em um processo separado. Os parâmetros ajustados são
+    salvos em `<dir_modelos>/<codigo>.npz` e reutilizados nas chamadas
+    seguintes, de forma que novos dias são avaliados sem reajustar o modelo ao
+    histórico completo.
+
+    Parameters
+    ----------
+    postos : pd.DataFrame
+        Séries indexadas por data, com uma coluna por posto.
+
+    dir_modelos : Optional[Path]
+        Diretório dos modelos de cada posto. Caso seja None, os modelos são
+        sempre ajustados e não são salvos.
+
+    reajustar : bool
+        Caso seja desejado ajustar novamente os modelos já salvos.
+
+    max_processos : Optional[int]
+        Número máximo de processos simultâneos.
+
+    Returns
+    -------
+    pd.DataFrame
+        Séries com o quantil inferior substituído e os outliers anulados.
+    """
+    datas = pd.to_datetime(postos.index)
+    resultado = pd.DataFrame(np.nan, index=datas, columns=postos.columns)
+
+    with ProcessPoolExecutor(max_workers=max_processos) as processos:
+        futuros: Dict[str, Tuple] = dict()
+        for codigo in postos.columns:
+            valores = postos[codigo].to_numpy(dtype=float)
+            validos = ~np.isnan(valores)
+            if not validos.any():
+                continue
+            arquivo = (
+                None if dir_modelos is None else Path(dir_modelos, f"{codigo}.npz")
+            )
+            futuro = processos.submit(
+                _processar_posto,
+                valores[validos],
+                datas[validos].values,
+                arquivo,
+                reajustar,
+            )
+            futuros[codigo] = (futuro, validos)
+
+        for codigo, (futuro, validos) in futuros.items():
+            valores, outliers = futuro.result()
+            valores[outliers] = np.nan
+            resultado.loc[validos, codigo] = valores
+
+    return resultado
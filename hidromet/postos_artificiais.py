@@ -0,0 +1,348 @@
+"""Postos artificiais para as áreas da bacia não cobertas pelos postos."""
+import json
+
+from pathlib import Path
+from typing import Literal
+from typing import Optional
+from typing import Tuple
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+import xarray as xr
+
+from scipy import sparse
+from scipy.spatial import cKDTree
+
+from hidromet import config
+from hidromet import grade
+from hidromet import modelos
+
+
+# marcador dos códigos dos postos artificiais, após o nome da bacia
+prefixo_artificial = "V"
+# resolução, em fração do buffer, dos pontos em que a cobertura é avaliada
+resolucao_relativa = 0.2
+# menor área descoberta, em fração do círculo do buffer, que justifica um posto
+fracao_minima = 0.1
+
+
+def _projetado(geometrias: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    """Geometrias em `config.epsg`, assumindo coordenadas geográficas sem crs."""
+    if geometrias.crs is None:
+        geometrias = geometrias.set_crs(epsg=config.epsg_inicial)
+    return geometrias.to_crs(epsg=config.epsg)
+
+
+def _pontos_grade(
+    limites: np.ndarray, espacamento: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Centros das células de uma grade regular que cobre uma caixa envolvente."""
+    x_min, y_min, x_max, y_max = limites
+    x = np.arange(x_min + espacamento / 2, x_max + espacamento / 2, espacamento)
+    y = np.arange(y_min + espacamento / 2, y_max + espacamento / 2, espacamento)
+    x, y = np.meshgrid(x, y)
+    return x.ravel(), y.ravel()
+
+
+def area_descoberta(
+    contorno: gpd.GeoDataFrame,
+    postos: pd.DataFrame,
+    buffer: float = config.buffer,
+) -> gpd.GeoSeries:
+    """
+    Calcula a parte da bacia fora do buffer de todos os postos.
+
+    Parameters
+    ----------
+    contorno : gpd.GeoDataFrame
+        Contorno da bacia.
+
+    postos : pd.DataFrame
+        Tabela de postos com as colunas "latitude" e "longitude".
+
+    buffer : float
+        Raio, em metros, coberto por cada posto.
+
+    Returns
+    -------
+    gpd.GeoSeries
+        Área descoberta, em `config.epsg`.
+    """
+    bacia = _projetado(contorno).unary_union
+    pontos = gpd.GeoSeries(
+        gpd.points_from_xy(
+            pd.to_numeric(postos["longitude"]), pd.to_numeric(postos["latitude"])
+        ),
+        crs=f"epsg:{config.epsg_inicial}",
+    ).to_crs(epsg=config.epsg)
+
+    descoberta = bacia.difference(pontos.buffer(buffer).unary_union)
+
+    return gpd.GeoSeries([descoberta], crs=f"epsg:{config.epsg}")
+
+
+def posicionar_em_grade(
+    descoberta: gpd.GeoSeries,
+    buffer: float = config.buffer,
+    espacamento: Optional[float] = None,
+) -> np.ndarray:
+    """
+    Posiciona postos artificiais nos centros das células de uma grade regular.
+
+    Um posto é criado em cada célula que intercepta a área descoberta, mesmo
+    que o centro da célula esteja fora dela, de forma que as células da borda
+    também são cobertas.
+
+    Parameters
+    ----------
+    descoberta : gpd.GeoSeries
+        Área descoberta, em `config.epsg` (ver `area_descoberta`).
+
+    buffer : float
+        Raio, em metros, coberto por cada posto.
+
+    espacamento : Optional[float]
+        Distância, em metros, entre os pontos da grade. Por padrão, o lado do
+        quadrado inscrito no buffer, de forma que o buffer de cada posto cobre
+        toda a sua célula e a área descoberta é coberta por completo.
+
+    Returns
+    -------
+    np.ndarray
+        Coordenadas (x, y) dos postos dentro da área descoberta, em `config.epsg`.
+    """
+    espacamento = espacamento or buffer * np.sqrt(2)
+    x, y = _pontos_grade(descoberta.total_bounds, espacamento)
+    meio = espacamento / 2
+    celulas = gpd.GeoSeries(
+        shapely.box(x - meio, y - meio, x + meio, y + meio), crs=descoberta.crs
+    )
+    dentro = celulas.intersects(descoberta.unary_union).to_numpy()
+
+    return np.column_stack([x[dentro], y[dentro]])
+
+
+def posicionar_por_cobertura(
+    contorno: gpd.GeoDataFrame,
+    descoberta: gpd.GeoSeries,
+    buffer: float = config.buffer,
+    max_postos: Optional[int] = None,
+    fracao_minima: float = fracao_minima,
+) -> np.ndarray:
+    """
+    Posiciona postos artificiais onde cada um cobre a maior área ainda descoberta.
+
+    A área descoberta é representada por uma grade fina de pontos e os locais
+    candidatos são os pontos da mesma grade em toda a bacia. A cobertura de
+    todos os candidatos é obtida de uma só vez por uma árvore KD, como uma
+    matriz esparsa (candidatos x pontos descobertos), e os postos são escolhidos
+    um a um, sempre o de maior ganho de cobertura.
+
+    Parameters
+    ----------
+    contorno : gpd.GeoDataFrame
+        Contorno da bacia.
+
+    descoberta : gpd.GeoSeries
+        Área descoberta, em `config.epsg` (ver `area_descoberta`).
+
+    buffer : float
+        Raio, em metros, coberto por cada posto.
+
+    max_postos : Optional[int]
+        Número máximo de postos artificiais.
+
+    fracao_minima : float
+        Menor área descoberta coberta por um novo posto, em fração da área do
+        buffer. Abaixo dela, a escolha é interrompida.
+
+    Returns
+    -------
+    np.ndarray
+        Coordenadas (x, y) dos postos, em `config.epsg`, na ordem da escolha.
+    """
+    resolucao = buffer * resolucao_relativa
+    bacia = _projetado(contorno)
+
+    x, y = _pontos_grade(bacia.total_bounds, resolucao)
+    pontos = gpd.GeoSeries(gpd.points_from_xy(x, y), crs=bacia.crs)
+    na_bacia = pontos.within(bacia.unary_union).to_numpy()
+    candidatos = np.column_stack([x[na_bacia], y[na_bacia]])
+    descobertos = pontos[na_bacia].within(descoberta.unary_union).to_numpy()
+    demanda = candidatos[descobertos]
+    if not len(demanda):
+        return np.empty((0, 2))
+
+    vizinhos = cKDTree(demanda).query_ball_point(candidatos, r=buffer)
+    n_vizinhos = np.fromiter((len(v) for v in vizinhos), dtype=int)
+    cobertura = sparse.csr_matrix(
+        (
+            np.ones(n_vizinhos.sum()),
+            np.concatenate([np.asarray(v, dtype=int) for v in vizinhos]),
+            np.concatenate([[0], np.cumsum(n_vizinhos)]),
+        ),
+        shape=(len(candidatos), len(demanda)),
+    )
+
+    ganho_minimo = fracao_minima * np.pi * buffer**2 / resolucao**2
+    restante = np.ones(len(demanda))
+    escolhidos = list()
+    while max_postos is None or len(escolhidos) < max_postos:
+        ganhos = cobertura @ restante
+        melhor = int(np.argmax(ganhos))
+        if ganhos[melhor] < ganho_minimo:
+            break
+        escolhidos.append(melhor)
+        restante[cobertura[melhor].indices] = 0
+
+    return candidatos[escolhidos]
+
+
+def criar_postos(xy: np.ndarray, prefixo: str = prefixo_artificial) -> pd.DataFrame:
+    """
+    Cria a tabela dos postos artificiais a partir das coordenadas projetadas.
+
+    Parameters
+    ----------
+    xy : np.ndarray
+        Coordenadas (x, y) dos postos, em `config.epsg`.
+
+    prefixo : str
+        Prefixo dos códigos, seguido do número do posto.
+
+    Returns
+    -------
+    pd.DataFrame
+        Tabela de postos com as colunas "codigo", "latitude" e "longitude".
+    """
+    pontos = gpd.GeoSeries(
+        gpd.points_from_xy(xy[:, 0], xy[:, 1]), crs=f"epsg:{config.epsg}"
+    ).to_crs(epsg=config.epsg_inicial)
+
+    return pd.DataFrame(
+        {
+            "codigo": [f"{prefixo}{i + 1:03d}" for i in range(len(xy))],
+            "latitude": pontos.y.to_numpy(),
+            "longitude": pontos.x.to_numpy(),
+        }
+    )
+
+
+def salvar_postos(
+    postos: pd.DataFrame, series: pd.DataFrame, nome: str, diretorio: Path
+) -> None:
+    """
+    Salva as séries e as informações dos postos artificiais.
+
+    Cada série é salva em `<codigo>.csv`, como as séries preenchidas, e os
+    postos em `coords_<nome>.json`, como uma lista de `modelos.Posto`.
+
+    Parameters
+    ----------
+    postos : pd.DataFrame
+        Tabela de postos artificiais (ver `criar_postos`).
+
+    series : pd.DataFrame
+        Séries dos postos indexadas por data, com uma coluna por código.
+
+    nome : str
+        Nome da bacia.
+
+    diretorio : Path
+        Diretório de saída.
+    """
+    # índice sem nome, como o dos arquivos de `preenchimento.preencher_diretorio`
+    exportar = series.set_axis(
+        pd.to_datetime(series.index).strftime("%Y-%m-%d")
+    ).rename_axis(None)
+    for codigo in exportar.columns:
+        exportar[codigo].to_csv(diretorio.joinpath(f"{codigo}.csv"))
+
+    info_postos = [
+        modelos.Posto(**posto).dict() for posto in postos.to_dict(orient="records")
+    ]
+    with open(diretorio.joinpath(f"coords_{nome}.json"), "w") as f:
+        json.dump(info_postos, f)
+
+
+def gerar_postos_artificiais(
+    contorno: gpd.GeoDataFrame,
+    postos: pd.DataFrame,
+    dataset: Optional[xr.Dataset] = None,
+    metodo: Literal["cobertura", "grade"] = "cobertura",
+    buffer: float = config.buffer,
+    max_postos: Optional[int] = None,
+    coluna: str = "bacia",
+    prefixo: Optional[str] = None,
+    diretorio: Optional[Path] = config.dir_final_extra,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Cria postos artificiais nas áreas descobertas da bacia e as suas séries.
+
+    As séries são extraídas do merge da mesma forma que as dos postos reais:
+    média dos pontos de grade no buffer recortado pela bacia, por
+    `grade.criar_matriz_pesos` e `grade.extrair_series`.
+
+    Parameters
+    ----------
+    contorno : gpd.GeoDataFrame
+        Contorno da bacia, com o nome na coluna `coluna`.
+
+    postos : pd.DataFrame
+        Tabela dos postos reais, com as colunas "latitude" e "longitude", como
+        as tabelas `coords_<bacia>.json` de `config.dir_prec_concat`.
+
+    dataset : Optional[xr.Dataset]
+        Dataset do merge. Por padrão, o cubo (`grade.abrir_cubo`).
+
+    metodo : {"cobertura", "grade"}
+        Posicionamento dos postos: onde cada um cobre a maior área descoberta
+        (`posicionar_por_cobertura`) ou em uma grade regular
+        (`posicionar_em_grade`).
+
+    buffer : float
+        Raio, em metros, coberto por cada posto.
+
+    max_postos : Optional[int]
+        Número máximo de postos artificiais (apenas no método "cobertura").
+
+    coluna : str
+        Coluna com o nome da bacia.
+
+    prefixo : Optional[str]
+        Prefixo dos códigos dos postos artificiais. Por padrão, o nome da bacia
+        seguido de `_V` (por exemplo, `Iguacu_V001`), de forma que bacias
+        diferentes no mesmo diretório não sobrescrevem os postos umas das
+        outras.
+
+    diretorio : Optional[Path]
+        Diretório de saída (ver `salvar_postos`). Caso seja None, nada é salvo.
+
+    Returns
+    -------
+    Tuple[pd.DataFrame, pd.DataFrame]
+        Tabela dos postos artificiais e as suas séries, indexadas por data.
+    """
+    nome = contorno[coluna].iloc[0]
+    if prefixo is None:
+        prefixo = f"{nome}_{prefixo_artificial}"
+
+    descoberta = area_descoberta(contorno, postos, buffer)
+    if metodo == "grade":
+        xy = posicionar_em_grade(descoberta, buffer)
+    else:
+        xy = posicionar_por_cobertura(contorno, descoberta, buffer, max_postos)
+    artificiais = criar_postos(xy, prefixo)
+    if artificiais.empty:
+        return artificiais, pd.DataFrame()
+
+    dataset = grade.abrir_cubo() if dataset is None else dataset
+    pesos = grade.criar_matriz_pesos(dataset, artificiais, contorno, buffer)
+    series = grade.extrair_series(dataset, pesos, artificiais["codigo"].tolist())
+
+    if diretorio is not None:
+        salvar_postos(artificiais, series, nome, diretorio)
+
+    return artificiais, series
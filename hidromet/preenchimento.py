@@ -0,0 +1,1055 @@
+"""Preenchimento das falhas dos postos pelo merge corrigido e pelos postos vizinhos."""
+import warnings
+
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+from scipy.spatial import cKDTree
+
+from hidromet import config
+from hidromet import contornos
+from hidromet import utils
+
+
+# número de quantis ajustados em cada mês de cada posto
+n_quantis = 51
+# probabilidade do maior quantil: acima dela, a correção é uma diferença constante,
+# já que os máximos mensais são instáveis entre os anos
+probabilidade_maxima = 0.99
+# número mínimo de dias com posto e satélite para ajustar a correção de um mês
+min_amostras = 60
+# número de vizinhos de cada posto e de postos mais próximos avaliados como vizinhos
+n_vizinhos = 5
+n_candidatos = 15
+# correlação diária e número de dias em comum mínimos de um vizinho
+min_correlacao = 0.5
+min_dias_vizinhos = 365
+# potência da distância inversa
+potencia_distancia = 2
+
+
+@dataclass
+class CorrecaoQuantis:
+    """Quantis do satélite e do posto em cada mês de cada posto."""
+
+    # códigos dos postos
+    codigos: np.ndarray
+    # probabilidades dos quantis
+    probabilidades: np.ndarray
+    # quantis do satélite (postos x 12 x quantis), NaN nos meses sem correção
+    quantis_satelite: np.ndarray
+    # quantis do posto nas mesmas probabilidades
+    quantis_posto: np.ndarray
+    # número de dias com posto e satélite em cada mês (postos x 12)
+    n_amostras: np.ndarray
+
+    def selecionar(self, codigos: List[str]) -> Optional["CorrecaoQuantis"]:
+        """
+        Seleciona os postos de uma lista, na ordem da lista.
+
+        Parameters
+        ----------
+        codigos : List[str]
+            Códigos dos postos.
+
+        Returns
+        -------
+        Optional[CorrecaoQuantis]
+            Correção dos postos, ou None caso algum deles não tenha sido ajustado.
+        """
+        posicoes = pd.Index(self.codigos).get_indexer([str(c) for c in codigos])
+        if (posicoes < 0).any():
+            return None
+
+        return CorrecaoQuantis(
+            codigos=self.codigos[posicoes],
+            probabilidades=self.probabilidades,
+            quantis_satelite=self.quantis_satelite[posicoes],
+            quantis_posto=self.quantis_posto[posicoes],
+            n_amostras=self.n_amostras[posicoes],
+        )
+
+    def mesclar(self, outra: "CorrecaoQuantis") -> "CorrecaoQuantis":
+        """
+        Une as correções de dois conjuntos de postos.
+
+        Parameters
+        ----------
+        outra : CorrecaoQuantis
+            Correção com as mesmas probabilidades. Os postos presentes nas
+            duas são substituídos pelos desta.
+
+        Returns
+        -------
+        CorrecaoQuantis
+            Correção dos postos de ambas.
+        """
+        if not np.array_equal(self.probabilidades, outra.probabilidades):
+            raise ValueError(
+                "Correções com probabilidades diferentes: utilize outro arquivo "
+                "para os novos parâmetros."
+            )
+
+        mantidos = ~np.isin(self.codigos, outra.codigos)
+        return CorrecaoQuantis(
+            codigos=np.concatenate([self.codigos[mantidos], outra.codigos]),
+            probabilidades=self.probabilidades,
+            quantis_satelite=np.concatenate(
+                [self.quantis_satelite[mantidos], outra.quantis_satelite]
+            ),
+            quantis_posto=np.concatenate(
+                [self.quantis_posto[mantidos], outra.quantis_posto]
+            ),
+            n_amostras=np.concatenate([self.n_amostras[mantidos], outra.n_amostras]),
+        )
+
+    def salvar(self, arquivo: Path) -> None:
+        """
+        Salva os parâmetros da correção.
+
+        Parameters
+        ----------
+        arquivo : Path
+            Arquivo npz da correção.
+        """
+        np.savez(
+            arquivo,
+            codigos=self.codigos.astype(str),
+            probabilidades=self.probabilidades,
+            quantis_satelite=self.quantis_satelite,
+            quantis_posto=self.quantis_posto,
+            n_amostras=self.n_amostras,
+        )
+
+    @classmethod
+    def carregar(cls, arquivo: Path) -> "CorrecaoQuantis":
+        """
+        Carrega os parâmetros de uma correção salva.
+
+        Parameters
+        ----------
+        arquivo : Path
+            Arquivo npz da correção.
+
+        Returns
+        -------
+        CorrecaoQuantis
+            Correção salva.
+        """
+        with np.load(arquivo) as dados:
+            return cls(
+                codigos=dados["codigos"],
+                probabilidades=dados["probabilidades"],
+                quantis_satelite=dados["quantis_satelite"],
+                quantis_posto=dados["quantis_posto"],
+                n_amostras=dados["n_amostras"],
+            )
+
+
+def ajustar_correcao(
+    postos: np.ndarray,
+    satelite: np.ndarray,
+    meses: np.ndarray,
+    codigos: List[str],
+    n_quantis: int = n_quantis,
+    probabilidade_maxima: float = probabilidade_maxima,
+    min_amostras: int = min_amostras,
+) -> CorrecaoQuantis:
+    """
+    Ajusta a correção por mapeamento de quantis de todos os postos.
+
+    Para cada mês, os quantis do posto e do satélite são calculados de uma só
+    vez para todos os postos, apenas sobre os dias em que ambos têm dado.
+
+    Parameters
+    ----------
+    postos : np.ndarray
+        Chuva observada (dias x postos).
+
+    satelite : np.ndarray
+        Chuva do satélite nos mesmos dias e postos.
+
+    meses : np.ndarray
+        Mês (1 a 12) de cada dia.
+
+    codigos : List[str]
+        Códigos dos postos das colunas.
+
+    n_quantis : int
+        Número de quantis, igualmente espaçados entre o mínimo e a
+        probabilidade máxima.
+
+    probabilidade_maxima : float
+        Probabilidade do maior quantil.
+
+    min_amostras : int
+        Número mínimo de dias em comum para que o mês de um posto seja
+        corrigido. Meses com menos dias ficam sem correção.
+
+    Returns
+    -------
+    CorrecaoQuantis
+        Correção ajustada.
+    """
+    postos = np.asarray(postos, dtype=np.float64)
+    satelite = np.asarray(satelite, dtype=np.float64)
+    meses = np.asarray(meses)
+    probabilidades = np.linspace(0, probabilidade_maxima, n_quantis)
+
+    forma = (postos.shape[1], 12, n_quantis)
+    quantis_satelite = np.full(forma, np.nan)
+    quantis_posto = np.full(forma, np.nan)
+    n_amostras = np.zeros(forma[:2], dtype=np.int64)
+
+    for mes in range(1, 13):
+        linhas = meses == mes
+        comum = ~np.isnan(postos[linhas]) & ~np.isnan(satelite[linhas])
+        n_amostras[:, mes - 1] = comum.sum(axis=0)
+
+        ajustaveis = n_amostras[:, mes - 1] >= min_amostras
+        if not ajustaveis.any():
+            continue
+        comum = comum[:, ajustaveis]
+        obs = np.where(comum, postos[linhas][:, ajustaveis], np.nan)
+        sat = np.where(comum, satelite[linhas][:, ajustaveis], np.nan)
+        quantis_posto[ajustaveis, mes - 1] = np.nanquantile(
+            obs, probabilidades, axis=0
+        ).T
+        quantis_satelite[ajustaveis, mes - 1] = np.nanquantile(
+            sat, probabilidades, axis=0
+        ).T
+
+    return CorrecaoQuantis(
+        codigos=np.array([str(c) for c in codigos]),
+        probabilidades=probabilidades,
+        quantis_satelite=quantis_satelite,
+        quantis_posto=quantis_posto,
+        n_amostras=n_amostras,
+    )
+
+
+def _interpolar(
+    x: np.ndarray, grupos: np.ndarray, xp: np.ndarray, lado: str
+) -> np.ndarray:
+    """
+    Posição fracionária de cada valor entre os quantis do seu grupo.
+
+    Todos os grupos são buscados de uma só vez: cada linha de `xp` é deslocada
+    por um múltiplo de uma escala maior que a faixa dos valores, de forma que a
+    concatenação das linhas fica ordenada.
+    """
+    n_quantis = xp.shape[1]
+    minimo = min(xp.min(), x.min())
+    escala = max(xp.max(), x.max()) - minimo + 1
+    deslocamento = escala * np.arange(len(xp))
+
+    plano = (xp - minimo + deslocamento[:, None]).ravel()
+    alvo = x - minimo + deslocamento[grupos]
+    posicao = np.searchsorted(plano, alvo, side=lado) - grupos * n_quantis
+    superior = np.clip(posicao, 1, n_quantis - 1)
+    inferior = superior - 1
+
+    x_inf, x_sup = xp[grupos, inferior], xp[grupos, superior]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        fracao = np.where(x_sup > x_inf, (x - x_inf) / (x_sup - x_inf), 0.0)
+
+    return inferior + np.clip(fracao, 0, 1)
+
+
+def corrigir(
+    correcao: CorrecaoQuantis, satelite: np.ndarray, meses: np.ndarray
+) -> np.ndarray:
+    """
+    Corrige a chuva do satélite de todos os postos por mapeamento de quantis.
+
+    Cada valor do satélite é levado à sua probabilidade na distribuição do
+    satélite do mês e do posto e substituído pelo quantil do posto com a mesma
+    probabilidade. Valores empatados (como os dias secos) recebem a
+    probabilidade do meio do empate. Acima do maior quantil, a diferença entre
+    os maiores quantis é somada ao valor. Meses sem correção mantêm o valor do
+    satélite.
+
+    Parameters
+    ----------
+    correcao : CorrecaoQuantis
+        Correção dos postos das colunas (ver `CorrecaoQuantis.selecionar`).
+
+    satelite : np.ndarray
+        Chuva do satélite (dias x postos), ou de um único dia (postos).
+
+    meses : np.ndarray
+        Mês (1 a 12) de cada dia, ou o mês do dia.
+
+    Returns
+    -------
+    np.ndarray
+        Chuva corrigida, com a mesma forma da chuva do satélite.
+    """
+    satelite = np.asarray(satelite, dtype=np.float64)
+    forma = satelite.shape
+    satelite = np.atleast_2d(satelite)
+    meses = np.broadcast_to(np.asarray(meses), satelite.shape[:1])
+
+    n_postos = satelite.shape[1]
+    xp = correcao.quantis_satelite.reshape(n_postos * 12, -1).copy()
+    fp = correcao.quantis_posto.reshape(n_postos * 12, -1).copy()
+    # meses sem correção: quantis iguais nas duas distribuições (identidade)
+    sem_correcao = np.isnan(xp).any(axis=1) | np.isnan(fp).any(axis=1)
+    xp[sem_correcao] = fp[sem_correcao] = np.arange(xp.shape[1])
+
+    grupos = np.arange(n_postos)[None, :] * 12 + (meses[:, None] - 1)
+    validos = ~np.isnan(satelite)
+    x, grupos = satelite[validos], grupos[validos]
+    corrigido = np.full(satelite.shape, np.nan)
+    if not len(x):
+        return corrigido.reshape(forma)
+
+    # posição média entre o primeiro e o último quantil empatados com o valor
+    posicao = (
+        _interpolar(x, grupos, xp, "left") + _interpolar(x, grupos, xp, "right")
+    ) / 2
+    inferior = np.minimum(posicao.astype(int), xp.shape[1] - 2)
+    fracao = posicao - inferior
+    y = fp[grupos, inferior] + fracao * (
+        fp[grupos, inferior + 1] - fp[grupos, inferior]
+    )
+
+    acima = x > xp[grupos, -1]
+    y[acima] = fp[grupos[acima], -1] + x[acima] - xp[grupos[acima], -1]
+
+    corrigido[validos] = np.maximum(y, 0)
+
+    return corrigido.reshape(forma)
+
+
+def obter_correcao(
+    postos: pd.DataFrame,
+    satelite: pd.DataFrame,
+    arquivo: Path = config.dir_correcao_merge,
+    reajustar: bool = False,
+    **kwargs,
+) -> CorrecaoQuantis:
+    """
+    Obtém a correção dos postos, ajustando-a apenas uma vez.
+
+    A correção é salva em disco e reaproveitada, de forma que as execuções
+    diárias apenas a aplicam ao dia novo. Apenas os postos que ainda não estão
+    no arquivo são ajustados, e as suas tabelas são acrescentadas às dos demais
+    postos do arquivo. Para incorporar o histórico mais recente, utilizar
+    `reajustar`, que ajusta novamente os postos pedidos e mantém os demais.
+
+    Parameters
+    ----------
+    postos : pd.DataFrame
+        Séries observadas indexadas por data, com uma coluna por posto.
+
+    satelite : pd.DataFrame
+        Séries do satélite com as mesmas colunas.
+
+    arquivo : Path
+        Arquivo npz da correção.
+
+    reajustar : bool
+        Caso seja desejado ajustar novamente a correção salva.
+
+    **kwargs
+        Parâmetros repassados para `ajustar_correcao`.
+
+    Returns
+    -------
+    CorrecaoQuantis
+        Correção dos postos, na ordem das colunas.
+    """
+    codigos = [str(c) for c in postos.columns]
+    postos = postos.set_axis(codigos, axis=1)
+    satelite = satelite.set_axis([str(c) for c in satelite.columns], axis=1)
+
+    salva = CorrecaoQuantis.carregar(arquivo) if arquivo.exists() else None
+    ajustar = codigos
+    if salva is not None and not reajustar:
+        correcao = salva.selecionar(codigos)
+        if correcao is not None:
+            return correcao
+        ajustar = [c for c in codigos if c not in set(salva.codigos)]
+
+    postos, satelite = postos[ajustar].align(satelite[ajustar], join="inner", axis=0)
+    meses = pd.to_datetime(postos.index).month.to_numpy()
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        correcao = ajustar_correcao(
+            postos.to_numpy(dtype=float),
+            satelite.to_numpy(dtype=float),
+            meses,
+            ajustar,
+            **kwargs,
+        )
+
+    if salva is not None:
+        correcao = salva.mesclar(correcao)
+    correcao.salvar(arquivo)
+
+    return correcao.selecionar(codigos)
+
+
+def preencher(
+    postos: pd.DataFrame, satelite: pd.DataFrame, correcao: CorrecaoQuantis
+) -> pd.DataFrame:
+    """
+    Preenche as falhas dos postos com o satélite corrigido.
+
+    Parameters
+    ----------
+    postos : pd.DataFrame
+        Séries observadas indexadas por data, com uma coluna por posto.
+
+    satelite : pd.DataFrame
+        Séries do satélite dos mesmos postos. Para uma execução diária, basta
+        a linha do dia novo.
+
+    correcao : CorrecaoQuantis
+        Correção dos postos, na ordem das colunas (ver `obter_correcao`).
+
+    Returns
+    -------
+    pd.DataFrame
+        Séries preenchidas, na união das datas dos postos e do satélite.
+    """
+    indice = pd.to_datetime(postos.index).union(pd.to_datetime(satelite.index))
+    postos = postos.set_axis(pd.to_datetime(postos.index)).reindex(indice)
+    satelite = satelite.set_axis(pd.to_datetime(satelite.index))
+    satelite = satelite.reindex(index=indice, columns=postos.columns)
+
+    corrigido = corrigir(
+        correcao, satelite.to_numpy(dtype=float), indice.month.to_numpy()
+    )
+    valores = postos.to_numpy(dtype=float)
+    preenchido = np.where(np.isnan(valores), corrigido, valores)
+
+    return pd.DataFrame(preenchido, index=indice, columns=postos.columns)
+
+
+@dataclass
+class VizinhosPostos:
+    """Vizinhos mais correlacionados de cada posto e os seus pesos."""
+
+    # códigos dos postos
+    codigos: np.ndarray
+    # posição dos vizinhos de cada posto (postos x k), -1 quando não há vizinho
+    vizinhos: np.ndarray
+    # peso de distância inversa de cada vizinho
+    pesos: np.ndarray
+    # razão entre as médias do posto e do vizinho nos dias em comum
+    razoes: np.ndarray
+    # correlação diária entre o posto e o vizinho
+    correlacoes: np.ndarray
+
+    def _codigos_vizinhos(self) -> np.ndarray:
+        """Código de cada vizinho, vazio quando não há vizinho."""
+        return np.where(self.vizinhos >= 0, self.codigos.astype(str)[self.vizinhos], "")
+
+    def selecionar(self, codigos: List[str]) -> Optional["VizinhosPostos"]:
+        """
+        Seleciona os postos de uma lista, na ordem da lista.
+
+        Parameters
+        ----------
+        codigos : List[str]
+            Códigos dos postos.
+
+        Returns
+        -------
+        Optional[VizinhosPostos]
+            Grafo dos postos, com os vizinhos indicados pela posição na lista, ou
+            None caso algum posto ou vizinho não esteja no grafo ou na lista.
+        """
+        codigos = pd.Index([str(c) for c in codigos])
+        posicoes = pd.Index(self.codigos.astype(str)).get_indexer(codigos)
+        if (posicoes < 0).any():
+            return None
+
+        possui_vizinho = self.vizinhos[posicoes] >= 0
+        vizinhos = codigos.get_indexer(
+            self._codigos_vizinhos()[posicoes].ravel()
+        ).reshape(possui_vizinho.shape)
+        if (vizinhos[possui_vizinho] < 0).any():
+            return None
+
+        return VizinhosPostos(
+            codigos=codigos.to_numpy(),
+            vizinhos=np.where(possui_vizinho, vizinhos, -1),
+            pesos=self.pesos[posicoes],
+            razoes=self.razoes[posicoes],
+            correlacoes=self.correlacoes[posicoes],
+        )
+
+    def mesclar(self, outra: "VizinhosPostos") -> "VizinhosPostos":
+        """
+        Une os grafos de dois conjuntos de postos.
+
+        Parameters
+        ----------
+        outra : VizinhosPostos
+            Grafo com o mesmo número de vizinhos. Os postos presentes nos dois
+            são substituídos pelos deste.
+
+        Returns
+        -------
+        VizinhosPostos
+            Grafo dos postos de ambos, com os vizinhos indicados pela posição
+            nos códigos unidos.
+        """
+        if self.vizinhos.shape[1] != outra.vizinhos.shape[1]:
+            raise ValueError(
+                "Grafos com números de vizinhos diferentes: utilize outro arquivo "
+                "para os novos parâmetros."
+            )
+
+        mantidos = ~np.isin(self.codigos.astype(str), outra.codigos.astype(str))
+        codigos = np.concatenate(
+            [self.codigos.astype(str)[mantidos], outra.codigos.astype(str)]
+        )
+        codigos_vizinhos = np.concatenate(
+            [self._codigos_vizinhos()[mantidos], outra._codigos_vizinhos()]
+        )
+        vizinhos = (
+            pd.Index(codigos)
+            .get_indexer(codigos_vizinhos.ravel())
+            .reshape(codigos_vizinhos.shape)
+        )
+
+        return VizinhosPostos(
+            codigos=codigos,
+            vizinhos=vizinhos,
+            pesos=np.concatenate([self.pesos[mantidos], outra.pesos]),
+            razoes=np.concatenate([self.razoes[mantidos], outra.razoes]),
+            correlacoes=np.concatenate([self.correlacoes[mantidos], outra.correlacoes]),
+        )
+
+    def salvar(self, arquivo: Path) -> None:
+        """
+        Salva o grafo de vizinhos.
+
+        Parameters
+        ----------
+        arquivo : Path
+            Arquivo npz do grafo.
+        """
+        np.savez(
+            arquivo,
+            codigos=self.codigos.astype(str),
+            vizinhos=self.vizinhos,
+            pesos=self.pesos,
+            razoes=self.razoes,
+            correlacoes=self.correlacoes,
+        )
+
+    @classmethod
+    def carregar(cls, arquivo: Path) -> "VizinhosPostos":
+        """
+        Carrega um grafo de vizinhos salvo.
+
+        Parameters
+        ----------
+        arquivo : Path
+            Arquivo npz do grafo.
+
+        Returns
+        -------
+        VizinhosPostos
+            Grafo salvo.
+        """
+        with np.load(arquivo) as dados:
+            return cls(
+                codigos=dados["codigos"],
+                vizinhos=dados["vizinhos"],
+                pesos=dados["pesos"],
+                razoes=dados["razoes"],
+                correlacoes=dados["correlacoes"],
+            )
+
+
+def carregar_coordenadas(arquivos: Iterable[Path]) -> pd.DataFrame:
+    """
+    Lê as coordenadas dos postos de tabelas `coords_*.json`.
+
+    São aceitas tanto as tabelas por fonte (`modelos.Bacia`, das quais todos os
+    postos são lidos) quanto as listas de postos das séries concatenadas.
+
+    Parameters
+    ----------
+    arquivos : Iterable[Path]
+        Arquivos json, como `config.dir_prec_concat.glob("coords_*.json")`.
+
+    Returns
+    -------
+    pd.DataFrame
+        Latitude e longitude de cada posto, indexadas pelo código.
+    """
+    postos = list()
+    for arquivo in arquivos:
+        tabela = utils.carregar_json(arquivo)
+        if isinstance(tabela, dict):
+            tabela = [
+                posto
+                for campo in (
+                    "serie_vazia",
+                    "nao_representativos",
+                    "com_falhas",
+                    "postos_ok",
+                )
+                for posto in tabela[campo]
+            ]
+        postos.extend(tabela)
+
+    coordenadas = pd.DataFrame(postos, columns=["codigo", "latitude", "longitude"])
+    coordenadas["codigo"] = coordenadas["codigo"].astype(str)
+    coordenadas = coordenadas.drop_duplicates("codigo").set_index("codigo")
+
+    return coordenadas.astype(float)
+
+
+def ajustar_vizinhos(
+    coordenadas: pd.DataFrame,
+    series: pd.DataFrame,
+    k: int = n_vizinhos,
+    n_candidatos: int = n_candidatos,
+    min_correlacao: float = min_correlacao,
+    min_dias: int = min_dias_vizinhos,
+    potencia: float = potencia_distancia,
+) -> VizinhosPostos:
+    """
+    Seleciona os k vizinhos mais correlacionados de cada posto.
+
+    Os `n_candidatos` postos mais próximos de cada posto são encontrados de uma
+    só vez por uma árvore KD sobre as coordenadas projetadas. A correlação e a
+    razão das médias com cada candidato são calculadas sobre os dias em comum,
+    para todos os postos de uma vez (uma operação por ordem de proximidade).
+
+    Parameters
+    ----------
+    coordenadas : pd.DataFrame
+        Latitude e longitude de cada posto, indexadas pelo código (ver
+        `carregar_coordenadas`).
+
+    series : pd.DataFrame
+        Séries observadas indexadas por data, com uma coluna por posto. Postos
+        sem coordenadas ficam sem vizinhos e não são vizinhos de nenhum posto.
+
+    k : int
+        Número máximo de vizinhos de cada posto.
+
+    n_candidatos : int
+        Número de postos mais próximos avaliados.
+
+    min_correlacao : float
+        Correlação diária mínima de um vizinho.
+
+    min_dias : int
+        Número mínimo de dias em comum com um vizinho.
+
+    potencia : float
+        Potência da distância no peso de cada vizinho.
+
+    Returns
+    -------
+    VizinhosPostos
+        Grafo de vizinhos, na ordem das colunas das séries.
+    """
+    codigos = np.array([str(c) for c in series.columns])
+    valores = series.to_numpy(dtype=np.float64)
+    validos = ~np.isnan(valores)
+    n_postos = len(codigos)
+
+    coordenadas = coordenadas.reindex(codigos)
+    localizados = np.flatnonzero(coordenadas.notna().all(axis=1).to_numpy())
+    xy = contornos.projetar_coordenadas(
+        coordenadas["latitude"].to_numpy()[localizados],
+        coordenadas["longitude"].to_numpy()[localizados],
+    )
+
+    n_candidatos = min(n_candidatos, len(localizados) - 1)
+    candidatos = np.full((n_postos, max(n_candidatos, 0)), -1)
+    distancias = np.full(candidatos.shape, np.inf)
+    if n_candidatos > 0:
+        distancia, posicao = cKDTree(xy).query(xy, k=n_candidatos + 1)
+        # remove o próprio posto (ou um posto co-localizado na mesma posição)
+        proprio = posicao == np.arange(len(localizados))[:, None]
+        proprio[proprio.sum(axis=1) == 0, -1] = True
+        candidatos[localizados] = localizados[posicao[~proprio]].reshape(
+            len(localizados), n_candidatos
+        )
+        distancias[localizados] = distancia[~proprio].reshape(
+            len(localizados), n_candidatos
+        )
+
+    correlacoes = np.full(candidatos.shape, np.nan)
+    razoes = np.full(candidatos.shape, np.nan)
+    n_comum = np.zeros(candidatos.shape, dtype=np.int64)
+    x = np.where(validos, valores, 0)
+    for ordem in range(candidatos.shape[1]):
+        vizinho = candidatos[:, ordem]
+        comum = validos & validos[:, vizinho] & (vizinho >= 0)
+        n = comum.sum(axis=0)
+        a, b = np.where(comum, x, 0), np.where(comum, x[:, vizinho], 0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            media_a, media_b = a.sum(axis=0) / n, b.sum(axis=0) / n
+            covariancia = (a * b).sum(axis=0) / n - media_a * media_b
+            variancia_a = (a * a).sum(axis=0) / n - media_a**2
+            variancia_b = (b * b).sum(axis=0) / n - media_b**2
+            correlacoes[:, ordem] = covariancia / np.sqrt(variancia_a * variancia_b)
+            razoes[:, ordem] = media_a / media_b
+        n_comum[:, ordem] = n
+
+    elegiveis = (
+        (candidatos >= 0)
+        & (n_comum >= min_dias)
+        & (correlacoes >= min_correlacao)
+        & np.isfinite(razoes)
+    )
+    escolha = np.argsort(np.where(elegiveis, -correlacoes, np.inf), axis=1)
+    escolha = escolha[:, : min(k, candidatos.shape[1])]
+
+    def escolher(matriz: np.ndarray) -> np.ndarray:
+        return np.take_along_axis(matriz, escolha, axis=1)
+
+    elegiveis = escolher(elegiveis)
+    pesos = 1 / np.maximum(escolher(distancias), 1) ** potencia
+
+    return VizinhosPostos(
+        codigos=codigos,
+        vizinhos=np.where(elegiveis, escolher(candidatos), -1),
+        pesos=np.where(elegiveis, pesos, 0),
+        razoes=np.where(elegiveis, escolher(razoes), np.nan),
+        correlacoes=np.where(elegiveis, escolher(correlacoes), np.nan),
+    )
+
+
+def obter_vizinhos(
+    coordenadas: pd.DataFrame,
+    series: pd.DataFrame,
+    arquivo: Path = config.dir_vizinhos,
+    reajustar: bool = False,
+    **kwargs,
+) -> VizinhosPostos:
+    """
+    Obtém o grafo de vizinhos dos postos, calculando-o apenas uma vez.
+
+    O grafo é salvo em disco e reaproveitado enquanto os postos pedidos e os
+    seus vizinhos estiverem no arquivo. Caso contrário, o grafo dos postos
+    pedidos é calculado e unido aos demais postos do arquivo, de forma que os
+    grafos de outras bacias são mantidos.
+
+    Parameters
+    ----------
+    coordenadas : pd.DataFrame
+        Latitude e longitude de cada posto, indexadas pelo código.
+
+    series : pd.DataFrame
+        Séries observadas indexadas por data, com uma coluna por posto.
+
+    arquivo : Path
+        Arquivo npz do grafo.
+
+    reajustar : bool
+        Caso seja desejado calcular novamente o grafo dos postos pedidos.
+
+    **kwargs
+        Parâmetros repassados para `ajustar_vizinhos`.
+
+    Returns
+    -------
+    VizinhosPostos
+        Grafo de vizinhos, na ordem das colunas das séries.
+    """
+    codigos = [str(c) for c in series.columns]
+    salvo = VizinhosPostos.carregar(arquivo) if arquivo.exists() else None
+    if salvo is not None and not reajustar:
+        vizinhos = salvo.selecionar(codigos)
+        if vizinhos is not None:
+            return vizinhos
+
+    vizinhos = ajustar_vizinhos(coordenadas, series, **kwargs)
+    (vizinhos if salvo is None else salvo.mesclar(vizinhos)).salvar(arquivo)
+
+    return vizinhos
+
+
+def estimar_por_vizinhos(
+    series: pd.DataFrame,
+    vizinhos: VizinhosPostos,
+    dias_por_bloco: int = 4096,
+) -> pd.DataFrame:
+    """
+    Estima a chuva de todos os postos em todos os dias a partir dos vizinhos.
+
+    Em cada dia, a estimativa de um posto é a média dos valores dos seus
+    vizinhos com dado, ponderada pelo inverso da distância e escalada pela
+    razão entre as médias do posto e de cada vizinho. Todos os postos e dias de
+    um bloco são calculados por operações mascaradas sobre a matriz (dias x
+    postos x vizinhos).
+
+    Parameters
+    ----------
+    series : pd.DataFrame
+        Séries observadas indexadas por data, com as colunas na ordem do grafo.
+
+    vizinhos : VizinhosPostos
+        Grafo de vizinhos (ver `obter_vizinhos`).
+
+    dias_por_bloco : int
+        Número de dias calculados por vez.
+
+    Returns
+    -------
+    pd.DataFrame
+        Estimativa de cada posto, NaN nos dias sem nenhum vizinho com dado.
+    """
+    valores = series.to_numpy(dtype=np.float64)
+    possui_vizinho = vizinhos.vizinhos >= 0
+    indices = np.where(possui_vizinho, vizinhos.vizinhos, 0)
+    fatores = np.where(possui_vizinho, vizinhos.pesos * vizinhos.razoes, 0)
+    pesos = np.where(possui_vizinho, vizinhos.pesos, 0)
+
+    estimativa = np.full(valores.shape, np.nan)
+    for inicio in range(0, len(valores), dias_por_bloco):
+        bloco = valores[inicio : inicio + dias_por_bloco][:, indices]
+        com_dado = ~np.isnan(bloco)
+        soma = (np.where(com_dado, bloco, 0) * fatores).sum(axis=2)
+        peso_total = (com_dado * pesos).sum(axis=2)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            estimativa[inicio : inicio + dias_por_bloco] = np.where(
+                peso_total > 0, soma / peso_total, np.nan
+            )
+
+    return pd.DataFrame(estimativa, index=series.index, columns=series.columns)
+
+
+def preencher_por_vizinhos(
+    series: pd.DataFrame, vizinhos: VizinhosPostos
+) -> pd.DataFrame:
+    """
+    Preenche as falhas dos postos com a estimativa dos vizinhos.
+
+    Apenas os valores observados dos vizinhos são utilizados, de forma que o
+    resultado não depende da ordem dos postos.
+
+    Parameters
+    ----------
+    series : pd.DataFrame
+        Séries observadas indexadas por data, com as colunas na ordem do grafo.
+
+    vizinhos : VizinhosPostos
+        Grafo de vizinhos (ver `obter_vizinhos`).
+
+    Returns
+    -------
+    pd.DataFrame
+        Séries preenchidas.
+    """
+    return series.fillna(estimar_por_vizinhos(series, vizinhos))
+
+
+def _correlacao(a: np.ndarray, b: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Correlação entre as colunas de duas matrizes nos dias com ambos os dados."""
+    comum = ~np.isnan(a) & ~np.isnan(b)
+    n = comum.sum(axis=0)
+    a, b = np.where(comum, a, 0), np.where(comum, b, 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        media_a, media_b = a.sum(axis=0) / n, b.sum(axis=0) / n
+        covariancia = (a * b).sum(axis=0) / n - media_a * media_b
+        variancia_a = (a * a).sum(axis=0) / n - media_a**2
+        variancia_b = (b * b).sum(axis=0) / n - media_b**2
+        return covariancia / np.sqrt(variancia_a * variancia_b), n
+
+
+def preferir_vizinhos(
+    observadas: pd.DataFrame,
+    corrigido: pd.DataFrame,
+    estimativa: pd.DataFrame,
+    correcao: CorrecaoQuantis,
+    min_amostras: int = min_amostras,
+) -> np.ndarray:
+    """
+    Indica os meses de cada posto em que os vizinhos estimam melhor que o satélite.
+
+    Em cada mês, a correlação diária com o posto observado é calculada para o
+    satélite corrigido e para a estimativa dos vizinhos. Os vizinhos são
+    preferidos quando a sua estimativa tem ao menos `min_amostras` dias de
+    comparação e correlação maior que a do satélite, ou quando o satélite não
+    tem correção no mês (menos de `min_amostras` dias para o ajuste).
+
+    Parameters
+    ----------
+    observadas : pd.DataFrame
+        Séries observadas indexadas por data, com uma coluna por posto.
+
+    corrigido : pd.DataFrame
+        Satélite corrigido, com o mesmo índice e as mesmas colunas.
+
+    estimativa : pd.DataFrame
+        Estimativa dos vizinhos (ver `estimar_por_vizinhos`), com o mesmo
+        índice e as mesmas colunas.
+
+    correcao : CorrecaoQuantis
+        Correção dos postos, na ordem das colunas.
+
+    min_amostras : int
+        Número mínimo de dias de comparação.
+
+    Returns
+    -------
+    np.ndarray
+        Matriz booleana (postos x 12), verdadeira nos meses em que os vizinhos
+        são preferidos.
+    """
+    meses = pd.to_datetime(observadas.index).month.to_numpy()
+    valores = observadas.to_numpy(dtype=np.float64)
+    satelite = corrigido.to_numpy(dtype=np.float64)
+    vizinhos = estimativa.to_numpy(dtype=np.float64)
+
+    preferir = np.zeros((valores.shape[1], 12), dtype=bool)
+    for mes in range(1, 13):
+        dias = meses == mes
+        correlacao_satelite, _ = _correlacao(valores[dias], satelite[dias])
+        correlacao_vizinhos, n = _correlacao(valores[dias], vizinhos[dias])
+        satelite_ruim = (correcao.n_amostras[:, mes - 1] < min_amostras) | ~(
+            correlacao_satelite >= correlacao_vizinhos
+        )
+        preferir[:, mes - 1] = (
+            (n >= min_amostras) & np.isfinite(correlacao_vizinhos) & satelite_ruim
+        )
+
+    return preferir
+
+
+def ler_comparacoes(
+    diretorio: Path = config.dir_merge_posto, bacia: Optional[str] = None
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Lê os arquivos de comparação entre posto e merge de um diretório.
+
+    Parameters
+    ----------
+    diretorio : Path
+        Diretório com um arquivo `<codigo>.csv` por posto, com as colunas do
+        posto, "merge" e "diferenca".
+
+    bacia : Optional[str]
+        Nome da bacia, cujos arquivos estão em `<diretorio>/<bacia>`, como os
+        salvos por `lote.extrair_satelite`.
+
+    Returns
+    -------
+    Tuple[pd.DataFrame, pd.DataFrame]
+        Séries dos postos e do merge, indexadas por data, com uma coluna por
+        posto.
+    """
+    if bacia is not None:
+        diretorio = diretorio.joinpath(bacia)
+
+    postos, satelite = dict(), dict()
+    for arquivo in sorted(diretorio.glob("*.csv")):
+        df = pd.read_csv(arquivo, index_col=0)
+        df.index = pd.to_datetime(df.index)
+        postos[arquivo.stem] = df[arquivo.stem]
+        satelite[arquivo.stem] = df["merge"]
+
+    return pd.DataFrame(postos), pd.DataFrame(satelite)
+
+
+def preencher_diretorio(
+    dir_comparacoes: Path = config.dir_merge_posto,
+    diretorio: Path = config.dir_final,
+    arquivo: Path = config.dir_correcao_merge,
+    reajustar: bool = False,
+    coordenadas: Optional[pd.DataFrame] = None,
+    arquivo_vizinhos: Path = config.dir_vizinhos,
+    bacia: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    Preenche as séries de todos os postos de um diretório de comparações.
+
+    Substitui o `combine_first` posto a posto do notebook 06. As falhas são
+    preenchidas pelo merge corrigido e as que restam (como as anteriores ao
+    início do merge) pelos postos vizinhos, exceto nos meses de cada posto em
+    que os vizinhos estimam melhor que o merge (ver `preferir_vizinhos`), em
+    que a ordem é invertida.
+
+    Parameters
+    ----------
+    dir_comparacoes : Path
+        Diretório das comparações entre posto e merge (ver `ler_comparacoes`).
+
+    diretorio : Path
+        Diretório de saída, com um arquivo `<codigo>.csv` por posto.
+
+    arquivo : Path
+        Arquivo npz da correção.
+
+    reajustar : bool
+        Caso seja desejado ajustar novamente a correção e o grafo de vizinhos
+        salvos.
+
+    coordenadas : Optional[pd.DataFrame]
+        Latitude e longitude de cada posto. Por padrão, as das tabelas
+        `coords_*.json` de `config.dir_prec_concat`.
+
+    arquivo_vizinhos : Path
+        Arquivo npz do grafo de vizinhos.
+
+    bacia : Optional[str]
+        Nome da bacia, para a estrutura por bacia de `lote`: as comparações
+        são lidas de `<dir_comparacoes>/<bacia>`, as séries são salvas em
+        `<diretorio>/<bacia>` e a correção e o grafo de vizinhos têm um
+        arquivo por bacia (`<arquivo>_<bacia>.npz`), já que a série de
+        satélite de um posto depende do recorte da bacia.
+
+    Returns
+    -------
+    pd.DataFrame
+        Séries preenchidas de todos os postos.
+    """
+    if bacia is not None:
+        diretorio = diretorio.joinpath(bacia)
+        diretorio.mkdir(parents=True, exist_ok=True)
+        arquivo = arquivo.with_name(f"{arquivo.stem}_{bacia}{arquivo.suffix}")
+        arquivo_vizinhos = arquivo_vizinhos.with_name(
+            f"{arquivo_vizinhos.stem}_{bacia}{arquivo_vizinhos.suffix}"
+        )
+
+    postos, satelite = ler_comparacoes(dir_comparacoes, bacia)
+    correcao = obter_correcao(postos, satelite, arquivo, reajustar)
+    indice = postos.index.union(satelite.index)
+    observadas = postos.reindex(indice)
+    corrigido = pd.DataFrame(
+        corrigir(
+            correcao,
+            satelite.reindex(index=indice, columns=postos.columns).to_numpy(float),
+            indice.month.to_numpy(),
+        ),
+        index=indice,
+        columns=postos.columns,
+    )
+
+    if coordenadas is None:
+        coordenadas = carregar_coordenadas(config.dir_prec_concat.glob("coords_*.json"))
+    vizinhos = obter_vizinhos(coordenadas, observadas, arquivo_vizinhos, reajustar)
+    estimativa = estimar_por_vizinhos(observadas, vizinhos)
+
+    preferir = preferir_vizinhos(observadas, corrigido, estimativa, correcao)
+    preferir = preferir[:, indice.month - 1].T
+    preenchidas = observadas.fillna(corrigido.where(~preferir, estimativa))
+    preenchidas = preenchidas.fillna(corrigido.where(preferir, estimativa))
+
+    exportar = preenchidas.set_axis(preenchidas.index.strftime("%Y-%m-%d"))
+    for codigo in exportar.columns:
+        exportar[codigo].to_csv(diretorio.joinpath(f"{codigo}.csv"))
+
+    return preenchidas
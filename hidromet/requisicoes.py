@@ -0,0 +1,144 @@
+"""Utilitários para requisições HTTP às APIs de dados hidrometeorológicos."""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
+from itertools import islice
+from typing import Any
+from typing import Callable
+from typing import Iterable
+from typing import Iterator
+from typing import Tuple
+from typing import Union
+
+import requests
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+# número máximo de requisições simultâneas por cliente
+max_conexoes = 8
+# número de tentativas em caso de falha de conexão ou erro do servidor
+n_tentativas = 5
+# fator de espera exponencial entre tentativas, em segundos
+backoff = 1.0
+# tempo limite de (conexão, leitura), em segundos
+timeout = (10, 300)
+
+
+def criar_sessao(
+    n_conexoes: int = max_conexoes,
+    tentativas: int = n_tentativas,
+    fator_backoff: float = backoff,
+) -> requests.Session:
+    """
+    Cria uma sessão HTTP com conexões persistentes e novas tentativas.
+
+    Parameters
+    ----------
+    n_conexoes : int
+        Tamanho do pool de conexões mantidas abertas por host.
+
+    tentativas : int
+        Número de novas tentativas em caso de falha.
+
+    fator_backoff : float
+        Fator de espera exponencial entre as tentativas, em segundos.
+
+    Returns
+    -------
+    requests.Session
+        Sessão configurada.
+    """
+    retry = Retry(
+        total=tentativas,
+        backoff_factor=fator_backoff,
+        status_forcelist=(429, 500, 502, 503, 504),
+    )
+    adaptador = HTTPAdapter(
+        pool_connections=n_conexoes, pool_maxsize=n_conexoes, max_retries=retry
+    )
+
+    sessao = requests.Session()
+    sessao.mount("http://", adaptador)
+    sessao.mount("https://", adaptador)
+
+    return sessao
+
+
+def executar_em_paralelo(
+    funcao: Callable[[Any], Any],
+    argumentos: Iterable[Any],
+    max_workers: int = max_conexoes,
+) -> Iterator[Tuple[Any, Union[Any, Exception]]]:
+    """
+    Executa uma função para cada argumento em um pool de threads.
+
+    Os resultados são entregues à medida que ficam prontos, e não na ordem dos
+    argumentos. Exceções não interrompem o lote: são retornadas no lugar do
+    resultado do argumento que falhou.
+
+    Parameters
+    ----------
+    funcao : Callable[[Any], Any]
+        Função a ser executada.
+
+    argumentos : Iterable[Any]
+        Argumentos da função, um por chamada.
+
+    max_workers : int
+        Número máximo de chamadas simultâneas.
+
+    Returns
+    -------
+    Iterator[Tuple[Any, Union[Any, Exception]]]
+        Pares (argumento, resultado ou exceção).
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futuros = {executor.submit(funcao, arg): arg for arg in argumentos}
+        for futuro in as_completed(futuros):
+            argumento = futuros[futuro]
+            try:
+                yield argumento, futuro.result()
+            except Exception as erro:
+                yield argumento, erro
+
+
+def executar_em_ordem(
+    funcao: Callable[[Any], Any],
+    argumentos: Iterable[Any],
+    max_workers: int = max_conexoes,
+) -> Iterator[Any]:
+    """
+    Executa uma função para cada argumento em um pool de threads, em ordem.
+
+    Os resultados são entregues na ordem dos argumentos e apenas `max_workers`
+    chamadas ficam adiantadas em relação ao consumo, de forma que a memória
+    ocupada pelos resultados pendentes é limitada. Exceções são propagadas.
+
+    Parameters
+    ----------
+    funcao : Callable[[Any], Any]
+        Função a ser executada.
+
+    argumentos : Iterable[Any]
+        Argumentos da função, um por chamada.
+
+    max_workers : int
+        Número máximo de chamadas simultâneas.
+
+    Returns
+    -------
+    Iterator[Any]
+        Resultados na ordem dos argumentos.
+    """
+    argumentos = iter(argumentos)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pendentes = deque(
+            executor.submit(funcao, arg) for arg in islice(argumentos, max_workers)
+        )
+        while pendentes:
+            resultado = pendentes.popleft().result()
+            for arg in islice(argumentos, 1):
+                pendentes.append(executor.submit(funcao, arg))
+            yield resultado
@@ -0,0 +1,68 @@
+"""Testes do processamento em lote das bacias."""
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+from shapely.geometry import box
+
+from hidromet import lote
+from hidromet.ANA import parsear_inventario
+
+
+def _inventario_xml(postos):
+    tabelas = "".join(
+        f"<Table><Codigo>{codigo}</Codigo><Nome>Posto {codigo}</Nome>"
+        f"<Latitude>{latitude}</Latitude><Longitude>{longitude}</Longitude>"
+        "<TipoEstacao>2</TipoEstacao></Table>"
+        for codigo, latitude, longitude in postos
+    )
+    return (
+        '<DataTable xmlns="http://MRCS/"><diffgr:diffgram '
+        'xmlns:diffgr="urn:schemas-microsoft-com:xml-diffgram-v1">'
+        f"<Documento>{tabelas}</Documento></diffgr:diffgram></DataTable>"
+    ).encode()
+
+
+class _ANAFalsa:
+    def __init__(self, postos, datas):
+        self.postos = postos
+        self.datas = datas
+        self.baixados = list()
+
+    def inventario(self, tipoest=""):
+        return parsear_inventario(_inventario_xml(self.postos), telemetrica=False)
+
+    def obter_chuvas(self, cod_estacoes, data_inicial="", max_workers=1):
+        for codigo in cod_estacoes:
+            self.baixados.append(codigo)
+            valores = np.random.default_rng(len(self.baixados)).gamma(
+                0.5, 8, len(self.datas)
+            )
+            yield codigo, pd.DataFrame({codigo: valores}, index=self.datas)
+
+
+def test_processar_ana(tmp_path):
+    bacias = gpd.GeoDataFrame(
+        {"bacia": ["Oeste", "Leste"]},
+        geometry=[box(-52, -27, -50, -25), box(-51, -27, -49, -25)],
+        crs="epsg:4326",
+    )
+    postos = [
+        ("2651000", -26.0, -51.5),
+        ("2650000", -26.0, -50.5),
+        ("2649000", -26.0, -49.5),
+        ("2000000", -20.0, -40.0),
+    ]
+    ana = _ANAFalsa(postos, pd.date_range("2000-01-01", "2010-12-31"))
+
+    info, erros = lote.processar_ana(bacias, ana=ana, diretorio=tmp_path)
+
+    assert not erros
+    # o posto na sobreposição é baixado uma única vez e o de fora, nenhuma
+    assert sorted(ana.baixados) == ["2649000", "2650000", "2651000"]
+    assert info["Oeste"].n_postos == 2
+    assert info["Leste"].n_postos == 2
+    for bacia in ("Oeste", "Leste"):
+        arquivo_bacia, arquivo_json = lote.arquivos_bacia(tmp_path, bacia)
+        assert arquivo_json.exists()
+        assert "2650000" in pd.read_csv(arquivo_bacia, index_col=0).columns
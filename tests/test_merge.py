@@ -0,0 +1,55 @@
+"""Testes da coleta do merge."""
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from hidromet import grade
+from hidromet import merge
+
+
+def _ler_grib_falso(arquivo_grib, remover_arquivo_grib=True, mascara=None):
+    data = pd.Timestamp(arquivo_grib.stem)
+    return xr.Dataset(
+        {"prec": ((grade.dim_tempo, "latitude", "longitude"), np.full((1, 2, 2), 1.0))},
+        coords={
+            grade.dim_tempo: [data],
+            "latitude": [0.0, 1.0],
+            "longitude": [0.0, 1.0],
+        },
+    )
+
+
+def test_falha_interrompe_o_cubo_sem_lacunas(tmp_path, monkeypatch):
+    falhas = {pd.Timestamp("2020-01-04")}
+
+    def obter_falso(data):
+        if data in falhas:
+            raise ConnectionError(data)
+        arquivo = tmp_path.joinpath(f"{data:%Y-%m-%d}.grib2")
+        arquivo.touch()
+        return arquivo
+
+    monkeypatch.setattr(merge, "obter", obter_falso)
+    monkeypatch.setattr(grade, "ler_grib", _ler_grib_falso)
+    cubo = tmp_path.joinpath("cubo.zarr")
+
+    resultados = merge.obter_periodo(
+        "2020-01-01", "2020-01-08", cubo=cubo, cubo_pixels=None, max_processos=1
+    )
+
+    assert grade.datas_no_cubo(cubo).equals(
+        pd.date_range("2020-01-01", "2020-01-03", name=grade.dim_tempo)
+    )
+    assert isinstance(resultados[pd.Timestamp("2020-01-04")], ConnectionError)
+    assert all(
+        isinstance(resultados[data], RuntimeError)
+        for data in pd.date_range("2020-01-05", "2020-01-08")
+    )
+
+    # a próxima execução continua a partir do dia que falhou
+    falhas.clear()
+    merge.obter_periodo(
+        "2020-01-01", "2020-01-08", cubo=cubo, cubo_pixels=None, max_processos=1
+    )
+    datas = grade.abrir_cubo(cubo).indexes[grade.dim_tempo]
+    assert datas.equals(pd.date_range("2020-01-01", "2020-01-08", name=grade.dim_tempo))
@@ -0,0 +1,23 @@
+"""Testes da detecção de outliers."""
+import numpy as np
+import pandas as pd
+
+from hidromet import outliers
+
+
+def test_dias_apos_o_ajuste_sem_reajustar():
+    rng = np.random.default_rng(0)
+    datas = pd.date_range("2000-01-01", "2010-12-31", freq="D")
+    chuva = np.where(rng.random(len(datas)) < 0.4, rng.gamma(0.8, 12, len(datas)), 0)
+    historico = datas.year < 2010
+
+    modelo = outliers.ajustar(chuva[historico], datas[historico])
+    no_ajuste = outliers.detectar(modelo, chuva[historico], datas[historico])
+    novos = outliers.detectar(modelo, chuva[~historico], datas[~historico])
+    # um dia de um ano posterior ao ajuste é avaliado como os do último ano
+    pontuacao = outliers.pontuar(
+        modelo, np.array([5.0, 5.0]), pd.DatetimeIndex(["2009-06-15", "2030-06-15"])
+    )
+
+    assert novos.mean() <= 2 * no_ajuste.mean() + 0.01
+    assert pontuacao[1] == pontuacao[0]